@@ -4,7 +4,10 @@ import typer
 from dotenv import load_dotenv
 from rich.console import Console
 
+from .core.costs import get_llm_backend
+from .core.git_async import cancel_git_work
 from .core.graph import create_git_assistant
+from .core.llm import warm_llm_client
 from .core.models import State
 from .ui.display import (
     display_nerd_stats,
@@ -30,13 +33,15 @@ def run():
     # env
     load_dotenv()
 
-    # setup
-    configure_api_key()
-    if not (os.getenv("OPENAI_API_KEY") or os.getenv("GOOGLE_API_KEY")):
-        typer.secho("error: no API key configured.", fg=typer.colors.RED)
-        raise typer.Exit(1)
+    # setup; replayed and stubbed sessions never reach a provider and need no key
+    if get_llm_backend() not in ("replay", "stub"):
+        configure_api_key()
+        if not (os.getenv("OPENAI_API_KEY") or os.getenv("GOOGLE_API_KEY")):
+            typer.secho("error: no API key configured.", fg=typer.colors.RED)
+            raise typer.Exit(1)
 
-    # ui
+    # ui; the llm connection is opened in the background meanwhile
+    warm_llm_client()
     welcome_screen()
 
     assistant = create_git_assistant()
@@ -86,6 +91,8 @@ def run():
                 display_nerd_stats()
 
         except KeyboardInterrupt:
+            # the status collection may be running on a graph worker thread
+            cancel_git_work()
             console.print("\n[warning]operation cancelled by user[/warning]\n")
             continue
         except Exception as e:
@@ -0,0 +1,224 @@
+import mmap
+import os
+import struct
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .git_backend import git_argv, probe_env
+from .repo_meta import find_git_dirs
+
+_GRAPH_HEADER = struct.Struct(">4sBBBB")
+_CHUNK_ENTRY = struct.Struct(">4sQ")
+_UINT32 = struct.Struct(">I")
+
+_CHUNK_FANOUT = b"OIDF"
+_CHUNK_LOOKUP = b"OIDL"
+_CHUNK_DATA = b"CDAT"
+
+
+# the number of commits we are willing to walk before answering "<limit>+"
+def _count_limit() -> int:
+    try:
+        return max(1, int(os.getenv("ASD_COMMIT_COUNT_LIMIT", "10000")))
+    except ValueError:
+        return 10000
+
+
+def _git(git_dir: str, args: List[str], timeout: float) -> Optional[str]:
+    try:
+        result = subprocess.run(
+            git_argv(["git", "--git-dir", git_dir, *args]),
+            capture_output=True,
+            close_fds=False,
+            text=True,
+            env=probe_env(),
+            timeout=timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+# the commit-graph files of a repository, either the single file or every file of a split chain
+def _graph_files(objects_dir: str) -> List[str]:
+    info = os.path.join(objects_dir, "info")
+    files = []
+    single = os.path.join(info, "commit-graph")
+    if os.path.isfile(single):
+        files.append(single)
+    try:
+        with open(os.path.join(info, "commit-graphs", "commit-graph-chain")) as f:
+            for line in f:
+                if line.strip():
+                    files.append(
+                        os.path.join(
+                            info, "commit-graphs", f"graph-{line.strip()}.graph"
+                        )
+                    )
+    except OSError:
+        pass
+    return files
+
+
+# the topological level git stored for a commit, None when the commit is not in this file
+# every commit below the tip adds at least one level, so the level is a lower bound for the count
+def _graph_generation(path: str, sha: str) -> Optional[int]:
+    try:
+        oid = bytes.fromhex(sha)
+    except ValueError:
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        signature, version, hash_version, num_chunks, _ = _GRAPH_HEADER.unpack_from(
+            data, 0
+        )
+        hash_size = 32 if hash_version == 2 else 20
+        if signature != b"CGPH" or version != 1 or hash_size != len(oid):
+            return None
+
+        chunks: Dict[bytes, int] = {}
+        for i in range(num_chunks):
+            chunk_id, offset = _CHUNK_ENTRY.unpack_from(
+                data, _GRAPH_HEADER.size + i * _CHUNK_ENTRY.size
+            )
+            chunks[chunk_id] = offset
+        if not all(c in chunks for c in (_CHUNK_FANOUT, _CHUNK_LOOKUP, _CHUNK_DATA)):
+            return None
+
+        # the fanout table gives the range of oids starting with our first byte
+        fanout = chunks[_CHUNK_FANOUT]
+        first = oid[0]
+        lo = _UINT32.unpack_from(data, fanout + 4 * (first - 1))[0] if first else 0
+        hi = _UINT32.unpack_from(data, fanout + 4 * first)[0]
+
+        lookup = chunks[_CHUNK_LOOKUP]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = lookup + mid * hash_size
+            candidate = data[start : start + hash_size]
+            if candidate == oid:
+                # tree oid, two parent positions, then the level in the top 30 bits
+                record = chunks[_CHUNK_DATA] + mid * (hash_size + 16)
+                level = _UINT32.unpack_from(data, record + hash_size + 8)[0] >> 2
+                return level or None
+            if candidate < oid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+    except struct.error:
+        return None
+    finally:
+        data.close()
+
+
+# counting the commits reachable from a tip without walking the whole history on every request
+# counts are cached per tip sha; when HEAD moves the new count is derived from the previous one
+# and the symmetric difference between the two tips, which is usually a handful of commits
+class CommitCounter:
+    def __init__(self, git_dir: str, common_dir: str, limit: int = 10000) -> None:
+        self.git_dir = git_dir
+        self.objects_dir = os.getenv("GIT_OBJECT_DIRECTORY") or os.path.join(
+            common_dir, "objects"
+        )
+        self.limit = limit
+        # sha -> (count, capped); a capped count is a lower bound
+        self._counts: Dict[str, Tuple[int, bool]] = {}
+        self._last: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def generation(self, sha: str) -> Optional[int]:
+        for path in _graph_files(self.objects_dir):
+            level = _graph_generation(path, sha)
+            if level is not None:
+                return level
+        return None
+
+    # count(old) + commits only in new - commits only in old, exact for any pair of tips
+    def _incremental(self, sha: str, timeout: float) -> Optional[Tuple[int, bool]]:
+        if self._last is None or self._last == sha:
+            return None
+        old_count, old_capped = self._counts[self._last]
+        output = _git(
+            self.git_dir,
+            ["rev-list", "--left-right", "--count", f"{self._last}...{sha}"],
+            timeout,
+        )
+        try:
+            only_old, only_new = (int(n) for n in (output or "").split())
+        except ValueError:
+            return None
+        if old_capped:
+            # a lower bound only carries over when nothing was dropped from it
+            return (old_count + only_new, True) if only_old == 0 else None
+        return old_count + only_new - only_old, False
+
+    # walks at most limit + 1 commits, so the answer is either exact or "<limit>+"
+    def _bounded(self, sha: str, timeout: float) -> Optional[Tuple[int, bool]]:
+        output = _git(
+            self.git_dir,
+            ["rev-list", "--count", f"--max-count={self.limit + 1}", sha],
+            timeout,
+        )
+        try:
+            count = int(output or "")
+        except ValueError:
+            return None
+        if count > self.limit:
+            return self.limit, True
+        return count, False
+
+    # (count, capped) for a commit sha; (0, False) when it cannot be counted
+    def count(self, sha: str, timeout: float = 10) -> Tuple[int, bool]:
+        with self._lock:
+            cached = self._counts.get(sha)
+            if cached is not None:
+                return cached
+
+            result = self._incremental(sha, timeout)
+            if result is None:
+                # a tip whose level is already past the limit has at least that many commits
+                level = self.generation(sha)
+                if level is not None and level > self.limit:
+                    result = (level, True)
+                else:
+                    result = self._bounded(sha, timeout)
+            if result is None:
+                return 0, False
+
+            # a long session visits few tips, but keep the cache from growing without bound
+            if len(self._counts) >= 256:
+                last = self._counts.get(self._last) if self._last else None
+                self._counts.clear()
+                if last is not None:
+                    self._counts[self._last] = last
+            self._counts[sha] = result
+            self._last = sha
+            return result
+
+
+_counters: Dict[str, CommitCounter] = {}
+_counters_lock = threading.Lock()
+
+
+# (count, capped) for the commits reachable from sha in the repository around the working directory
+def count_commits(sha: Optional[str], timeout: float = 10) -> Tuple[int, bool]:
+    if not sha:
+        return 0, False
+    dirs = find_git_dirs()
+    if dirs is None:
+        return 0, False
+    git_dir, common_dir = dirs
+    limit = _count_limit()
+    with _counters_lock:
+        counter = _counters.get(common_dir)
+        if counter is None or counter.limit != limit:
+            counter = CommitCounter(git_dir, common_dir, limit)
+            _counters[common_dir] = counter
+    return counter.count(sha, timeout)
@@ -0,0 +1,146 @@
+import logging
+import os
+import shlex
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from .git_backend import probe_env
+from .git_tools import generate_commit_message, run_git_command
+from .models import ExecutionPlan
+from .staged_diff import get_commit_diff
+
+logger = logging.getLogger(__name__)
+
+# one worker is enough, there is at most one commit message in flight per plan
+_executor: Optional[ThreadPoolExecutor] = None
+_pending: Optional[Tuple[str, "Future[Optional[Tuple[str, str]]]"]] = None
+_lock = threading.Lock()
+
+
+# a commit step the executor fills in with a generated message
+def is_bare_commit(command: str) -> bool:
+    return command.startswith("git commit") and "-m" not in command
+
+
+# subcommands that change what the index holds, so a commit after them would not commit
+# the tree staged while the plan is reviewed
+_INDEX_SUBCOMMANDS = frozenset(
+    (
+        "add",
+        "am",
+        "apply",
+        "checkout",
+        "cherry-pick",
+        "merge",
+        "mv",
+        "pull",
+        "read-tree",
+        "rebase",
+        "reset",
+        "revert",
+        "rm",
+        "stage",
+        "stash",
+        "switch",
+        "update-index",
+    )
+)
+
+
+def _changes_index(command: str) -> bool:
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return True
+    if len(argv) < 2 or argv[0] != "git":
+        return False
+    if argv[1] == "restore":
+        return "--staged" in argv or "-S" in argv
+    return argv[1] in _INDEX_SUBCOMMANDS
+
+
+# a bare commit the staged changes can be summarised for ahead of time: one no earlier
+# step of the plan stages, unstages or otherwise rewrites the index for
+def _precomputable(plan: ExecutionPlan) -> bool:
+    for step in plan.steps:
+        if is_bare_commit(step.command):
+            return True
+        if _changes_index(step.command):
+            return False
+    return False
+
+
+# the id of the tree the index would commit, None when it cannot be written (conflicts,
+# not a repository); the same id means the same staged content
+def staged_tree_id() -> Optional[str]:
+    result = run_git_command(
+        ["git", "write-tree"], suppress_errors=True, env=probe_env(), timeout=10
+    )
+    if not result["success"]:
+        return None
+    return result["stdout"].strip() or None
+
+
+def _generate() -> Optional[Tuple[str, str]]:
+    diff = get_commit_diff()
+    if not diff:
+        return None
+    return generate_commit_message(diff)
+
+
+# starting the commit message for the staged changes while the plan is reviewed, when the
+# plan has a bare git commit step the earlier steps do not restage for
+# (ASD_COMMIT_PRECOMPUTE=0 disables it)
+def start_commit_precompute(plan: Optional[ExecutionPlan]) -> bool:
+    global _executor, _pending
+    if os.getenv("ASD_COMMIT_PRECOMPUTE", "1").strip().lower() in (
+        "0",
+        "false",
+        "no",
+        "off",
+    ):
+        return False
+    if plan is None or not _precomputable(plan):
+        return False
+    tree = staged_tree_id()
+    if tree is None:
+        return False
+    with _lock:
+        if _pending is not None and _pending[0] == tree:
+            return True
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="asd-commit-message"
+            )
+        _pending = (tree, _executor.submit(_generate))
+    return True
+
+
+# the precomputed message and explanation when the index still holds the tree it was
+# generated for; anything else is dropped and the caller generates a fresh one
+def take_precomputed_message() -> Optional[Tuple[str, str]]:
+    global _pending
+    with _lock:
+        pending, _pending = _pending, None
+    if pending is None:
+        return None
+    tree, future = pending
+    if staged_tree_id() != tree:
+        future.cancel()
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        # the worker's failure is not the commit's, the executor just asks again
+        logger.info("precomputed commit message failed: %s", e)
+        return None
+
+
+# dropping any message in flight, e.g. when a new request starts
+def discard_precomputed_message() -> None:
+    global _pending
+    with _lock:
+        pending, _pending = _pending, None
+    if pending is not None:
+        pending[1].cancel()
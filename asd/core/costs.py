@@ -1,5 +1,6 @@
 import json
 import os
+import threading
 from typing import Any, Dict, List, Optional, Tuple
 
 from langchain_core.callbacks import BaseCallbackHandler
@@ -21,13 +22,36 @@ def _model_key(provider: str, model: str) -> str:
     return f"{p}:{m}"
 
 
+def provider_model(provider: str) -> str:
+    if provider == "google":
+        return os.getenv("GOOGLE_MODEL", "gemini-2.5-flash")
+    return os.getenv("OPENAI_MODEL", "o4-mini")
+
+
+def provider_api_key(provider: str) -> Optional[str]:
+    return os.getenv("GOOGLE_API_KEY" if provider == "google" else "OPENAI_API_KEY")
+
+
+# where structured llm responses come from (ASD_LLM_BACKEND):
+# live calls the provider, record calls it and saves every response as a cassette,
+# replay answers from the cassettes only and stub answers with fixed responses, no network
+LLM_BACKENDS = ("live", "record", "replay", "stub")
+
+
+def get_llm_backend() -> str:
+    backend = os.getenv("ASD_LLM_BACKEND", "live").strip().lower()
+    return backend if backend in LLM_BACKENDS else "live"
+
+
+# the provider chosen with ASD_PROVIDER (set by the model menu) when its key is there,
+# otherwise google when it has a key, then openai
 def get_active_model_provider() -> Tuple[str, str]:
+    chosen = os.getenv("ASD_PROVIDER", "").strip().lower()
+    if chosen in ("openai", "google") and provider_api_key(chosen):
+        return chosen, provider_model(chosen)
     if os.getenv("GOOGLE_API_KEY"):
-        return (
-            "google",
-            os.getenv("GOOGLE_MODEL", "gemini-2.5-flash"),
-        )
-    return ("openai", os.getenv("OPENAI_MODEL", "o4-mini"))
+        return "google", provider_model("google")
+    return "openai", provider_model("openai")
 
 
 # NOTE:
@@ -35,24 +59,28 @@ def get_active_model_provider() -> Tuple[str, str]:
 # - gpt-4.1 rates are consistent across current guides ($2/$8 and $0.40/$1.60).
 # - o4-mini from OpenAI community + OpenRouter.
 # - gemini 2.5 pro is tiered based on prompt size per official coverage (annoying)
+# - cached_in is the rate for input tokens served from the provider's prompt cache
+#   (openai: automatic for prefixes over 1024 tokens; gemini 2.5: implicit caching, 75% off)
+#   models without it are charged the full input rate
 DEFAULT_PRICING: Dict[str, Dict[str, Any]] = {
     "openai": {
-        "gpt-4o": {"in": 2.50, "out": 10.00},
-        "gpt-4o-mini": {"in": 0.15, "out": 0.60},
-        "gpt-4.1": {"in": 2.00, "out": 8.00},
-        "gpt-4.1-mini": {"in": 0.40, "out": 1.60},
-        "o4-mini": {"in": 1.10, "out": 4.40},
+        "gpt-4o": {"in": 2.50, "cached_in": 1.25, "out": 10.00},
+        "gpt-4o-mini": {"in": 0.15, "cached_in": 0.075, "out": 0.60},
+        "gpt-4.1": {"in": 2.00, "cached_in": 0.50, "out": 8.00},
+        "gpt-4.1-mini": {"in": 0.40, "cached_in": 0.10, "out": 1.60},
+        "o4-mini": {"in": 1.10, "cached_in": 0.275, "out": 4.40},
     },
     "google": {
         "gemini-2.5-pro": {
             "tiered": True,
             "tiers": {
                 "in": [(200_000, 1.25), (None, 2.50)],
+                "cached_in": [(200_000, 0.31), (None, 0.625)],
                 "out": [(200_000, 10.00), (None, 15.00)],
             },
         },
-        "gemini-2.5-flash": {"in": 0.35, "out": 1.05},
-        "gemini-2.0-flash": {"in": 0.35, "out": 1.05},
+        "gemini-2.5-flash": {"in": 0.35, "cached_in": 0.0875, "out": 1.05},
+        "gemini-2.0-flash": {"in": 0.35, "cached_in": 0.0875, "out": 1.05},
     },
 }
 
@@ -132,19 +160,41 @@ def get_rates(
     return spec["in"], spec["out"]
 
 
+# the rate for cached input tokens, the full input rate when the model has none
+def get_cached_rate(
+    provider: str,
+    model: str,
+    prompt_tokens: Optional[int] = None,
+) -> Optional[float]:
+    _, spec = _match_model(provider, model)
+    if not spec:
+        return None
+    if spec.get("tiered"):
+        pairs = spec["tiers"].get("cached_in") or spec["tiers"]["in"]
+        return _pick_tier(pairs, prompt_tokens)
+    return spec.get("cached_in", spec["in"])
+
+
+# cached_tokens are part of prompt_tokens (both providers count them there) and priced at
+# the cached rate instead of the input rate
 def compute_cost_usd(
     provider: str,
     model: str,
     prompt_tokens: int,
     completion_tokens: int,
+    cached_tokens: int = 0,
 ) -> Optional[float]:
     rates = get_rates(provider, model, prompt_tokens)
     if not rates:
         return None
     in_per_m, out_per_m = rates
-    return prompt_tokens * _rate_per_token_per_million(
-        in_per_m
-    ) + completion_tokens * _rate_per_token_per_million(out_per_m)
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    cached_per_m = get_cached_rate(provider, model, prompt_tokens)
+    return (
+        (prompt_tokens - cached_tokens) * _rate_per_token_per_million(in_per_m)
+        + cached_tokens * _rate_per_token_per_million(cached_per_m)
+        + completion_tokens * _rate_per_token_per_million(out_per_m)
+    )
 
 
 # this class is a tracker for the usage of the model
@@ -153,6 +203,8 @@ class TokenTracker:
         self.calls: List[Dict[str, Any]] = []
         self.totals: Dict[str, Dict[str, Any]] = {}
         self.last: Optional[Dict[str, Any]] = None
+        # chunked commit messages record usage from several threads at once
+        self._lock = threading.Lock()
 
     def record(
         self,
@@ -161,20 +213,49 @@ class TokenTracker:
         prompt_tokens: int,
         completion_tokens: int,
         cost: Optional[float],
+        cached_tokens: int = 0,
+        saved: float = 0.0,
     ) -> None:
         key = _model_key(provider, model)
+        with self._lock:
+            self._record(
+                key,
+                provider,
+                model,
+                prompt_tokens,
+                completion_tokens,
+                cost,
+                cached_tokens,
+                saved,
+            )
+
+    def _record(
+        self,
+        key: str,
+        provider: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cost: Optional[float],
+        cached_tokens: int,
+        saved: float,
+    ) -> None:
         if key not in self.totals:
             self.totals[key] = {
                 "provider": provider,
                 "model": model,
                 "prompt_tokens": 0,
+                "cached_tokens": 0,
                 "completion_tokens": 0,
                 "cost": 0.0,
+                "saved": 0.0,
                 "calls": 0,
             }
         t = self.totals[key]
         t["prompt_tokens"] += prompt_tokens
+        t["cached_tokens"] += cached_tokens
         t["completion_tokens"] += completion_tokens
+        t["saved"] += saved
         t["calls"] += 1
         if cost is not None:
             t["cost"] += cost
@@ -183,6 +264,7 @@ class TokenTracker:
             "provider": provider,
             "model": model,
             "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
             "completion_tokens": completion_tokens,
             "cost": cost,
         }
@@ -192,14 +274,18 @@ class TokenTracker:
     def grand_totals(self) -> Dict[str, Any]:
         gt = {
             "prompt_tokens": 0,
+            "cached_tokens": 0,
             "completion_tokens": 0,
             "cost": 0.0,
+            "saved": 0.0,
             "calls": 0,
         }
         for v in self.totals.values():
             gt["prompt_tokens"] += v["prompt_tokens"]
+            gt["cached_tokens"] += v["cached_tokens"]
             gt["completion_tokens"] += v["completion_tokens"]
             gt["cost"] += v["cost"]
+            gt["saved"] += v["saved"]
             gt["calls"] += v["calls"]
         return gt
 
@@ -210,8 +296,16 @@ tracker = TokenTracker()
 def record_usage(provider: str, model: str, usage: Dict[str, int]) -> None:
     prompt_tokens = int(usage.get("prompt_tokens", 0))
     completion_tokens = int(usage.get("completion_tokens", 0))
-    cost = compute_cost_usd(provider, model, prompt_tokens, completion_tokens)
-    tracker.record(provider, model, prompt_tokens, completion_tokens, cost)
+    cached_tokens = int(usage.get("cached_tokens", 0))
+    cost = compute_cost_usd(
+        provider, model, prompt_tokens, completion_tokens, cached_tokens
+    )
+    # what the cache took off the bill, against the same call at the full input rate
+    full = compute_cost_usd(provider, model, prompt_tokens, completion_tokens)
+    saved = full - cost if cost is not None and full is not None else 0.0
+    tracker.record(
+        provider, model, prompt_tokens, completion_tokens, cost, cached_tokens, saved
+    )
 
 
 def session_usage_snapshot() -> Dict[str, Any]:
@@ -224,14 +318,55 @@ def session_usage_snapshot() -> Dict[str, Any]:
                 "model": v["model"],
                 "calls": v["calls"],
                 "prompt_tokens": v["prompt_tokens"],
+                "cached_tokens": v["cached_tokens"],
                 "completion_tokens": v["completion_tokens"],
                 "cost": float(v["cost"]),
+                "saved": float(v["saved"]),
             }
         )
     grand = tracker.grand_totals()
     return {"models": models, "grand": grand}
 
 
+# time to plan per planning mode ("separate" or "fused"), so both can be compared in a session
+_plan_timings: Dict[str, List[float]] = {}
+_plan_timings_lock = threading.Lock()
+
+
+def record_plan_latency(mode: str, seconds: float) -> None:
+    with _plan_timings_lock:
+        _plan_timings.setdefault(mode, []).append(seconds)
+
+
+def plan_latency_snapshot() -> Dict[str, Dict[str, float]]:
+    with _plan_timings_lock:
+        return {
+            mode: {
+                "runs": len(times),
+                "avg": sum(times) / len(times),
+                "last": times[-1],
+            }
+            for mode, times in _plan_timings.items()
+            if times
+        }
+
+
+# input tokens served from the provider's prompt cache, in whichever usage format it reports
+# (openai prompt_tokens_details, langchain input_token_details, gemini usage metadata)
+def _cached_tokens(usage: Dict[str, Any]) -> int:
+    details = usage.get("prompt_tokens_details") or {}
+    if isinstance(details, dict) and details.get("cached_tokens"):
+        return int(details["cached_tokens"])
+    details = usage.get("input_token_details") or {}
+    if isinstance(details, dict) and details.get("cache_read"):
+        return int(details["cache_read"])
+    return int(
+        usage.get("cached_content_token_count")
+        or usage.get("cachedContentTokenCount")
+        or 0
+    )
+
+
 # this class is a callback handler for the usage of the model
 class UsageCallback(BaseCallbackHandler):
     def __init__(self, provider: str, model: str) -> None:
@@ -249,8 +384,15 @@ class UsageCallback(BaseCallbackHandler):
 
     # TODO: add better token estimation
     def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = self.parse_usage(response)
+        if usage["prompt_tokens"] > 0 or usage["completion_tokens"] > 0:
+            record_usage(self.provider, self.model, usage)
+
+    # the token counts of a response in any of the provider formats, estimated when absent
+    def parse_usage(self, response: LLMResult) -> Dict[str, int]:
         prompt = 0
         completion = 0
+        cached = 0
 
         # 1) check response.llm_output for usage
         if response.llm_output and isinstance(response.llm_output, dict):
@@ -261,6 +403,7 @@ class UsageCallback(BaseCallbackHandler):
             if isinstance(tu, dict):
                 prompt = int(tu.get("prompt_tokens") or 0)
                 completion = int(tu.get("completion_tokens") or 0)
+                cached = _cached_tokens(tu)
 
             # google format in llm_output
             um = response.llm_output.get("usage_metadata") or response.llm_output.get(
@@ -269,6 +412,7 @@ class UsageCallback(BaseCallbackHandler):
             if isinstance(um, dict):
                 prompt = int(um.get("prompt_token_count") or 0)
                 completion = int(um.get("candidates_token_count") or 0)
+                cached = _cached_tokens(um)
 
         # 2) check generations for usage metadata
         if prompt == 0 and completion == 0 and response.generations:
@@ -290,6 +434,7 @@ class UsageCallback(BaseCallbackHandler):
                                     or um.get("candidates_token_count")
                                     or 0
                                 )
+                                cached += _cached_tokens(um)
 
                         # check response_metadata
                         if (
@@ -302,6 +447,7 @@ class UsageCallback(BaseCallbackHandler):
                             if isinstance(tu, dict):
                                 prompt += int(tu.get("prompt_tokens") or 0)
                                 completion += int(tu.get("completion_tokens") or 0)
+                                cached += _cached_tokens(tu)
                             um = meta.get("usage_metadata") or meta.get("usageMetadata")
                             if isinstance(um, dict):
                                 prompt += int(
@@ -314,6 +460,7 @@ class UsageCallback(BaseCallbackHandler):
                                     or um.get("candidates_token_count")
                                     or 0
                                 )
+                                cached += _cached_tokens(um)
             except Exception as e:
                 print(f"DEBUG: Exception parsing generations: {e}")
 
@@ -352,13 +499,8 @@ class UsageCallback(BaseCallbackHandler):
                     completion = 200  # typical plan response
 
         print(f"DEBUG: Final token counts - prompt:{prompt}, completion:{completion}")
-
-        if prompt > 0 or completion > 0:
-            record_usage(
-                self.provider,
-                self.model,
-                {
-                    "prompt_tokens": prompt,
-                    "completion_tokens": completion,
-                },
-            )
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "cached_tokens": cached,
+        }
@@ -1,3 +1,5 @@
+import shlex
+
 from rich.prompt import Confirm
 
 from ..ui.display import (
@@ -6,15 +8,20 @@ from ..ui.display import (
 )
 from ..ui.loader import stop_loader
 from ..ui.prompts import confirm_step_execution
+from .commit_precompute import (
+    discard_precomputed_message,
+    is_bare_commit,
+    take_precomputed_message,
+)
+from .git_async import load_git_status
 from .git_tools import (
     check_git_prerequisites,
     generate_commit_message,
-    get_git_diff_analysis,
-    get_git_status,
     run_git_command,
 )
 from .models import State, StepResult
 from .planner import generate_recovery_plan
+from .staged_diff import get_commit_diff
 
 
 # lowercase comments as requested
@@ -63,18 +70,26 @@ def execute_plan(state: State) -> State:
                 break
             continue
 
-        if final_command.startswith("git commit") and "-m" not in final_command:
-            diff = get_git_diff_analysis()
-            if not diff:
-                console.print("[warning]> nothing staged[/warning]")
-                continue
-
-            commit_msg, explanation = generate_commit_message(diff)
-            final_command = f'git commit -m "{commit_msg}"'
+        if is_bare_commit(final_command):
+            # generated while the plan was reviewed, as long as the index is unchanged
+            precomputed = take_precomputed_message()
+            if precomputed is not None:
+                commit_msg, explanation = precomputed
+            else:
+                diff = get_commit_diff()
+                if not diff:
+                    console.print("[warning]> nothing staged[/warning]")
+                    continue
+                commit_msg, explanation = generate_commit_message(diff)
+            # argv keeps quotes and $ in the generated message literal
+            command_argv = ["git", "commit", "-m", commit_msg]
+            final_command = shlex.join(command_argv)
             console.print(f"[info]> generated: {commit_msg}[/info]")
+        else:
+            command_argv = final_command
 
         console.print(f"[info]> executing: {final_command}[/info]")
-        result = run_git_command(final_command)
+        result = run_git_command(command_argv)
 
         educational_note = step.educational_note
         safety_note = ""
@@ -108,7 +123,7 @@ def execute_plan(state: State) -> State:
 
         if not result["success"]:
             console.print("[loading] analyzing failure...[/loading]")
-            fresh_git_status = get_git_status()
+            fresh_git_status = load_git_status()
             completed_successful_steps = [r for r in state.step_results if r.success]
             recovery_plan = generate_recovery_plan(
                 state, step_result, fresh_git_status, completed_successful_steps
@@ -128,6 +143,7 @@ def execute_plan(state: State) -> State:
                 all_success = False
                 break
 
+    discard_precomputed_message()
     state.operation_complete = True
     state.operation_success = all_success
     state.final_message = (
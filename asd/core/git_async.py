@@ -0,0 +1,297 @@
+import asyncio
+import os
+import signal
+import threading
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional, Tuple, TypeVar
+
+from .commit_count import count_commits
+from .git_backend import _git_workers, probe_env
+from .git_tools import (
+    GitCommand,
+    _argv,
+    _get_git_status_legacy,
+    _last_commit_subject,
+    _PorcelainV2Parser,
+    _probe_timeout,
+    _remote_names,
+    _status_sample_limit,
+    _untracked_mode,
+    get_git_status,
+)
+from .models import GitStatus
+from .repo_meta import find_git_dirs, get_repo_metadata
+
+T = TypeVar("T")
+
+# one semaphore per event loop, a semaphore cannot be shared between loops
+_semaphores: Dict[int, asyncio.Semaphore] = {}
+
+
+# how many git processes the async layer runs at once, the same limit as the backend's pool
+def _semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(id(loop))
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(_git_workers())
+        _semaphores.clear()
+        _semaphores[id(loop)] = semaphore
+    return semaphore
+
+
+# git runs in its own process group so a cancelled task can take down git and its helpers
+async def _spawn(
+    cmd: GitCommand, env: Optional[Dict[str, str]], stderr: int
+) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(
+        *_argv(cmd),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=stderr,
+        env=env,
+        start_new_session=True,
+    )
+
+
+async def _kill_group(proc: asyncio.subprocess.Process) -> None:
+    if proc.returncode is None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    # reap the child even while the surrounding task is being cancelled
+    await asyncio.shield(proc.wait())
+
+
+# the async counterpart of run_git_command, with the same dict result
+# the timeout applies per call; cancelling the awaiting task kills the git process group
+async def run_git_command_async(
+    cmd: GitCommand,
+    suppress_errors: bool = False,
+    env: Optional[Dict[str, str]] = None,
+    timeout: float = 30,
+) -> Dict[str, Any]:
+    async with _semaphore():
+        try:
+            proc = await _spawn(cmd, env, asyncio.subprocess.PIPE)
+        except (OSError, ValueError) as e:
+            return {
+                "success": False,
+                "stdout": "",
+                "stderr": "" if suppress_errors else str(e),
+                "returncode": -1,
+            }
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            await _kill_group(proc)
+            return {
+                "success": False,
+                "stdout": "",
+                "stderr": "command timed out",
+                "returncode": -1,
+            }
+        except BaseException:
+            await _kill_group(proc)
+            raise
+        return {
+            "success": proc.returncode == 0,
+            "stdout": stdout.decode("utf-8", errors="replace").strip(),
+            "stderr": stderr.decode("utf-8", errors="replace").strip(),
+            "returncode": proc.returncode,
+        }
+
+
+# the async counterpart of GitStream: raw bytes records as git writes them
+# the exit code is stored in result["returncode"] once the generator finishes
+async def stream_git_command_async(
+    cmd: GitCommand,
+    delimiter: bytes = b"\0",
+    env: Optional[Dict[str, str]] = None,
+    timeout: float = 30,
+    result: Optional[Dict[str, int]] = None,
+    skip_empty: bool = True,
+) -> AsyncIterator[bytes]:
+    result = result if result is not None else {}
+    result["returncode"] = -1
+    async with _semaphore():
+        try:
+            proc = await _spawn(cmd, env, asyncio.subprocess.DEVNULL)
+        except (OSError, ValueError):
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            pending = bytearray()
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                chunk = await asyncio.wait_for(proc.stdout.read(65536), remaining)
+                if not chunk:
+                    break
+                pending += chunk
+                start = 0
+                end = pending.find(delimiter)
+                while end != -1:
+                    if end > start or not skip_empty:
+                        yield bytes(pending[start:end])
+                    start = end + 1
+                    end = pending.find(delimiter, start)
+                del pending[:start]
+            if pending:
+                yield bytes(pending)
+            result["returncode"] = await proc.wait()
+        except asyncio.TimeoutError:
+            await _kill_group(proc)
+        except BaseException:
+            # cancelled, or the consumer stopped early
+            await _kill_group(proc)
+            raise
+
+
+async def _porcelain_v2_fields(
+    env: Optional[Dict[str, str]], sample_limit: int
+) -> Optional[Dict[str, Any]]:
+    parser = _PorcelainV2Parser(sample_limit)
+    result: Dict[str, int] = {}
+    records = stream_git_command_async(
+        [
+            "git",
+            "status",
+            "--porcelain=v2",
+            "--branch",
+            "--show-stash",
+            "-z",
+            f"--untracked-files={_untracked_mode()}",
+        ],
+        env=env,
+        result=result,
+    )
+    async for record in records:
+        parser.feed(record.decode("utf-8", errors="replace"))
+    return parser.fields if result["returncode"] == 0 else None
+
+
+# the async counterpart of the porcelain v2 status collection
+# the status probe and the remote probe run as cancellable subprocesses; the commit count and the
+# last commit subject come from the session caches and the cat-file helper
+async def get_git_status_async() -> GitStatus:
+    if find_git_dirs() is None:
+        return GitStatus(is_repo=False)
+
+    aux_timeout = _probe_timeout()
+    meta = get_repo_metadata()
+    status_task = asyncio.ensure_future(
+        _porcelain_v2_fields(probe_env(), _status_sample_limit())
+    )
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        if meta is None:
+            results["remote"] = await run_git_command_async(
+                ["git", "remote"], True, probe_env(), aux_timeout
+            )
+        fields = await status_task
+    finally:
+        if not status_task.done():
+            status_task.cancel()
+    if fields is None:
+        return await asyncio.to_thread(_get_git_status_legacy)
+
+    total_commits, commits_capped = 0, False
+    last_commit_message = ""
+    if fields["head_oid"]:
+        total_commits, commits_capped = await asyncio.to_thread(
+            count_commits, fields["head_oid"], aux_timeout
+        )
+        last_commit_message = await asyncio.to_thread(_last_commit_subject)
+
+    remotes = _remote_names(results, meta)
+    return GitStatus(
+        is_repo=True,
+        current_branch=fields["current_branch"],
+        staged=fields["staged"],
+        modified=fields["modified"],
+        untracked=fields["untracked"],
+        staged_count=fields["staged_count"],
+        modified_count=fields["modified_count"],
+        untracked_count=fields["untracked_count"],
+        paths_truncated=fields["paths_truncated"],
+        ahead=fields["ahead"],
+        behind=fields["behind"],
+        conflicts=fields["conflicts"],
+        total_commits=total_commits,
+        total_commits_capped=commits_capped,
+        uncommitted_changes=fields["staged_count"] + fields["modified_count"],
+        has_remote=bool(remotes),
+        remote_name=remotes[0] if remotes else "",
+        last_commit_hash=fields["head_oid"][:8],  # short hash
+        last_commit_message=last_commit_message,
+        stash_count=fields["stash_count"],
+    )
+
+
+# the async counterpart of get_git_diff_analysis
+async def get_git_diff_analysis_async() -> Optional[str]:
+    result: Dict[str, int] = {}
+    lines = [
+        line
+        async for line in stream_git_command_async(
+            ["git", "diff", "--staged"],
+            delimiter=b"\n",
+            result=result,
+            skip_empty=False,
+        )
+    ]
+    if result["returncode"] != 0 or not lines:
+        return None
+    return b"\n".join(lines).decode("utf-8", errors="replace").strip() or None
+
+
+# loops running git on threads other than the main one, ctrl-c never reaches those
+_worker_runs: Dict[int, Tuple[asyncio.AbstractEventLoop, "asyncio.Task[Any]"]] = {}
+_worker_lock = threading.Lock()
+
+
+async def _registered(coro: Awaitable[T]) -> T:
+    task = asyncio.current_task()
+    with _worker_lock:
+        _worker_runs[id(task)] = (asyncio.get_running_loop(), task)
+    try:
+        return await coro
+    finally:
+        with _worker_lock:
+            _worker_runs.pop(id(task), None)
+
+
+# running a coroutine to completion from synchronous code
+# ctrl-c cancels it, which kills any git it started, and then surfaces as KeyboardInterrupt;
+# off the main thread the run is registered so cancel_git_work can stop it instead
+def run_interruptible(coro: Awaitable[T]) -> T:
+    if threading.current_thread() is threading.main_thread():
+        return asyncio.run(coro)
+    return asyncio.run(_registered(coro))
+
+
+# cancelling the git work running on other threads, called by the main thread on ctrl-c;
+# each run is cancelled inside its own loop, which kills the git process groups it started
+def cancel_git_work() -> None:
+    with _worker_lock:
+        runs = list(_worker_runs.values())
+    for loop, task in runs:
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # the loop closed in the meantime
+            pass
+
+
+# status for synchronous callers: the cancellable async path for the default mode when no event
+# loop is running in this thread, the regular collection otherwise
+def load_git_status() -> GitStatus:
+    mode = os.getenv("ASD_STATUS_MODE", "porcelain-v2").strip().lower()
+    if mode not in ("", "porcelain-v2"):
+        return get_git_status(mode)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return run_interruptible(get_git_status_async())
+    return get_git_status(mode)
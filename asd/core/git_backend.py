@@ -0,0 +1,228 @@
+import atexit
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_probe_env: Optional[Dict[str, str]] = None
+_git_path: Optional[str] = None
+
+
+# environment for read-only probes, prepared once and shared by every probe (never mutate it)
+# GIT_OPTIONAL_LOCKS=0 stops git from refreshing the index, so we never race an ide for index.lock
+def probe_env() -> Dict[str, str]:
+    global _probe_env
+    if _probe_env is None:
+        _probe_env = {**os.environ, "GIT_OPTIONAL_LOCKS": "0"}
+    return _probe_env
+
+
+# argv with git replaced by its absolute path
+# subprocess only takes the posix_spawn fast path for an executable with a directory part,
+# so resolving git once up front saves a PATH search and a fork per command
+def git_argv(argv: List[str]) -> List[str]:
+    global _git_path
+    if not argv or argv[0] != "git":
+        return argv
+    if _git_path is None:
+        _git_path = shutil.which("git") or "git"
+    return [_git_path, *argv[1:]]
+
+
+# a long-lived git helper for read-only object, ref and commit lookups
+# one `git cat-file --batch-command` process answers queries over pipes, so a lookup costs
+# a write and a read instead of a fork; a small thread pool is kept alive for other probes
+class GitBackend:
+    def __init__(self, repo_path: Optional[str] = None, max_workers: int = 8) -> None:
+        self.repo_path = repo_path or os.getcwd()
+        self.max_workers = max_workers
+        self.restarts = 0
+        self._proc: Optional[subprocess.Popen] = None
+        # whether the current process has answered at least once
+        self._proc_answered = False
+        # set when git cannot run the helper at all (e.g. older than 2.36)
+        self._disabled = False
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return not self._disabled
+
+    def _start(self) -> None:
+        self._proc = subprocess.Popen(
+            git_argv(["git", "cat-file", "--batch-command"]),
+            cwd=self.repo_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=probe_env(),
+        )
+        self._proc_answered = False
+
+    def _kill(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=1)
+        except Exception:
+            pass
+        for pipe in (proc.stdin, proc.stdout):
+            try:
+                if pipe:
+                    pipe.close()
+            except Exception:
+                pass
+
+    # send one command and return the header line plus the object body (for contents)
+    # a helper that dies mid-session is restarted once; one that never answers disables the backend
+    def _request(
+        self, command: str, obj: str, with_body: bool
+    ) -> Optional[Tuple[bytes, bytes]]:
+        if self._disabled or not obj or "\n" in obj:
+            return None
+
+        with self._lock:
+            for _ in range(2):
+                try:
+                    if self._proc is None or self._proc.poll() is not None:
+                        if self._proc is not None:
+                            self._kill()
+                            self.restarts += 1
+                        self._start()
+
+                    self._proc.stdin.write(f"{command} {obj}\n".encode("utf-8"))
+                    self._proc.stdin.flush()
+                    header = self._proc.stdout.readline()
+                    if not header:
+                        raise BrokenPipeError("git cat-file exited")
+
+                    self._proc_answered = True
+                    body = b""
+                    parts = header.split()
+                    if with_body and len(parts) == 3:
+                        size = int(parts[2])
+                        # the body is followed by a single newline
+                        body = self._proc.stdout.read(size + 1)[:size]
+                    return header.rstrip(b"\n"), body
+                except (OSError, ValueError):
+                    answered = self._proc_answered
+                    self._kill()
+                    if not answered:
+                        self._disabled = True
+                        return None
+                    self.restarts += 1
+            return None
+
+    # (oid, type, size) for any object name git understands, None when missing or unavailable
+    def object_info(self, obj: str) -> Optional[Tuple[str, str, int]]:
+        response = self._request("info", obj, with_body=False)
+        if response is None:
+            return None
+        parts = response[0].decode("utf-8", errors="replace").split()
+        if len(parts) != 3:
+            # "<obj> missing" or "<obj> ambiguous"
+            return None
+        try:
+            return parts[0], parts[1], int(parts[2])
+        except ValueError:
+            return None
+
+    # raw object contents as (type, bytes)
+    def read_object(self, obj: str) -> Optional[Tuple[str, bytes]]:
+        response = self._request("contents", obj, with_body=True)
+        if response is None:
+            return None
+        parts = response[0].decode("utf-8", errors="replace").split()
+        if len(parts) != 3:
+            return None
+        return parts[1], response[1]
+
+    # full commit hash for a revision (HEAD, HEAD~2, a branch name, a short sha)
+    def resolve(self, rev: str) -> Optional[str]:
+        info = self.object_info(f"{rev}^{{commit}}")
+        return info[0] if info else None
+
+    def blob_size(self, obj: str) -> Optional[int]:
+        info = self.object_info(obj)
+        if info is None or info[1] != "blob":
+            return None
+        return info[2]
+
+    # the subject line of a commit, the same text `git log --format=%s` prints
+    def commit_subject(self, rev: str = "HEAD") -> Optional[str]:
+        obj = self.read_object(f"{rev}^{{commit}}")
+        if obj is None:
+            return None
+        _, raw = obj
+        _, sep, message = raw.partition(b"\n\n")
+        if not sep:
+            return ""
+        first_paragraph = message.split(b"\n\n", 1)[0]
+        lines = first_paragraph.decode("utf-8", errors="replace").splitlines()
+        return " ".join(line.strip() for line in lines if line.strip())
+
+    # (full hash, subject) of the commit HEAD points to
+    def last_commit(self) -> Optional[Tuple[str, str]]:
+        sha = self.resolve("HEAD")
+        if sha is None:
+            return None
+        return sha, self.commit_subject(sha) or ""
+
+    # reusable workers for probes that still need their own git process
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="asd-git"
+                )
+            return self._pool.submit(fn, *args, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            self._kill()
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+_backend: Optional[GitBackend] = None
+_backend_lock = threading.Lock()
+
+
+# how many git processes run at once (ASD_GIT_WORKERS, default 8)
+def _git_workers() -> int:
+    try:
+        return max(1, int(os.getenv("ASD_GIT_WORKERS", "8") or 8))
+    except ValueError:
+        return 8
+
+
+# the session backend for the current working directory
+# a new one is started if the cli ends up in a different repository
+def get_backend() -> GitBackend:
+    global _backend
+    cwd = os.getcwd()
+    with _backend_lock:
+        if _backend is None or _backend.repo_path != cwd:
+            if _backend is not None:
+                _backend.close()
+            _backend = GitBackend(cwd, max_workers=_git_workers())
+        return _backend
+
+
+def close_backend() -> None:
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+            _backend = None
+
+
+atexit.register(close_backend)
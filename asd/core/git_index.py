@@ -0,0 +1,404 @@
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Set, Tuple
+
+from .git_backend import get_backend
+from .repo_meta import RepoMetadata, find_work_tree
+
+# ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size
+_STAT_FIELDS = struct.Struct(">10I")
+_FLAGS = struct.Struct(">H")
+_HEADER = struct.Struct(">4sII")
+
+_FLAG_ASSUME_VALID = 0x8000
+_FLAG_EXTENDED = 0x4000
+_FLAG_STAGE_MASK = 0x3000
+_FLAG_NAME_MASK = 0x0FFF
+_EXT_FLAG_SKIP_WORKTREE = 0x4000
+_EXT_FLAG_INTENT_TO_ADD = 0x2000
+
+_MODE_GITLINK = 0o160000
+_MODE_SYMLINK = 0o120000
+
+
+# one decoded index entry; stat holds the ten cached stat fields in index order
+class IndexEntry:
+    __slots__ = ("path", "mode", "sha", "stage", "stat", "skip", "intent_to_add")
+
+    def __init__(
+        self,
+        path: str,
+        mode: int,
+        sha: str,
+        stage: int,
+        stat: Tuple[int, ...],
+        skip: bool,
+        intent_to_add: bool = False,
+    ) -> None:
+        self.path = path
+        self.mode = mode
+        self.sha = sha
+        self.stage = stage
+        self.stat = stat
+        # assume-valid, skip-worktree and intent-to-add entries are left to git
+        self.skip = skip
+        # git add -N: a placeholder for a file still to be added, which status reports as
+        # a work tree addition, never as a staged one
+        self.intent_to_add = intent_to_add
+
+
+# the decoded index: entries in index order, the cache-tree extension and the file's mtime
+class ParsedIndex:
+    def __init__(
+        self,
+        version: int,
+        entries: List[IndexEntry],
+        cache_tree: Dict[str, str],
+        mtime: int,
+    ) -> None:
+        self.version = version
+        self.entries = entries
+        self.cache_tree = cache_tree
+        self.mtime = mtime
+
+
+# decoding git's offset varint used for v4 path prefix compression
+def _read_varint(buf, pos: int) -> Tuple[int, int]:
+    c = buf[pos]
+    pos += 1
+    value = c & 0x7F
+    while c & 0x80:
+        c = buf[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (c & 0x7F)
+    return value, pos
+
+
+# the TREE extension: pre-order nodes of "<name>\0<entries> <subtrees>\n<sha>"
+# only valid nodes (entries >= 0) carry a sha, and only those are returned
+def _parse_cache_tree(data: bytes, hash_size: int) -> Dict[str, str]:
+    trees: Dict[str, str] = {}
+
+    def parse_node(pos: int, prefix: str) -> int:
+        end = data.index(b"\0", pos)
+        name = data[pos:end].decode("utf-8", errors="surrogateescape")
+        pos = end + 1
+        end = data.index(b"\n", pos)
+        entry_count, subtree_count = data[pos:end].split(b" ")
+        pos = end + 1
+        path = f"{prefix}{name}/" if name else prefix
+        if int(entry_count) >= 0:
+            trees[path] = data[pos : pos + hash_size].hex()
+            pos += hash_size
+        for _ in range(int(subtree_count)):
+            pos = parse_node(pos, path)
+        return pos
+
+    try:
+        parse_node(0, "")
+    except (ValueError, IndexError):
+        return {}
+    return trees
+
+
+# reading .git/index through mmap so only the bytes we decode are ever copied
+# returns None for formats this reader does not handle (split or sparse indexes, unknown versions)
+def read_index(path: str, hash_size: int = 20) -> Optional[ParsedIndex]:
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_size < _HEADER.size + hash_size:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return _decode_index(buf, int(st.st_mtime), hash_size)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _decode_index(buf, mtime: int, hash_size: int) -> Optional[ParsedIndex]:
+    signature, version, count = _HEADER.unpack_from(buf, 0)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        return None
+
+    entries: List[IndexEntry] = []
+    pos = _HEADER.size
+    previous = b""
+    fixed = _STAT_FIELDS.size + hash_size + _FLAGS.size
+
+    for _ in range(count):
+        start = pos
+        stat = _STAT_FIELDS.unpack_from(buf, pos)
+        pos += _STAT_FIELDS.size
+        sha = buf[pos : pos + hash_size].hex()
+        pos += hash_size
+        (flags,) = _FLAGS.unpack_from(buf, pos)
+        pos += _FLAGS.size
+
+        extended = 0
+        if version >= 3 and flags & _FLAG_EXTENDED:
+            (extended,) = _FLAGS.unpack_from(buf, pos)
+            pos += _FLAGS.size
+
+        if version == 4:
+            strip, pos = _read_varint(buf, pos)
+            end = buf.find(b"\0", pos)
+            name = previous[: len(previous) - strip] + buf[pos:end]
+            pos = end + 1
+        else:
+            name_len = flags & _FLAG_NAME_MASK
+            if name_len < _FLAG_NAME_MASK:
+                end = pos + name_len
+            else:
+                end = buf.find(b"\0", pos)
+            name = buf[pos:end]
+            # entries are padded with 1-8 nul bytes to a multiple of eight
+            entry_len = fixed + (2 if flags & _FLAG_EXTENDED else 0) + len(name)
+            pos = start + ((entry_len + 8) & ~7)
+        previous = name
+
+        mode = stat[6]
+        # a sparse index stores whole directories as single entries
+        if mode == 0o040000:
+            return None
+        entries.append(
+            IndexEntry(
+                path=name.decode("utf-8", errors="surrogateescape"),
+                mode=mode,
+                sha=sha,
+                stage=(flags & _FLAG_STAGE_MASK) >> 12,
+                stat=stat,
+                skip=bool(
+                    flags & _FLAG_ASSUME_VALID
+                    or extended & (_EXT_FLAG_SKIP_WORKTREE | _EXT_FLAG_INTENT_TO_ADD)
+                ),
+                intent_to_add=bool(extended & _EXT_FLAG_INTENT_TO_ADD),
+            )
+        )
+
+    cache_tree: Dict[str, str] = {}
+    end_of_extensions = len(buf) - hash_size
+    while pos + 8 <= end_of_extensions:
+        ext_sig = bytes(buf[pos : pos + 4])
+        (ext_size,) = struct.unpack_from(">I", buf, pos + 4)
+        data_start = pos + 8
+        if ext_sig == b"link" or ext_sig == b"sdir":
+            # split index (entries live in a shared file) or sparse index
+            return None
+        if ext_sig == b"TREE":
+            cache_tree = _parse_cache_tree(
+                bytes(buf[data_start : data_start + ext_size]), hash_size
+            )
+        pos = data_start + ext_size
+
+    return ParsedIndex(version, entries, cache_tree, mtime)
+
+
+# the result of a scan: what is known for sure plus the paths only git can settle
+class IndexScan:
+    def __init__(self) -> None:
+        self.staged: List[str] = []
+        self.modified: List[str] = []
+        # racily clean entries and stat changes that need a content comparison
+        self.unsure: List[str] = []
+        self.conflicts = False
+
+
+# comparing cached stat data with the work tree, one os.scandir per directory
+class IndexEngine:
+    def __init__(self, meta: RepoMetadata, work_tree: str) -> None:
+        self.meta = meta
+        self.work_tree = work_tree
+        self.hash_size = (
+            32
+            if self.meta.config_value("extensions", "objectformat") == "sha256"
+            else 20
+        )
+        self.trust_ctime = self.meta.config_value("core", "trustctime") != "false"
+        self.minimal_stat = self.meta.config_value("core", "checkstat") == "minimal"
+        self.trust_filemode = self.meta.config_value("core", "filemode") != "false"
+
+    def scan(self) -> Optional[IndexScan]:
+        index = read_index(self.meta.index_path, self.hash_size)
+        if index is None:
+            return None
+
+        result = IndexScan()
+        by_dir: Dict[str, List[IndexEntry]] = {}
+        for entry in index.entries:
+            if entry.stage:
+                result.conflicts = True
+                continue
+            if entry.skip or entry.mode == _MODE_GITLINK:
+                continue
+            by_dir.setdefault(os.path.dirname(entry.path), []).append(entry)
+
+        dirty: Set[str] = set()
+        for directory, entries in by_dir.items():
+            self._check_directory(directory, entries, index.mtime, dirty, result)
+        result.modified = [e.path for e in index.entries if e.path in dirty]
+
+        staged = self._staged_paths(index)
+        if staged is None:
+            return None
+        result.staged = staged
+        return result
+
+    def _check_directory(
+        self,
+        directory: str,
+        entries: List[IndexEntry],
+        index_mtime: int,
+        dirty: Set[str],
+        result: IndexScan,
+    ) -> None:
+        found: Dict[str, os.DirEntry] = {}
+        try:
+            with os.scandir(os.path.join(self.work_tree, directory)) as it:
+                for dir_entry in it:
+                    found[dir_entry.name] = dir_entry
+        except OSError:
+            pass
+
+        for entry in entries:
+            dir_entry = found.get(os.path.basename(entry.path))
+            if dir_entry is None:
+                # deleted from the work tree
+                dirty.add(entry.path)
+                continue
+            try:
+                st = dir_entry.stat(follow_symlinks=False)
+            except OSError:
+                dirty.add(entry.path)
+                continue
+
+            verdict = self._compare(entry, st, index_mtime)
+            if verdict == "dirty":
+                dirty.add(entry.path)
+            elif verdict == "unsure":
+                result.unsure.append(entry.path)
+
+    # the same decisions git makes in ie_match_stat: a size or type change is a modification,
+    # a timestamp or inode change needs a content comparison, and an entry written in the same
+    # second as the index itself is racily clean and needs one too
+    def _compare(self, entry: IndexEntry, st: os.stat_result, index_mtime: int) -> str:
+        (
+            ctime_s,
+            _ctime_ns,
+            mtime_s,
+            _mtime_ns,
+            _dev,
+            ino,
+            mode,
+            uid,
+            gid,
+            size,
+        ) = entry.stat
+
+        if (mode & 0o170000) != (st.st_mode & 0o170000):
+            return "dirty"
+        if (
+            mode & 0o170000 != _MODE_SYMLINK
+            and (mode & 0o100) != (st.st_mode & 0o100)
+            and self.trust_filemode
+        ):
+            return "dirty"
+        if size != (st.st_size & 0xFFFFFFFF):
+            # a zero size is how git marks a smudged racy entry
+            return "unsure" if size == 0 else "dirty"
+
+        changed = mtime_s != (int(st.st_mtime) & 0xFFFFFFFF)
+        if not self.minimal_stat:
+            changed = changed or (
+                self.trust_ctime and ctime_s != (int(st.st_ctime) & 0xFFFFFFFF)
+            )
+            changed = changed or ino != (st.st_ino & 0xFFFFFFFF)
+            changed = changed or uid != st.st_uid or gid != st.st_gid
+        if changed:
+            return "unsure"
+        if index_mtime <= mtime_s:
+            return "unsure"
+        return "clean"
+
+    # staged changes are index entries that differ from HEAD's tree
+    # subtrees whose cache-tree sha matches HEAD are skipped without being read
+    def _staged_paths(self, index: ParsedIndex) -> Optional[List[str]]:
+        stage0 = {
+            e.path: e for e in index.entries if e.stage == 0 and not e.intent_to_add
+        }
+        # unmerged paths are reported as conflicts, not as staged changes
+        unmerged = {e.path for e in index.entries if e.stage}
+        backend = get_backend()
+        head_tree = backend.object_info("HEAD^{tree}")
+        if head_tree is None:
+            if self.meta.head_sha() is not None or not backend.available:
+                return None
+            # unborn branch: everything in the index is a new file
+            return list(stage0)
+
+        changed: Set[str] = set()
+        seen: Set[str] = set()
+        skipped: Set[str] = set()
+
+        def walk(tree_sha: str, prefix: str) -> bool:
+            if index.cache_tree.get(prefix) == tree_sha:
+                skipped.add(prefix)
+                return True
+            obj = backend.read_object(tree_sha)
+            if obj is None or obj[0] != "tree":
+                return False
+            data = obj[1]
+            pos = 0
+            while pos < len(data):
+                space = data.index(b" ", pos)
+                nul = data.index(b"\0", space)
+                mode = int(data[pos:space], 8)
+                name = data[space + 1 : nul].decode("utf-8", errors="surrogateescape")
+                sha = data[nul + 1 : nul + 1 + self.hash_size].hex()
+                pos = nul + 1 + self.hash_size
+                path = prefix + name
+                if mode == 0o040000:
+                    if not walk(sha, path + "/"):
+                        return False
+                    continue
+                seen.add(path)
+                entry = stage0.get(path)
+                if entry is None or entry.sha != sha or entry.mode != mode:
+                    changed.add(path)
+            return True
+
+        if not walk(head_tree[0], ""):
+            return None
+
+        for entry in index.entries:
+            if entry.stage or entry.path in seen or entry.path in changed:
+                continue
+            if entry.intent_to_add:
+                continue
+            if _under_skipped(entry.path, skipped):
+                continue
+            # in the index but not in HEAD
+            changed.add(entry.path)
+
+        changed -= unmerged
+        # paths only HEAD knows about (staged deletions) sort in with the rest
+        return sorted(changed)
+
+
+def _under_skipped(path: str, skipped: Set[str]) -> bool:
+    if "" in skipped:
+        return True
+    end = path.find("/")
+    while end != -1:
+        if path[: end + 1] in skipped:
+            return True
+        end = path.find("/", end + 1)
+    return False
+
+
+# scanning the index of the repository around the working directory, None when unsupported
+def scan_index(meta: RepoMetadata) -> Optional[IndexScan]:
+    work_tree = find_work_tree()
+    if work_tree is None:
+        return None
+    return IndexEngine(meta, work_tree).scan()
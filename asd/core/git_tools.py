@@ -1,27 +1,65 @@
 import os
+import re
+import shlex
 import subprocess
-from typing import Dict, List, Optional, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 
+from .commit_count import count_commits
 from .costs import UsageCallback, get_active_model_provider
+from .git_backend import get_backend, git_argv, probe_env
+from .git_index import scan_index
+from .llm import get_structured_llm
 from .models import GitStatus, SafetyLevel
+from .repo_meta import find_git_dirs, find_work_tree, get_repo_metadata
+
+# a command as an argv list, or a command line that is split with split_command
+GitCommand = Union[str, List[str]]
+
+# shell control operators; a command line containing one is not a single git command
+_SHELL_OPERATOR_CHARS = set("();<>|&")
+
+
+# splitting a free-form command line into argv the way a posix shell would quote it
+# nothing is expanded or executed, and pipes, redirects or chained commands are refused
+def split_command(command: str) -> List[str]:
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    argv = list(lexer)
+    for token in argv:
+        if token and set(token) <= _SHELL_OPERATOR_CHARS:
+            raise ValueError(
+                f"shell operator '{token}' is not supported, run one command at a time"
+            )
+    if not argv:
+        raise ValueError("empty command")
+    return argv
+
+
+def _argv(cmd: GitCommand) -> List[str]:
+    return git_argv(split_command(cmd) if isinstance(cmd, str) else list(cmd))
 
 
 # running git commands and capturing the output
-# using the subprocess module to run the commands
-def run_git_command(cmd: str, suppress_errors: bool = False) -> Dict[str, any]:
+# git is executed directly from argv, without a shell in between
+def run_git_command(
+    cmd: GitCommand,
+    suppress_errors: bool = False,
+    env: Optional[Dict[str, str]] = None,
+    timeout: float = 30,
+) -> Dict[str, any]:
     try:
         result = subprocess.run(
-            cmd,
-            shell=True,
-            cwd=os.getcwd(),
+            _argv(cmd),
+            close_fds=False,
             capture_output=True,
             text=True,
-            timeout=30,
+            timeout=timeout,
+            env=env,
             encoding="utf-8",
             errors="replace",
         )
@@ -49,23 +87,615 @@ def run_git_command(cmd: str, suppress_errors: bool = False) -> Dict[str, any]:
         return {"success": False, "stdout": "", "stderr": "", "returncode": -1}
 
 
+# timeout in seconds for each auxiliary status probe (ASD_PROBE_TIMEOUT, default 10)
+def _probe_timeout() -> float:
+    try:
+        return float(os.getenv("ASD_PROBE_TIMEOUT", "10"))
+    except ValueError:
+        return 10.0
+
+
+# running independent probes concurrently on the backend's worker pool
+# probes maps a name to (command, timeout); a probe that runs out of time only loses its own field,
+# so the wall clock is bounded by the slowest probe rather than the sum of all of them
+def _run_probes(
+    probes: Dict[str, Tuple[GitCommand, float]],
+) -> Dict[str, Dict[str, Any]]:
+    return _collect_probes(_submit_probes(probes))
+
+
+def _submit_probes(probes: Dict[str, Tuple[GitCommand, float]]) -> Dict[str, Any]:
+    backend = get_backend()
+    env = probe_env()
+    return {
+        name: backend.submit(run_git_command, cmd, True, env, timeout)
+        for name, (cmd, timeout) in probes.items()
+    }
+
+
+def _collect_probes(futures: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = {
+                "success": False,
+                "stdout": "",
+                "stderr": str(e),
+                "returncode": -1,
+            }
+    return results
+
+
+# remote names from the config file when the metadata reader can handle this repo, otherwise from `git remote`
+def _remote_names(results: Dict[str, Dict[str, Any]], meta) -> List[str]:
+    if meta is not None:
+        return meta.remotes()
+    remote_result = results.get("remote")
+    if not remote_result or not remote_result["success"]:
+        return []
+    return [name for name in remote_result["stdout"].splitlines() if name]
+
+
+# the subject of the last commit from the long-lived cat-file helper, git log is the fallback
+def _last_commit_subject() -> str:
+    backend = get_backend()
+    subject = backend.commit_subject("HEAD")
+    if subject is not None:
+        return subject
+    if backend.available:
+        # the helper answered, HEAD just has no commit yet
+        return ""
+    subject_result = run_git_command(
+        ["git", "log", "-1", "--format=%s"], env=probe_env()
+    )
+    return subject_result["stdout"] if subject_result["success"] else ""
+
+
 # getting the git status of the repo
-def get_git_status() -> GitStatus:
+# ASD_STATUS_MODE picks the collection strategy: "porcelain-v2" (default), "index" or "legacy"
+def get_git_status(mode: Optional[str] = None) -> GitStatus:
+    mode = (mode or os.getenv("ASD_STATUS_MODE", "porcelain-v2")).strip().lower()
+    # no .git anywhere above us means no repository, and no need to fork git to find out
+    if find_git_dirs() is None:
+        return GitStatus(is_repo=False)
+    if mode == "legacy":
+        return _get_git_status_legacy()
+    if mode == "index":
+        return _get_git_status_index()
+    return _get_git_status_porcelain_v2()
+
+
+# paths kept per category once the counts are exact (ASD_STATUS_SAMPLE, default 200)
+def _status_sample_limit() -> int:
+    try:
+        return max(0, int(os.getenv("ASD_STATUS_SAMPLE", "200")))
+    except ValueError:
+        return 200
+
+
+# how untracked files are listed (ASD_UNTRACKED_FILES): "normal" (default) or "no"
+def _untracked_mode() -> str:
+    mode = os.getenv("ASD_UNTRACKED_FILES", "normal").strip().lower()
+    return mode if mode in ("normal", "no") else "normal"
+
+
+# an exact count of paths plus the first few of them
+class _PathSample:
+    def __init__(self, limit: Optional[int] = None) -> None:
+        self.limit = limit
+        self.paths: List[str] = []
+        self.count = 0
+
+    def add(self, path: str) -> None:
+        self.count += 1
+        if self.limit is None or len(self.paths) < self.limit:
+            self.paths.append(path)
+
+    def extend(self, paths: List[str]) -> "_PathSample":
+        for path in paths:
+            self.add(path)
+        return self
+
+    @property
+    def truncated(self) -> bool:
+        return self.count > len(self.paths)
+
+
+# list, count and truncation fields for GitStatus
+def _path_fields(
+    staged: _PathSample, modified: _PathSample, untracked: _PathSample
+) -> Dict[str, Any]:
+    return {
+        "staged": staged.paths,
+        "modified": modified.paths,
+        "untracked": untracked.paths,
+        "staged_count": staged.count,
+        "modified_count": modified.count,
+        "untracked_count": untracked.count,
+        "paths_truncated": staged.truncated
+        or modified.truncated
+        or untracked.truncated,
+    }
+
+
+# GitStatus path fields from complete lists, sampled down to ASD_STATUS_SAMPLE
+def _sampled_path_fields(
+    staged: List[str], modified: List[str], untracked: List[str]
+) -> Dict[str, Any]:
+    limit = _status_sample_limit()
+    return _path_fields(
+        _PathSample(limit).extend(staged),
+        _PathSample(limit).extend(modified),
+        _PathSample(limit).extend(untracked),
+    )
+
+
+# parsing git status --porcelain=v2 --branch --show-stash -z one record at a time
+# renames and copies carry their original path as an extra record; counts are always exact
+# while each list keeps at most sample_limit paths (None keeps everything)
+class _PorcelainV2Parser:
+    def __init__(self, sample_limit: Optional[int] = None) -> None:
+        self.staged = _PathSample(sample_limit)
+        self.modified = _PathSample(sample_limit)
+        self.untracked = _PathSample(sample_limit)
+        self.header: Dict[str, Any] = {
+            "current_branch": "HEAD",
+            "head_oid": "",
+            "ahead": 0,
+            "behind": 0,
+            "conflicts": False,
+            "stash_count": 0,
+        }
+        self._skip_next = False
+
+    @property
+    def fields(self) -> Dict[str, Any]:
+        return {
+            **self.header,
+            **_path_fields(self.staged, self.modified, self.untracked),
+        }
+
+    def feed(self, record: str) -> None:
+        if self._skip_next:
+            # the original path of a rename or copy
+            self._skip_next = False
+            return
+        if not record:
+            return
+
+        fields = self.header
+        # header lines: branch.oid, branch.head, branch.upstream, branch.ab, stash
+        if record.startswith("# "):
+            key, _, value = record[2:].partition(" ")
+            if key == "branch.oid" and value != "(initial)":
+                fields["head_oid"] = value
+            elif key == "branch.head" and value != "(detached)":
+                fields["current_branch"] = value
+            elif key == "branch.ab":
+                try:
+                    ahead_part, behind_part = value.split(" ", 1)
+                    fields["ahead"] = int(ahead_part.lstrip("+"))
+                    fields["behind"] = int(behind_part.lstrip("-"))
+                except ValueError:
+                    pass
+            elif key == "stash":
+                try:
+                    fields["stash_count"] = int(value)
+                except ValueError:
+                    pass
+            return
+
+        kind = record[0]
+        if kind == "1":
+            # 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+            parts = record.split(" ", 8)
+        elif kind == "2":
+            # 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path> nul <origPath>
+            parts = record.split(" ", 9)
+            self._skip_next = True
+        elif kind == "u":
+            # unmerged entries are reported as conflicts, not as staged or modified files
+            fields["conflicts"] = True
+            return
+        elif kind == "?":
+            self.untracked.add(record[2:])
+            return
+        else:
+            # "!" ignored entries and anything newer git may add
+            return
+
+        if len(parts) < 9:
+            return
+        index_status, worktree_status = parts[1][0], parts[1][1]
+        filepath = parts[-1]
+        if index_status in "AMDRC":
+            self.staged.add(filepath)
+        if worktree_status in "MD":
+            self.modified.add(filepath)
+
+
+# streaming the output of a git command as raw bytes records (nul or newline delimited)
+# records are read from the pipe into one reusable buffer and handed out as they arrive, so
+# consumers can process large outputs incrementally and stop early; run_git_command is for small ones
+class GitStream:
+    def __init__(
+        self,
+        cmd: GitCommand,
+        delimiter: bytes = b"\0",
+        env: Optional[Dict[str, str]] = None,
+        timeout: float = 30,
+        skip_empty: bool = True,
+        chunk_size: int = 65536,
+    ) -> None:
+        self.cmd = cmd
+        self.delimiter = delimiter
+        self.skip_empty = skip_empty
+        self.env = env
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        # exit code once the stream is exhausted or closed; -1 when git could not be started
+        self.returncode: Optional[int] = None
+        self._proc: Optional[subprocess.Popen] = None
+        self._timer: Optional[threading.Timer] = None
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            self._proc = subprocess.Popen(
+                _argv(self.cmd),
+                close_fds=False,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                env=self.env,
+            )
+        except (OSError, ValueError):
+            self.returncode = -1
+            return
+
+        self._timer = threading.Timer(self.timeout, self._proc.kill)
+        self._timer.start()
+        try:
+            chunk = bytearray(self.chunk_size)
+            view = memoryview(chunk)
+            pending = bytearray()
+            while True:
+                n = self._proc.stdout.readinto1(view)
+                if not n:
+                    break
+                pending += view[:n]
+                start = 0
+                end = pending.find(self.delimiter)
+                while end != -1:
+                    if end > start or not self.skip_empty:
+                        yield bytes(pending[start:end])
+                    start = end + 1
+                    end = pending.find(self.delimiter, start)
+                del pending[:start]
+            if pending:
+                yield bytes(pending)
+        finally:
+            self.close()
+
+    # stops the command if the consumer did not read everything, and records its exit code
+    def close(self) -> None:
+        proc = self._proc
+        if proc is None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        if proc.poll() is None and not proc.stdout.closed:
+            # an early stop must not leave git blocked on a full pipe
+            proc.stdout.close()
+            proc.kill()
+        # a command killed by the timer or by an early stop exits with a negative code
+        self.returncode = proc.wait()
+        if not proc.stdout.closed:
+            proc.stdout.close()
+
+    def __enter__(self) -> "GitStream":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+# a GitStream over the output of cmd
+def stream_git_command(
+    cmd: GitCommand,
+    delimiter: bytes = b"\0",
+    env: Optional[Dict[str, str]] = None,
+    timeout: float = 30,
+    skip_empty: bool = True,
+) -> GitStream:
+    return GitStream(
+        cmd, delimiter=delimiter, env=env, timeout=timeout, skip_empty=skip_empty
+    )
+
+
+# handing each decoded record of a nul separated output to consume; returns the exit code
+def _stream_nul_records(
+    cmd: GitCommand,
+    consume: Callable[[str], None],
+    env: Optional[Dict[str, str]] = None,
+    timeout: float = 30,
+) -> int:
+    stream = stream_git_command(cmd, env=env, timeout=timeout)
+    for record in stream:
+        consume(record.decode("utf-8", errors="replace"))
+    return stream.returncode
+
+
+# the porcelain v2 status probe, parsed while git is still writing it
+def _stream_status_probe(
+    env: Dict[str, str], sample_limit: int
+) -> Optional[Dict[str, Any]]:
+    parser = _PorcelainV2Parser(sample_limit)
+    returncode = _stream_nul_records(
+        [
+            "git",
+            "status",
+            "--porcelain=v2",
+            "--branch",
+            "--show-stash",
+            "-z",
+            f"--untracked-files={_untracked_mode()}",
+        ],
+        parser.feed,
+        env=env,
+    )
+    return parser.fields if returncode == 0 else None
+
+
+# collecting the git status from a single porcelain v2 probe
+# only the fields porcelain v2 cannot provide (commit count, remotes, last commit subject) come from
+# other probes, and the forked ones run alongside the status probe instead of after it
+def _get_git_status_porcelain_v2() -> GitStatus:
+    aux_timeout = _probe_timeout()
+    meta = get_repo_metadata()
+    # the status probe is streamed and parsed on a worker while the other probes run
+    status_future = get_backend().submit(
+        _stream_status_probe, probe_env(), _status_sample_limit()
+    )
+    # the commit count is cached per tip, so it is only counted alongside status when HEAD moved
+    head_sha = meta.head_sha() if meta is not None else None
+    count_future = (
+        get_backend().submit(count_commits, head_sha, aux_timeout) if head_sha else None
+    )
+    probes = {}
+    if meta is None:
+        probes["remote"] = (["git", "remote"], aux_timeout)
+    results = _run_probes(probes)
+
+    try:
+        fields = status_future.result()
+    except Exception:
+        fields = None
+    # outside a work tree or on a git without --show-stash, use the legacy probes
+    if fields is None:
+        return _get_git_status_legacy()
+
+    total_commits, commits_capped = 0, False
+    last_commit_message = ""
+    # an unborn branch has no history to count or describe
+    if fields["head_oid"]:
+        if count_future is not None and head_sha == fields["head_oid"]:
+            total_commits, commits_capped = count_future.result()
+        else:
+            total_commits, commits_capped = count_commits(
+                fields["head_oid"], aux_timeout
+            )
+        # answered by the long-lived helper, so it costs no fork once the repo is known
+        last_commit_message = _last_commit_subject()
+
+    remotes = _remote_names(results, meta)
+    has_remote = bool(remotes)
+    remote_name = remotes[0] if remotes else ""
+
+    return GitStatus(
+        is_repo=True,
+        current_branch=fields["current_branch"],
+        staged=fields["staged"],
+        modified=fields["modified"],
+        untracked=fields["untracked"],
+        staged_count=fields["staged_count"],
+        modified_count=fields["modified_count"],
+        untracked_count=fields["untracked_count"],
+        paths_truncated=fields["paths_truncated"],
+        ahead=fields["ahead"],
+        behind=fields["behind"],
+        conflicts=fields["conflicts"],
+        total_commits=total_commits,
+        total_commits_capped=commits_capped,
+        uncommitted_changes=fields["staged_count"] + fields["modified_count"],
+        has_remote=has_remote,
+        remote_name=remote_name,
+        last_commit_hash=fields["head_oid"][:8],  # short hash
+        last_commit_message=last_commit_message,
+        stash_count=fields["stash_count"],
+    )
+
+
+# porcelain v2 status limited to a set of paths relative to the top of the work tree
+# pathspecs are literal, so file names with glob characters only ever match themselves
+def status_for_paths(
+    paths: List[str], untracked: bool = True
+) -> Optional[Dict[str, Any]]:
+    work_tree = find_work_tree()
+    if work_tree is None:
+        return None
+    untracked_mode = _untracked_mode() if untracked else "no"
+    parser = _PorcelainV2Parser()
+    returncode = _stream_nul_records(
+        [
+            "git",
+            "-C",
+            work_tree,
+            "status",
+            "--porcelain=v2",
+            "-z",
+            f"--untracked-files={untracked_mode}",
+            "--ignore-submodules=all",
+            "--",
+            *paths,
+        ],
+        parser.feed,
+        env={**probe_env(), "GIT_LITERAL_PATHSPECS": "1"},
+    )
+    if returncode != 0:
+        return None
+    return parser.fields
+
+
+# most unsure entries the index engine hands to git before a full status probe is cheaper
+def _index_unsure_limit() -> int:
+    try:
+        return int(os.getenv("ASD_INDEX_UNSURE_LIMIT", "2000"))
+    except ValueError:
+        return 2000
+
+
+# collecting the git status from .git/index directly
+# staged and modified files come from the index engine; git only compares the contents of the
+# entries the engine could not settle from stat data, and untracked files still come from git
+def _get_git_status_index() -> GitStatus:
+    meta = get_repo_metadata()
+    work_tree = find_work_tree()
+    if meta is None or work_tree is None:
+        return _get_git_status_porcelain_v2()
+
+    aux_timeout = _probe_timeout()
+    untracked = _PathSample(_status_sample_limit())
+    untracked_future = None
+    if _untracked_mode() != "no":
+        # run from the top so paths match porcelain output from any subdirectory
+        untracked_future = get_backend().submit(
+            _stream_nul_records,
+            [
+                "git",
+                "-C",
+                work_tree,
+                "ls-files",
+                "--others",
+                "--exclude-standard",
+                "--directory",
+                "--no-empty-directory",
+                "-z",
+            ],
+            untracked.add,
+            probe_env(),
+        )
+    futures = _submit_probes(
+        {
+            "ahead_behind": (
+                ["git", "rev-list", "--left-right", "--count", "HEAD...@{upstream}"],
+                aux_timeout,
+            ),
+        }
+    )
+    head_sha = meta.head_sha() or ""
+    count_future = (
+        get_backend().submit(count_commits, head_sha, aux_timeout) if head_sha else None
+    )
+
+    scan = scan_index(meta)
+    if scan is None or len(scan.unsure) > _index_unsure_limit():
+        _collect_probes(futures)
+        if untracked_future is not None:
+            untracked_future.result()
+        return _get_git_status_porcelain_v2()
+
+    modified = list(scan.modified)
+    if scan.unsure:
+        verified = status_for_paths(scan.unsure, untracked=False)
+        if verified is None:
+            _collect_probes(futures)
+            if untracked_future is not None:
+                untracked_future.result()
+            return _get_git_status_porcelain_v2()
+        modified = sorted(set(modified) | set(verified["modified"]))
+
+    results = _collect_probes(futures)
+    if untracked_future is not None and untracked_future.result() != 0:
+        untracked = _PathSample(0)
+
+    ahead = behind = 0
+    ahead_behind_result = results["ahead_behind"]
+    if ahead_behind_result["success"]:
+        try:
+            ahead, behind = (int(n) for n in ahead_behind_result["stdout"].split())
+        except ValueError:
+            ahead = behind = 0
+
+    total_commits, commits_capped = 0, False
+    last_commit_message = ""
+    if count_future is not None:
+        total_commits, commits_capped = count_future.result()
+        last_commit_message = _last_commit_subject()
+
+    remotes = meta.remotes()
+    return GitStatus(
+        is_repo=True,
+        current_branch=meta.current_branch(),
+        **_path_fields(
+            _PathSample(_status_sample_limit()).extend(scan.staged),
+            _PathSample(_status_sample_limit()).extend(modified),
+            untracked,
+        ),
+        ahead=ahead,
+        behind=behind,
+        conflicts=scan.conflicts,
+        total_commits=total_commits,
+        total_commits_capped=commits_capped,
+        uncommitted_changes=len(scan.staged) + len(modified),
+        has_remote=bool(remotes),
+        remote_name=remotes[0] if remotes else "",
+        last_commit_hash=head_sha[:8],  # short hash
+        last_commit_message=last_commit_message,
+        stash_count=meta.stash_count(),
+    )
+
+
+# collecting the git status with one probe per field
+# kept for git versions without porcelain v2 --show-stash (older than 2.35)
+def _get_git_status_legacy() -> GitStatus:
     # using the run git function and running the git rev-parse --is-inside-work-tree command to check if the current directory is a git repository
     is_repo_result = run_git_command(
-        "git rev-parse --is-inside-work-tree", suppress_errors=True
+        ["git", "rev-parse", "--is-inside-work-tree"], suppress_errors=True
     )
     # if the current directory is not a git repository, the git status is set to false
     if not is_repo_result["success"] or is_repo_result["stdout"] != "true":
         return GitStatus(is_repo=False)
 
-    # run the git branch --show-current command to get the current branch
-    branch_result = run_git_command("git branch --show-current")
-    # if the current branch is not found, the current branch is set to HEAD
-    current_branch = branch_result["stdout"] or "HEAD"
+    # the remaining probes are independent of each other, so they run concurrently
+    # branch, remotes and stash count are read from the git directory when possible
+    timeout = _probe_timeout()
+    meta = get_repo_metadata()
+    probes = {
+        "porcelain": (
+            ["git", "status", "--porcelain", f"--untracked-files={_untracked_mode()}"],
+            30,
+        ),
+        "branch_status": (["git", "status", "--branch", "--porcelain"], 30),
+        "conflicts": (["git", "ls-files", "--unmerged"], timeout),
+        "commit_info": (["git", "log", "-1", "--format=%H|%s"], timeout),
+    }
+    if meta is None:
+        probes["branch"] = (["git", "branch", "--show-current"], timeout)
+        probes["remote"] = (["git", "remote"], timeout)
+        probes["stash"] = (["git", "stash", "list"], timeout)
+    results = _run_probes(probes)
+
+    if meta is not None:
+        current_branch = meta.current_branch()
+    else:
+        # run the git branch --show-current command to get the current branch
+        branch_result = results["branch"]
+        # if the current branch is not found, the current branch is set to HEAD
+        current_branch = branch_result["stdout"] or "HEAD"
 
     # run the git status --porcelain command to get the status of the repo
-    porcelain_result = run_git_command("git status --porcelain")
+    porcelain_result = results["porcelain"]
     # if the git status command fails, the porcelain lines are set to an empty list
     porcelain_lines = (
         porcelain_result["stdout"].splitlines() if porcelain_result["success"] else []
@@ -91,7 +721,7 @@ def get_git_status() -> GitStatus:
     # run the git status --branch --porcelain command to get the ahead and behind commits
     ahead = behind = 0
     # run the git status --branch --porcelain command to get the ahead and behind commits
-    status_result = run_git_command("git status --branch --porcelain")
+    status_result = results["branch_status"]
     # if the git status command fails, the ahead and behind commits are set to 0
     if status_result["success"] and status_result["stdout"]:
         # get the first line of the status result
@@ -117,32 +747,20 @@ def get_git_status() -> GitStatus:
                 behind = 0
 
     # run the git ls-files --unmerged command to check for conflicts (for merge conflicts if any)
-    conflicts_result = run_git_command("git ls-files --unmerged")
+    conflicts_result = results["conflicts"]
     has_conflicts = (
         bool(conflicts_result["stdout"]) if conflicts_result["success"] else False
     )
 
-    # run the git rev-list --count HEAD command to get the total number of commits
-    commit_count_result = run_git_command("git rev-list --count HEAD")
-    total_commits = 0
-    # if the git rev-list command fails, the total commits are set to 0
-    if commit_count_result["success"]:
-        try:
-            total_commits = int(commit_count_result["stdout"])
-        except ValueError:
-            total_commits = 0
-
-    # run the git remote command to check if the repo has a remote
-    remote_result = run_git_command("git remote")
-    # if the git remote command fails, the remote is set to false
-    has_remote = bool(remote_result["stdout"]) if remote_result["success"] else False
-    # if the remote is found, the remote name is set to the first remote name
-    remote_name = remote_result["stdout"].split("\n")[0] if has_remote else ""
+    # check if the repo has a remote, the first remote name is the primary one
+    remotes = _remote_names(results, meta)
+    has_remote = bool(remotes)
+    remote_name = remotes[0] if remotes else ""
 
     last_commit_hash = ""
     last_commit_message = ""
     # run the git log -1 --format='%H|%s' command to get the last commit hash and message
-    commit_info_result = run_git_command("git log -1 --format='%H|%s'")
+    commit_info_result = results["commit_info"]
     if commit_info_result["success"] and commit_info_result["stdout"]:
         try:
             # split the commit info result into a list of two elements
@@ -154,11 +772,20 @@ def get_git_status() -> GitStatus:
         except IndexError:
             pass
 
-    # run the git stash list command to get the number of stashed changes
-    stash_result = run_git_command("git stash list")
-    stash_count = (
-        len(stash_result["stdout"].splitlines()) if stash_result["success"] else 0
-    )
+    # count the commits behind the full hash, cached per tip and bounded by ASD_COMMIT_COUNT_LIMIT
+    full_hash = ""
+    if commit_info_result["success"]:
+        full_hash = commit_info_result["stdout"].split("|", 1)[0]
+    total_commits, commits_capped = count_commits(full_hash, timeout)
+
+    # get the number of stashed changes from the stash reflog, or from git stash list
+    if meta is not None:
+        stash_count = meta.stash_count()
+    else:
+        stash_result = results["stash"]
+        stash_count = (
+            len(stash_result["stdout"].splitlines()) if stash_result["success"] else 0
+        )
 
     # get the total number of uncommitted changes
     uncommitted_changes = len(staged) + len(modified)
@@ -167,13 +794,12 @@ def get_git_status() -> GitStatus:
     return GitStatus(
         is_repo=True,
         current_branch=current_branch,
-        staged=staged,
-        modified=modified,
-        untracked=untracked,
+        **_sampled_path_fields(staged, modified, untracked),
         ahead=ahead,
         behind=behind,
         conflicts=has_conflicts,
         total_commits=total_commits,
+        total_commits_capped=commits_capped,
         uncommitted_changes=uncommitted_changes,
         has_remote=has_remote,
         remote_name=remote_name,
@@ -186,10 +812,39 @@ def get_git_status() -> GitStatus:
 # using the git diff --staged command to get the diff of the staged changes
 # if the git diff command fails, the diff is set to None
 def get_git_diff_analysis() -> Optional[str]:
-    diff_result = run_git_command("git diff --staged")
-    if not diff_result["success"] or not diff_result["stdout"]:
+    # the diff is joined from the stream and decoded once instead of captured, decoded and stripped
+    stream = stream_git_command(
+        ["git", "diff", "--staged"], delimiter=b"\n", skip_empty=False
+    )
+    diff = b"\n".join(stream)
+    if stream.returncode != 0 or not diff.strip():
         return None
-    return diff_result["stdout"]
+    return diff.decode("utf-8", errors="replace").strip()
+
+
+# revisions such as HEAD~1, HEAD^2, ORIG_HEAD or a full sha that a plan step points at
+_REVISION_PATTERN = re.compile(
+    r"^(?:(?:HEAD|ORIG_HEAD|FETCH_HEAD|MERGE_HEAD)(?:@\{\d+\})?|[0-9a-f]{40})(?:[~^]\d*)*$"
+)
+_REVISION_COMMANDS = ("reset", "revert", "cherry-pick", "checkout", "switch", "show")
+
+
+# checking that every revision a history command refers to actually exists
+# resolved through the long-lived cat-file helper, so there is no fork per revision
+def _missing_revisions(command: str) -> List[str]:
+    tokens = command.split()
+    if len(tokens) < 3 or tokens[0] != "git" or tokens[1] not in _REVISION_COMMANDS:
+        return []
+
+    backend = get_backend()
+    missing = []
+    for token in tokens[2:]:
+        token = token.strip("'\"")
+        if not _REVISION_PATTERN.match(token):
+            continue
+        if backend.resolve(token) is None and backend.available:
+            missing.append(token)
+    return missing
 
 
 # the idea is to check the prerequisites for a command
@@ -197,8 +852,13 @@ def check_git_prerequisites(command: str, git_status: GitStatus) -> List[str]:
     issues = []
     cmd_lower = command.lower()
 
+    # if the command points at a revision that does not exist, add a warning
+    if git_status.is_repo:
+        for rev in _missing_revisions(command):
+            issues.append(f"revision '{rev}' does not exist in this repository")
+
     # if the command is a commit and no files are staged, add a warning
-    if "commit" in cmd_lower and not git_status.staged:
+    if "commit" in cmd_lower and git_status.staged_count == 0:
         issues.append("no files are staged for commit - use 'git add' first")
 
     # if the command is a push and no remote is configured, add a warning
@@ -228,26 +888,44 @@ class CommitMessage(BaseModel):
     explanation: str = Field(..., description="why this commit message was chosen")
 
 
-# using llm to generate a commit message
-# using the conventional commit format to generate the commit message
-# FIXED: the model now uses the same model as the rest of the application
-def get_llm():
-    if os.getenv("GOOGLE_API_KEY"):
-        return ChatGoogleGenerativeAI(
-            model=os.getenv("GOOGLE_MODEL", "gemini-2.5-flash"),
-            api_key=os.getenv("GOOGLE_API_KEY"),
-        )
-    return ChatOpenAI(
-        model=os.getenv("OPENAI_MODEL", "o4-mini"), api_key=os.getenv("OPENAI_API_KEY")
-    )
+# a cheap, provider independent estimate: about four characters per token
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
 
 
+# diffs above this many tokens are summarised chunk by chunk (ASD_COMMIT_CHUNK_TOKENS, default 4000)
+def _commit_chunk_tokens() -> int:
+    try:
+        return max(500, int(os.getenv("ASD_COMMIT_CHUNK_TOKENS", "4000")))
+    except ValueError:
+        return 4000
+
+
+# the most chunks one commit message is written from (ASD_COMMIT_MAX_CHUNKS, default 16)
+def _commit_max_chunks() -> int:
+    try:
+        return max(1, int(os.getenv("ASD_COMMIT_MAX_CHUNKS", "16")))
+    except ValueError:
+        return 16
+
+
+# concurrent chunk summaries (ASD_COMMIT_MAP_WORKERS, default 4)
+def _commit_map_workers() -> int:
+    try:
+        return max(1, int(os.getenv("ASD_COMMIT_MAP_WORKERS", "4")))
+    except ValueError:
+        return 4
+
+
+# using llm to generate a commit message
+# using the conventional commit format to generate the commit message
 def generate_commit_message(diff: str) -> Tuple[str, str]:
-    llm = get_llm()
+    if estimate_tokens(diff) > _commit_chunk_tokens():
+        return _generate_commit_message_chunked(diff)
+    return _generate_commit_message_single(diff)
 
-    mapper = llm.with_structured_output(CommitMessage)
 
-    system_prompt = """analyze the git diff and create a conventional commit message.
+_COMMIT_SYSTEM_PROMPT = """analyze the git diff and create a conventional commit message.
 
     conventional commit format: <type>: <description>
 
@@ -268,8 +946,12 @@ def generate_commit_message(diff: str) -> Tuple[str, str]:
 
     create a concise, imperative message that describes the most significant change."""
 
+
+def _generate_commit_message_single(diff: str) -> Tuple[str, str]:
+    mapper = get_structured_llm(CommitMessage)
+
     messages = [
-        SystemMessage(content=system_prompt),
+        SystemMessage(content=_COMMIT_SYSTEM_PROMPT),
         HumanMessage(content=f"git diff:\n{diff}"),
     ]
 
@@ -279,3 +961,153 @@ def generate_commit_message(diff: str) -> Tuple[str, str]:
         config={"callbacks": [UsageCallback(provider, model)]},
     )
     return result.message, result.explanation
+
+
+class ChunkSummary(BaseModel):
+    summary: str = Field(
+        ...,
+        description="what changed in these files and why, in two or three sentences",
+    )
+    change_type: str = Field(
+        ..., description="the conventional commit type that fits these changes best"
+    )
+
+
+_CHUNK_SYSTEM_PROMPT = """summarize one part of a larger staged git diff.
+
+    describe what changed in these files and the likely intent, in two or three sentences.
+    name concrete functions, modules or behaviours; skip formatting-only changes.
+    pick the conventional commit type (feat, fix, docs, style, refactor, test, chore)
+    that fits this part best."""
+
+
+# the lines of a hunk in pieces of at most limit tokens, each led by the hunk's @@ line so a
+# piece still says where in the file it is; a single line over the limit is cut short
+def _split_hunk(hunk: str, limit: int) -> List[str]:
+    head, _, rest = hunk.partition("\n")
+    room = max(1, limit - estimate_tokens(head) - 1)
+    pieces: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in rest.split("\n"):
+        if estimate_tokens(line) > room:
+            line = line[: room * 4 - 4]
+        cost = estimate_tokens(line) + 1
+        if current and size + cost > room:
+            pieces.append("\n".join([head] + current))
+            current, size = [], 0
+        current.append(line)
+        size += cost
+    if current or not pieces:
+        pieces.append("\n".join([head] + current))
+    return pieces
+
+
+# one file of the diff in pieces of at most chunk_tokens, split between hunks (and between
+# lines of a hunk that is too big on its own); every piece repeats the file header
+def _split_file(section: str, chunk_tokens: int) -> List[str]:
+    if estimate_tokens(section) <= chunk_tokens:
+        return [section]
+    header, *hunks = re.split(r"\n(?=@@)", section)
+    room = max(1, chunk_tokens - estimate_tokens(header) - 1)
+    units: List[str] = []
+    for hunk in hunks:
+        units.extend(
+            [hunk] if estimate_tokens(hunk) <= room else _split_hunk(hunk, room)
+        )
+    if not units:
+        return [header[: chunk_tokens * 4]]
+    pieces: List[str] = []
+    for unit in units:
+        if (
+            pieces
+            and estimate_tokens(pieces[-1]) + estimate_tokens(unit) < chunk_tokens
+        ):
+            pieces[-1] = f"{pieces[-1]}\n{unit}"
+        else:
+            pieces.append(f"{header}\n{unit}")
+    return pieces
+
+
+# splitting a diff into at most max_chunks chunks of whole files, or of whole hunks for a file
+# that is too big on its own; files that do not fit are named in the context instead
+# the text before the first file and an "omitted from this diff" block are returned as context
+def _split_diff(diff: str, chunk_tokens: int, max_chunks: int) -> Tuple[str, List[str]]:
+    context, sep, body = diff.partition("diff --git ")
+    if not sep:
+        return "", [diff]
+    body = sep + body
+    omitted_at = body.find("\n\nomitted from this diff:")
+    if omitted_at != -1:
+        context = context + body[omitted_at + 2 :]
+        body = body[:omitted_at]
+
+    # consecutive files share a directory more often than not, so they are grouped in order
+    chunks: List[str] = []
+    dropped: List[str] = []
+    for section in re.split(r"\n(?=diff --git )", body):
+        name = section.partition("\n")[0].rpartition(" b/")[2]
+        if dropped:
+            dropped.append(name)
+            continue
+        for index, piece in enumerate(_split_file(section, chunk_tokens)):
+            if (
+                chunks
+                and estimate_tokens(chunks[-1]) + estimate_tokens(piece) < chunk_tokens
+            ):
+                chunks[-1] = f"{chunks[-1]}\n{piece}"
+            elif len(chunks) < max_chunks:
+                chunks.append(piece)
+            else:
+                dropped.append(f"{name} (partly)" if index else name)
+                break
+    if dropped:
+        if len(dropped) > 20:
+            dropped = dropped[:20] + [f"and {len(dropped) - 20} more files"]
+        context = "\n".join(
+            [context.rstrip(), "", "not summarised, over the chunk limit:"] + dropped
+        )
+    return context.strip(), chunks
+
+
+# map-reduce commit messages for diffs too large for one prompt
+# each chunk is summarised on its own (concurrently, one llm call per chunk) and a final call
+# turns the summaries into the conventional commit message
+def _generate_commit_message_chunked(diff: str) -> Tuple[str, str]:
+    context, chunks = _split_diff(diff, _commit_chunk_tokens(), _commit_max_chunks())
+    provider, model = get_active_model_provider()
+    summarizer = get_structured_llm(ChunkSummary)
+
+    def summarize(index: int, chunk: str) -> ChunkSummary:
+        messages = [
+            SystemMessage(content=_CHUNK_SYSTEM_PROMPT),
+            HumanMessage(
+                content=f"part {index + 1} of {len(chunks)} of the git diff:\n{chunk}"
+            ),
+        ]
+        return summarizer.invoke(
+            messages,
+            config={"callbacks": [UsageCallback(provider, model)]},
+        )
+
+    workers = min(_commit_map_workers(), len(chunks))
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="asd-commit"
+    ) as pool:
+        summaries = list(pool.map(summarize, range(len(chunks)), chunks))
+
+    parts = [f"- [{s.change_type}] {s.summary}" for s in summaries]
+    content = "summaries of each part of the staged diff:\n" + "\n".join(parts)
+    if context:
+        content = f"{context}\n\n{content}"
+
+    mapper = get_structured_llm(CommitMessage)
+    messages = [
+        SystemMessage(content=_COMMIT_SYSTEM_PROMPT),
+        HumanMessage(content=content),
+    ]
+    result = mapper.invoke(
+        messages,
+        config={"callbacks": [UsageCallback(provider, model)]},
+    )
+    return result.message, result.explanation
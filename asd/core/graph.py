@@ -1,36 +1,97 @@
+import os
+import time
+from typing import Any, Dict, Optional
+
 from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import END, START, StateGraph
 
-from ..ui.display import display_execution_plan, display_git_status
+from ..ui.display import (
+    StreamingPlanView,
+    display_execution_plan,
+    display_git_status,
+)
 from ..ui.loader import stop_loader
+from .commit_precompute import start_commit_precompute
+from .costs import record_plan_latency
 from .executor import execute_plan
-from .git_tools import get_git_status
+from .intent_rules import fast_intent
 from .intents import parse_intent
 from .models import State
-from .planner import generate_execution_plan
+from .planner import generate_execution_plan, generate_intent_and_plan
+from .status_cache import get_cached_git_status
+
 
+# "separate" parses the intent and then plans (two llm calls), "fused" does both in one call
+# (ASD_PLAN_MODE, default separate)
+def _plan_mode() -> str:
+    mode = os.getenv("ASD_PLAN_MODE", "separate").strip().lower()
+    return mode if mode in ("separate", "fused") else "separate"
 
-def create_git_assistant():
+
+def create_git_assistant(plan_mode: Optional[str] = None):
+    plan_mode = plan_mode or _plan_mode()
     graph = StateGraph(State)
 
     # analyze git context (to understand the current state of the repo)
-    def analyze_git_context(state: State) -> State:
-        git_status = get_git_status()
-        return state.copy(update={"git_status": git_status})
+    # served from the session status cache, which returns immediately when nothing changed
+    # analyze and intent run side by side, so each returns only the state keys it owns
+    def analyze_git_context(state: State) -> Dict[str, Any]:
+        return {"git_status": get_cached_git_status()}
 
     # parse the user's intent (to understand what they want to do)
-    def parse_git_intent(state: State) -> State:
+    def parse_git_intent(state: State) -> Dict[str, Any]:
+        started = time.perf_counter()
         intent = parse_intent(state.input)
-        return state.copy(update={"intent": intent})
+        return {
+            "intent": intent,
+            "planning_seconds": time.perf_counter() - started,
+        }
 
     # create an execution plan (to understand the steps needed to achieve the user's intent)
     def create_execution_plan(state: State) -> State:
-        plan = generate_execution_plan(state)
-        return state.copy(update={"plan": plan})
+        started = time.perf_counter()
+        # steps are rendered as they stream in; the view only opens if the llm is streaming
+        view = StreamingPlanView(state.git_status, on_open=stop_loader)
+        try:
+            plan = generate_execution_plan(state, on_step=view.add_step)
+            view.finish(plan)
+        finally:
+            view.close()
+        return state.copy(
+            update={
+                "plan": plan,
+                "plan_shown": view.steps > 0,
+                "planning_seconds": state.planning_seconds
+                + time.perf_counter()
+                - started,
+            }
+        )
+
+    # parse the intent and create the plan in a single llm call (fused mode)
+    def create_intent_and_plan(state: State) -> State:
+        started = time.perf_counter()
+        # a request the local classifier recognises only needs the plan
+        intent = fast_intent(state.input)
+        if intent is not None:
+            plan = generate_execution_plan(state.copy(update={"intent": intent}))
+        else:
+            intent, plan = generate_intent_and_plan(state)
+        return state.copy(
+            update={
+                "intent": intent,
+                "plan": plan,
+                "planning_seconds": time.perf_counter() - started,
+            }
+        )
 
     # show plan overview before step-by-step execution
     def show_plan_overview(state: State) -> State:
         stop_loader()
+        record_plan_latency(plan_mode, state.planning_seconds)
+        # the commit message is written while the user reads the plan
+        start_commit_precompute(state.plan)
+        if state.plan_shown:
+            return state
         from ..ui.display import console
 
         console.print()
@@ -39,16 +100,26 @@ def create_git_assistant():
         return state
 
     graph.add_node("analyze", analyze_git_context)
-    graph.add_node("intent", parse_git_intent)
-    graph.add_node("plan", create_execution_plan)
+    if plan_mode == "fused":
+        graph.add_node("intent_plan", create_intent_and_plan)
+    else:
+        graph.add_node("intent", parse_git_intent)
+        graph.add_node("plan", create_execution_plan)
     graph.add_node("show", show_plan_overview)
     graph.add_node("execute", execute_plan)  # step-by-step approval
 
     # added show node to show the plan overview before step-by-step execution
     graph.add_edge(START, "analyze")
-    graph.add_edge("analyze", "intent")
-    graph.add_edge("intent", "plan")
-    graph.add_edge("plan", "show")
+    if plan_mode == "fused":
+        # the fused call plans too, so it needs the status first
+        graph.add_edge("analyze", "intent_plan")
+        graph.add_edge("intent_plan", "show")
+    else:
+        # intent parsing never reads the status and status collection never reads the
+        # intent: both start together and plan waits for the two of them
+        graph.add_edge(START, "intent")
+        graph.add_edge(["analyze", "intent"], "plan")
+        graph.add_edge("plan", "show")
     graph.add_edge("show", "execute")  # go directly to execute
     graph.add_edge("execute", END)  # always end after execute
 
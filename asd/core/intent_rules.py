@@ -0,0 +1,247 @@
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+
+from .models import GitAction, Intent
+
+# a branch, remote or file name as users type them
+_NAME = r"[\w][\w./@-]*"
+# a quoted commit message
+_MESSAGE = r"""["'](?P<message>[^"']+)["']"""
+
+# polite lead-ins and tails that do not change what is asked
+_LEAD = re.compile(
+    r"^(?:(?:please|pls|can you|could you|would you|i want to|i'd like to|i need to|"
+    r"let'?s|help me|go ahead and|just)\s+)+",
+    re.IGNORECASE,
+)
+_TAIL = re.compile(r"(?:\s+(?:please|for me|now|thanks|thank you))+$", re.IGNORECASE)
+
+# words that mean the request needs more care than a fixed mapping can give
+_CAREFUL = re.compile(
+    r"\b(?:force|hard|delete|remove|drop|rewrite|without losing|"
+    r"what would happen|what if|accidentally|messed|wrong)\b",
+    re.IGNORECASE,
+)
+
+
+# a phrase pattern with the intent it stands for
+# build receives the named groups; confidence says how unambiguous the phrasing is
+# verify, when given, checks the groups against the repository; a match it rejects keeps
+# only the unverified confidence, which is below the threshold, so the llm decides
+class IntentRule:
+    def __init__(
+        self,
+        pattern: str,
+        build: Callable[[Dict[str, Any]], Intent],
+        confidence: float = 0.9,
+        verify: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        unverified_confidence: float = 0.5,
+    ) -> None:
+        self.pattern: Pattern[str] = re.compile(pattern, re.IGNORECASE)
+        self.build = build
+        self.confidence = confidence
+        self.verify = verify
+        self.unverified_confidence = unverified_confidence
+
+    def match(self, text: str) -> Optional[Tuple[Intent, float]]:
+        found = self.pattern.fullmatch(text)
+        if found is None:
+            return None
+        groups = {k: v for k, v in found.groupdict().items() if v}
+        if self.verify is not None and not self.verify(groups):
+            return self.build(groups), self.unverified_confidence
+        return self.build(groups), self.confidence
+
+
+def _undo_last_commit(groups: Dict[str, Any]) -> Intent:
+    return Intent(
+        primary_action=GitAction.RESET,
+        targets=["HEAD~1"],
+        safety_concern="don't lose changes" if groups.get("keep") else None,
+        learning_goal="understand difference between reset types",
+    )
+
+
+def _commit(groups: Dict[str, Any]) -> Intent:
+    return Intent(
+        primary_action=GitAction.COMMIT,
+        targets=["."] if groups.get("all") else None,
+        commit_message=groups.get("message"),
+    )
+
+
+def _push(groups: Dict[str, Any]) -> Intent:
+    remote = groups.get("remote")
+    return Intent(
+        primary_action=GitAction.PUSH,
+        targets=[remote] if remote else None,
+        branch_name=groups.get("branch"),
+    )
+
+
+def _pull(groups: Dict[str, Any]) -> Intent:
+    return Intent(primary_action=GitAction.PULL, branch_name=groups.get("branch"))
+
+
+def _sync(groups: Dict[str, Any]) -> Intent:
+    return Intent(
+        primary_action=GitAction.FETCH,
+        secondary_actions=[GitAction.MERGE],
+        branch_name=groups["branch"],
+        targets=[groups["branch"]],
+    )
+
+
+def _new_branch(groups: Dict[str, Any]) -> Intent:
+    return Intent(
+        primary_action=GitAction.BRANCH,
+        secondary_actions=[GitAction.CHECKOUT] if groups.get("switch") else [],
+        branch_name=groups["branch"],
+    )
+
+
+def _switch(groups: Dict[str, Any]) -> Intent:
+    return Intent(primary_action=GitAction.CHECKOUT, branch_name=groups["branch"])
+
+
+def _stage(groups: Dict[str, Any]) -> Intent:
+    files = groups.get("files")
+    return Intent(
+        primary_action=GitAction.ADD, targets=files.split() if files else ["."]
+    )
+
+
+# "add .env to gitignore" or "add a readme file" read like a file list too; only a list
+# of paths that all exist is taken as one
+def _paths_exist(groups: Dict[str, Any]) -> bool:
+    files = groups.get("files", "").split()
+    return bool(files) and all(os.path.lexists(path) for path in files)
+
+
+def _amend(groups: Dict[str, Any]) -> Intent:
+    return Intent(primary_action=GitAction.AMEND, commit_message=groups.get("message"))
+
+
+def _action(action: GitAction, **fields: Any) -> Callable[[Dict[str, Any]], Intent]:
+    return lambda groups: Intent(primary_action=action, **fields)
+
+
+# the phrasings listed in the intent system prompt, plus the everyday ones around them
+RULES: List[IntentRule] = [
+    IntentRule(
+        r"(?:undo|take back) (?:my |the )?(?:last|latest|previous) commit"
+        r"(?P<keep>,? (?:but |and )?keep(?:ing)? (?:my |the )?(?:changes|work|files))?",
+        _undo_last_commit,
+    ),
+    # revert adds a commit that undoes the last one instead of rewriting history
+    IntentRule(
+        r"revert (?:my |the )?(?:last|latest|previous) commit",
+        _action(GitAction.REVERT, targets=["HEAD"]),
+    ),
+    IntentRule(
+        r"(?:save|stash) my (?:work|changes)(?: for later)?",
+        _action(GitAction.STASH, safety_concern="don't lose uncommitted work"),
+        confidence=0.85,
+    ),
+    IntentRule(
+        rf"(?:sync|update) (?:my |this |the current )?(?:branch )?with (?P<branch>{_NAME})",
+        _sync,
+    ),
+    IntentRule(
+        rf"push(?: (?:my|the|all))?(?: (?:changes|commits|work|code))?"
+        rf"(?: to (?P<remote>{_NAME})(?: (?P<branch>{_NAME}))?)?",
+        _push,
+    ),
+    IntentRule(
+        rf"pull(?: (?:the )?(?:latest|new)?(?: changes| commits)?)?(?: from (?P<branch>{_NAME}))?",
+        _pull,
+    ),
+    IntentRule(
+        rf"commit(?: (?P<all>all|everything|all my changes|my changes|my work))?"
+        rf"(?: with(?: the)? message)?(?: {_MESSAGE})?",
+        _commit,
+    ),
+    IntentRule(
+        rf"(?:create|make|start|open) (?:a )?(?:new )?branch (?:called |named )?(?P<branch>{_NAME})"
+        r"(?P<switch> and (?:switch|check ?out|move) to it)?",
+        _new_branch,
+    ),
+    IntentRule(
+        rf"(?:switch|checkout|check out|change|move) to (?:the )?(?:branch )?(?P<branch>{_NAME})(?: branch)?",
+        _switch,
+    ),
+    IntentRule(
+        r"(?:stage|add) (?:all |all of )?(?:my |the )?(?:changes|files|everything|all)",
+        _stage,
+    ),
+    IntentRule(
+        r"(?:stage|add) (?!(?:a |the )?remote\b)(?P<files>[\w./-]+(?: [\w./-]+)*)",
+        _stage,
+        0.85,
+        verify=_paths_exist,
+    ),
+    IntentRule(
+        rf"(?:fix|change|edit|amend|reword) (?:my |the )?last commit(?:'s)? message(?: to {_MESSAGE})?",
+        _amend,
+    ),
+    IntentRule(
+        r"(?:show |check )?(?:me )?(?:the |my )?(?:git |repo |repository )?status|"
+        r"what'?s (?:the )?(?:git )?status|what changed|what did i change",
+        _action(GitAction.STATUS),
+    ),
+    IntentRule(
+        r"(?:show|view|see) (?:me )?(?:the |my )?(?:commit )?(?:history|log)|git log",
+        _action(GitAction.LOG),
+    ),
+    IntentRule(
+        r"(?:show|view|see) (?:me )?(?:the |my )?(?:diff|changes|unstaged changes)",
+        _action(GitAction.DIFF),
+    ),
+    IntentRule(
+        rf"fetch(?: (?:the )?(?:latest|updates|changes))?(?: from (?P<remote>{_NAME}))?",
+        lambda groups: Intent(
+            primary_action=GitAction.FETCH,
+            targets=[groups["remote"]] if groups.get("remote") else None,
+        ),
+    ),
+]
+
+
+# the least confidence a local match needs to skip the llm (ASD_FAST_INTENT_CONFIDENCE, default 0.8)
+def _min_confidence() -> float:
+    try:
+        return float(os.getenv("ASD_FAST_INTENT_CONFIDENCE", "0.8"))
+    except ValueError:
+        return 0.8
+
+
+# the request without extra whitespace, trailing punctuation and polite lead-ins or tails
+def normalize_request(text: str) -> str:
+    text = " ".join(text.strip().split())
+    text = text.rstrip(".!?")
+    text = _LEAD.sub("", text)
+    return _TAIL.sub("", text).strip()
+
+
+# the intent for a request phrased the way most requests are, with its confidence
+# only whole-request matches count, anything longer or hedged is left to the llm
+def classify_intent(user_input: str) -> Optional[Tuple[Intent, float]]:
+    text = normalize_request(user_input)
+    if not text or _CAREFUL.search(text):
+        return None
+    for rule in RULES:
+        result = rule.match(text)
+        if result is not None:
+            return result
+    return None
+
+
+# the local intent when it is confident enough, None to ask the llm (ASD_FAST_INTENT=0 disables it)
+def fast_intent(user_input: str) -> Optional[Intent]:
+    if os.getenv("ASD_FAST_INTENT", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+    result = classify_intent(user_input)
+    if result is None or result[1] < _min_confidence():
+        return None
+    return result[0]
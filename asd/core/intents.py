@@ -1,10 +1,8 @@
-import os
-
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
 
 from .costs import UsageCallback, get_active_model_provider
+from .intent_rules import fast_intent
+from .llm import get_structured_llm
 from .models import Intent
 
 SYSTEM_PROMPT = """you are a git safety and education assistant. your job is to understand what the user wants to do with git, 
@@ -45,20 +43,13 @@ focus on git operations only. if the user asks about non-git tasks, set primary_
 
 
 # capturing user's intent using an LLM and system prompt with structured outputs
-def get_llm():
-    if os.getenv("GOOGLE_API_KEY"):
-        return ChatGoogleGenerativeAI(
-            model=os.getenv("GOOGLE_MODEL", "gemini-2.5-flash"),
-            api_key=os.getenv("GOOGLE_API_KEY"),
-        )
-    return ChatOpenAI(
-        model=os.getenv("OPENAI_MODEL", "o4-mini"), api_key=os.getenv("OPENAI_API_KEY")
-    )
-
-
+# the everyday phrasings are mapped locally first and never reach the llm
 def parse_intent(user_input: str) -> Intent:
-    llm = get_llm()
-    mapper = llm.with_structured_output(Intent)
+    intent = fast_intent(user_input)
+    if intent is not None:
+        return intent
+
+    mapper = get_structured_llm(Intent)
 
     messages = [
         SystemMessage(content=SYSTEM_PROMPT),
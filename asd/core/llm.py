@@ -0,0 +1,392 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, List, Optional, Tuple, Type
+
+from langchain_core.utils.function_calling import convert_to_json_schema
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+
+from .costs import (
+    UsageCallback,
+    get_active_model_provider,
+    get_llm_backend,
+    provider_api_key,
+    provider_model,
+)
+
+logger = logging.getLogger(__name__)
+
+# one chat client per provider, model and api key, shared by the intent, plan, recovery and
+# commit message calls so their http connections (and tls sessions) are reused between requests
+_clients: Dict[Tuple[str, str, str], Any] = {}
+# structured output runnables per client and schema, binding the schema is not free either
+_structured: Dict[Tuple[str, str, str, Type[BaseModel]], Any] = {}
+_streaming: Dict[Tuple[str, str, str, Type[BaseModel]], Any] = {}
+_lock = threading.Lock()
+
+_PROVIDERS = ("google", "openai")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() not in ("0", "false", "no", "off")
+
+
+def _client_key(provider: Optional[str] = None) -> Tuple[str, str, str]:
+    if provider is None:
+        provider, model = get_active_model_provider()
+    else:
+        model = provider_model(provider)
+    return provider, model, provider_api_key(provider) or ""
+
+
+# the clients do not retry on their own, StructuredCall owns retries so it can hedge and
+# keep the deadline (ASD_LLM_TIMEOUT seconds per request, default 60)
+def _build_client(provider: str, model: str, api_key: str) -> Any:
+    timeout = _env_float("ASD_LLM_TIMEOUT", 60.0)
+    if provider == "google":
+        return ChatGoogleGenerativeAI(
+            model=model, api_key=api_key, timeout=timeout, max_retries=0
+        )
+    return ChatOpenAI(model=model, api_key=api_key, timeout=timeout, max_retries=0)
+
+
+# the chat client for the active provider and model, built once per session
+def get_llm(provider: Optional[str] = None) -> Any:
+    key = _client_key(provider)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _build_client(*key)
+            _clients[key] = client
+        return client
+
+
+# the client bound to a structured output schema, cached alongside the client
+def _structured_runnable(
+    schema: Type[BaseModel], provider: Optional[str] = None
+) -> Any:
+    key = _client_key(provider)
+    llm = get_llm(key[0])
+    with _lock:
+        runnable = _structured.get((*key, schema))
+        if runnable is None:
+            runnable = llm.with_structured_output(schema)
+            _structured[(*key, schema)] = runnable
+        return runnable
+
+
+# the structured output call for a schema with deadlines, retries and optional hedging
+def get_structured_llm(schema: Type[BaseModel]) -> "StructuredCall":
+    return StructuredCall(schema)
+
+
+# the client bound to the json schema of a model instead of the model itself: the output is
+# parsed incrementally into growing dicts, so a caller can use parts of it while it streams
+def get_streaming_llm(schema: Type[BaseModel]) -> Any:
+    key = _client_key()
+    llm = get_llm()
+    with _lock:
+        runnable = _streaming.get((*key, schema))
+        if runnable is None:
+            runnable = llm.with_structured_output(convert_to_json_schema(schema))
+            _streaming[(*key, schema)] = runnable
+        return runnable
+
+
+# dropping every cached client, called when the model selection changes
+def invalidate_llm_clients() -> None:
+    with _lock:
+        _clients.clear()
+        _structured.clear()
+        _streaming.clear()
+
+
+# the http status behind an error, following the chain langchain wraps sdk errors in
+def _status_code(exc: BaseException) -> Optional[int]:
+    seen = set()
+    current: Optional[BaseException] = exc
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        for attr in ("status_code", "code"):
+            value = getattr(current, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+        current = current.__cause__ or current.__context__
+    return None
+
+
+# rate limits, server errors, timeouts and dropped connections are worth another attempt;
+# a bad request or a bad key fails the same way every time
+def _retryable(exc: BaseException) -> bool:
+    status = _status_code(exc)
+    if status is not None:
+        return status in (408, 429) or status >= 500
+    seen = set()
+    current: Optional[BaseException] = exc
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if isinstance(current, (TimeoutError, ConnectionError)):
+            return True
+        name = type(current).__name__
+        if "Timeout" in name or "Connection" in name:
+            return True
+        current = current.__cause__ or current.__context__
+    return False
+
+
+# latencies of recent successful calls per provider and model, for the hedging threshold
+_latencies: Dict[Tuple[str, str], Deque[float]] = {}
+_latency_lock = threading.Lock()
+_HEDGE_SAMPLES = 10
+
+
+def _record_latency(provider: str, model: str, seconds: float) -> None:
+    with _latency_lock:
+        _latencies.setdefault((provider, model), deque(maxlen=100)).append(seconds)
+
+
+# how long the primary provider gets before the other one is asked too: the p95 of its recent
+# latencies once there are enough of them, ASD_LLM_HEDGE_AFTER seconds (default 10) before
+def hedge_delay(provider: str, model: str) -> float:
+    with _latency_lock:
+        samples = sorted(_latencies.get((provider, model), ()))
+    if len(samples) < _HEDGE_SAMPLES:
+        return _env_float("ASD_LLM_HEDGE_AFTER", 10.0)
+    return max(1.0, samples[int(0.95 * (len(samples) - 1))])
+
+
+def _hedge_provider(primary: str) -> Optional[str]:
+    if not _env_flag("ASD_LLM_HEDGE", "0"):
+        return None
+    for provider in _PROVIDERS:
+        if provider != primary and provider_api_key(provider):
+            return provider
+    return None
+
+
+# the same config with usage accounted to the provider that actually answers
+def _config_for(config: Optional[Dict[str, Any]], provider: str) -> Dict[str, Any]:
+    config = dict(config or {})
+    callbacks = [
+        cb for cb in config.get("callbacks") or [] if not isinstance(cb, UsageCallback)
+    ]
+    callbacks.append(UsageCallback(provider, provider_model(provider)))
+    config["callbacks"] = callbacks
+    return config
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+# attempts cut short by the deadline run here, apart from the hedging pool whose workers
+# wait on them
+_attempt_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="asd-llm")
+        return _pool
+
+
+def _attempt_executor() -> ThreadPoolExecutor:
+    global _attempt_pool
+    with _lock:
+        if _attempt_pool is None:
+            _attempt_pool = ThreadPoolExecutor(
+                max_workers=16, thread_name_prefix="asd-llm-attempt"
+            )
+        return _attempt_pool
+
+
+def _deadline_error() -> TimeoutError:
+    return TimeoutError(
+        f"no llm answer within {_env_float('ASD_LLM_DEADLINE', 120.0)}s"
+    )
+
+
+# a structured output request that retries 429s, 5xx and timeouts with jittered exponential
+# backoff inside a deadline (ASD_LLM_RETRIES, default 3; ASD_LLM_DEADLINE seconds, default 120)
+# with ASD_LLM_HEDGE=1 and keys for both providers, a request the primary has not answered
+# within its p95 latency is sent to the other provider as well and the first valid result wins
+class StructuredCall:
+    def __init__(self, schema: Type[BaseModel]) -> None:
+        self.schema = schema
+
+    def invoke(
+        self, messages: List[Any], config: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        backend = get_llm_backend()
+        if backend != "live":
+            # imported here, the replay module reaches git_tools which imports this one
+            from . import llm_replay
+
+            if backend == "replay":
+                return llm_replay.replay_response(self.schema, messages, config)
+            if backend == "stub":
+                return llm_replay.stub_response(self.schema, messages, config)
+            return llm_replay.record_response(
+                self.schema, messages, config, self._invoke_live
+            )
+        return self._invoke_live(messages, config)
+
+    def _invoke_live(
+        self, messages: List[Any], config: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        primary, model = get_active_model_provider()
+        deadline = time.monotonic() + _env_float("ASD_LLM_DEADLINE", 120.0)
+        other = _hedge_provider(primary)
+        if other is None:
+            return self._with_retries(primary, messages, config, deadline)
+        return self._hedged(primary, model, other, messages, config, deadline)
+
+    # one request, given no more than what is left of the deadline: the client's own timeout
+    # covers it when enough is left, otherwise the caller stops waiting when the deadline passes
+    # and the abandoned request ends at the client timeout
+    def _attempt(
+        self,
+        provider: str,
+        messages: List[Any],
+        config: Optional[Dict[str, Any]],
+        deadline: float,
+    ) -> Any:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise _deadline_error()
+        runnable = _structured_runnable(self.schema, provider)
+        started = time.monotonic()
+        if remaining >= _env_float("ASD_LLM_TIMEOUT", 60.0):
+            result = runnable.invoke(messages, config=config)
+        else:
+            future = _attempt_executor().submit(
+                runnable.invoke, messages, config=config
+            )
+            if not wait([future], timeout=remaining).done:
+                future.cancel()
+                raise _deadline_error()
+            result = future.result()
+        if not isinstance(result, self.schema):
+            raise ValueError(f"{provider} returned no valid {self.schema.__name__}")
+        _record_latency(provider, provider_model(provider), time.monotonic() - started)
+        return result
+
+    def _with_retries(
+        self,
+        provider: str,
+        messages: List[Any],
+        config: Optional[Dict[str, Any]],
+        deadline: float,
+    ) -> Any:
+        retries = int(_env_float("ASD_LLM_RETRIES", 3))
+        config = _config_for(config, provider)
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(provider, messages, config, deadline)
+            except Exception as e:
+                if attempt >= retries or not _retryable(e):
+                    raise
+                # full jitter, so concurrent chunk summaries do not retry in lockstep
+                backoff = random.uniform(0, min(20.0, 0.5 * 2**attempt))
+                if time.monotonic() + backoff >= deadline:
+                    raise
+                logger.info(
+                    "%s call failed (%s), retrying in %.1fs", provider, e, backoff
+                )
+                time.sleep(backoff)
+                attempt += 1
+
+    def _hedged(
+        self,
+        primary: str,
+        model: str,
+        other: str,
+        messages: List[Any],
+        config: Optional[Dict[str, Any]],
+        deadline: float,
+    ) -> Any:
+        pool = _executor()
+        futures: Dict[Future, str] = {
+            pool.submit(
+                self._with_retries, primary, messages, config, deadline
+            ): primary
+        }
+        first_error: Optional[BaseException] = None
+        hedged = False
+        wait_for: Optional[float] = hedge_delay(primary, model)
+        while futures:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            timeout = remaining if wait_for is None else min(wait_for, remaining)
+            done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.pop(future)
+                try:
+                    # the slower call keeps running and still records its usage
+                    return future.result()
+                except Exception as e:
+                    first_error = first_error or e
+            # the primary is slow or failed: ask the other provider too, once
+            if not hedged:
+                hedged = True
+                wait_for = None
+                logger.info("hedging %s request to %s", primary, other)
+                futures[
+                    pool.submit(self._with_retries, other, messages, config, deadline)
+                ] = other
+        if first_error is not None:
+            raise first_error
+        raise _deadline_error()
+
+
+# a cheap request that costs no tokens but opens the connection the first real call will reuse
+def _warm(schemas: Tuple[Type[BaseModel], ...]) -> None:
+    try:
+        provider, model, _ = _client_key()
+        llm = get_llm()
+        for schema in schemas:
+            _structured_runnable(schema)
+        if provider == "google":
+            llm.client.models.get(model=model)
+        else:
+            llm.root_client.with_options(timeout=5, max_retries=0).models.retrieve(
+                model
+            )
+    except Exception:
+        # warming is best effort, the first real call will report any problem
+        pass
+
+
+# building the client, binding the structured schemas and opening a connection in the
+# background while the welcome screen is up (ASD_LLM_WARMUP=0 disables it)
+def warm_llm_client() -> Optional[threading.Thread]:
+    if os.getenv("ASD_LLM_WARMUP", "1").strip().lower() in ("0", "false", "no", "off"):
+        return None
+    # replayed and stubbed sessions never open a connection
+    if get_llm_backend() in ("replay", "stub"):
+        return None
+    from .git_tools import CommitMessage
+    from .models import ExecutionPlan, Intent
+
+    thread = threading.Thread(
+        target=_warm,
+        args=((Intent, ExecutionPlan, CommitMessage),),
+        name="asd-llm-warmup",
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from pydantic import BaseModel
+
+from .costs import UsageCallback, get_active_model_provider
+from .git_tools import estimate_tokens
+from .intent_rules import classify_intent
+from .models import (
+    ExecutionPlan,
+    ExecutionStep,
+    GitAction,
+    Intent,
+    IntentAndPlan,
+    SafetyLevel,
+)
+from .plan_cache import cache_dir
+
+# bumped whenever the key or the cassette layout changes
+_SCHEMA = 1
+_write_lock = threading.Lock()
+
+
+# where cassettes live (ASD_LLM_CASSETTES overrides the per-user cache directory)
+def cassette_dir() -> str:
+    return os.getenv("ASD_LLM_CASSETTES") or os.path.join(cache_dir(), "cassettes")
+
+
+# a hash of the schema and the exact messages sent, the same prompt replays the same answer
+def cassette_key(schema: Type[BaseModel], messages: List[Any]) -> str:
+    parts = {
+        "schema": _SCHEMA,
+        "output": schema.__name__,
+        "messages": [
+            [getattr(m, "type", type(m).__name__), getattr(m, "content", str(m))]
+            for m in messages
+        ],
+    }
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _cassette_path(schema: Type[BaseModel], key: str) -> str:
+    return os.path.join(cassette_dir(), f"{schema.__name__}-{key}.json")
+
+
+# the synthetic latency of a replayed answer (ASD_LLM_REPLAY_LATENCY): seconds, or
+# "recorded" to wait as long as the recorded call took; none by default
+def _replay_latency(recorded: float) -> float:
+    value = os.getenv("ASD_LLM_REPLAY_LATENCY", "0").strip().lower()
+    if value == "recorded":
+        return recorded
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return 0.0
+
+
+# handing the usage of an answer that never reached a provider to the config's callbacks,
+# in the openai format UsageCallback reads, so cost tracking sees replayed calls too
+def _report_usage(config: Optional[Dict[str, Any]], usage: Dict[str, int]) -> None:
+    result = LLMResult(
+        generations=[],
+        llm_output={
+            "token_usage": {
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "prompt_tokens_details": {
+                    "cached_tokens": usage.get("cached_tokens", 0)
+                },
+            }
+        },
+    )
+    for callback in (config or {}).get("callbacks") or []:
+        if isinstance(callback, BaseCallbackHandler):
+            callback.on_llm_end(result)
+
+
+# keeps the raw result of the live call so its usage can be stored with the response
+class _ResultCapture(BaseCallbackHandler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.result: Optional[LLMResult] = None
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        if self.result is None:
+            self.result = response
+
+
+# answering with the live call and saving the response, its usage and its latency
+def record_response(
+    schema: Type[BaseModel],
+    messages: List[Any],
+    config: Optional[Dict[str, Any]],
+    call: Callable[[List[Any], Optional[Dict[str, Any]]], Any],
+) -> Any:
+    capture = _ResultCapture()
+    config = dict(config or {})
+    config["callbacks"] = list(config.get("callbacks") or []) + [capture]
+    started = time.monotonic()
+    response = call(messages, config)
+    latency = time.monotonic() - started
+
+    provider, model = get_active_model_provider()
+    usage: Dict[str, int] = {}
+    if capture.result is not None:
+        usage = UsageCallback(provider, model).parse_usage(capture.result)
+    key = cassette_key(schema, messages)
+    entry = {
+        "schema": schema.__name__,
+        "provider": provider,
+        "model": model,
+        "latency": round(latency, 3),
+        "usage": usage,
+        "response": json.loads(response.json()),
+    }
+    path = _cassette_path(schema, key)
+    with _write_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+    return response
+
+
+# answering from a recorded cassette, never from the network
+def replay_response(
+    schema: Type[BaseModel],
+    messages: List[Any],
+    config: Optional[Dict[str, Any]],
+) -> Any:
+    key = cassette_key(schema, messages)
+    path = _cassette_path(schema, key)
+    try:
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        raise LookupError(
+            f"no recorded {schema.__name__} response for this prompt ({key[:12]}), "
+            "run once with ASD_LLM_BACKEND=record"
+        ) from None
+    response = schema.parse_obj(entry["response"])
+    time.sleep(_replay_latency(float(entry.get("latency", 0.0))))
+    _report_usage(config, entry.get("usage") or {})
+    return response
+
+
+def _human_text(messages: List[Any]) -> str:
+    return "\n".join(
+        str(m.content) for m in messages if getattr(m, "type", "") == "human"
+    )
+
+
+def _stub_intent(text: str) -> Intent:
+    request = text.split("user request:", 1)[-1].strip()
+    found = classify_intent(request)
+    if found is not None:
+        return found[0]
+    return Intent(primary_action=GitAction.STATUS)
+
+
+def _stub_plan(text: str) -> ExecutionPlan:
+    step = ExecutionStep(
+        command="git status",
+        description="show the state of the working tree",
+        safety_level=SafetyLevel.SAFE,
+        educational_note="status is read only and shows what git sees",
+    )
+    return ExecutionPlan(
+        steps=[step],
+        total_steps=1,
+        overall_safety=SafetyLevel.SAFE,
+        summary="check the repository status",
+        educational_summary="status is the first thing to look at before changing anything",
+    )
+
+
+def _stub_commit(text: str) -> Any:
+    from .git_tools import CommitMessage
+
+    files = len(re.findall(r"^diff --git ", text, re.MULTILINE))
+    noun = "file" if files == 1 else "files"
+    return CommitMessage(
+        message=f"chore: update {files} {noun}",
+        explanation="fixed message from the stub backend",
+    )
+
+
+def _stub_chunk(text: str) -> Any:
+    from .git_tools import ChunkSummary
+
+    files = len(re.findall(r"^diff --git ", text, re.MULTILINE))
+    return ChunkSummary(summary=f"changes to {files} files", change_type="chore")
+
+
+_STUBS: Dict[str, Callable[[str], Any]] = {
+    "Intent": _stub_intent,
+    "ExecutionPlan": _stub_plan,
+    "IntentAndPlan": lambda text: IntentAndPlan(
+        intent=_stub_intent(text), plan=_stub_plan(text)
+    ),
+    "CommitMessage": _stub_commit,
+    "ChunkSummary": _stub_chunk,
+}
+
+
+# a fixed answer derived only from the prompt, with token counts from the prompt and the
+# answer so costs are tracked as if a provider had answered; the counts come from the estimate,
+# which is the same on every machine and never needs the network
+def stub_response(
+    schema: Type[BaseModel],
+    messages: List[Any],
+    config: Optional[Dict[str, Any]],
+) -> Any:
+    build = _STUBS.get(schema.__name__)
+    if build is None:
+        raise LookupError(f"the stub backend has no {schema.__name__} response")
+    response = build(_human_text(messages))
+    time.sleep(_replay_latency(0.0))
+    prompt = "\n".join(str(getattr(m, "content", m)) for m in messages)
+    _report_usage(
+        config,
+        {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": estimate_tokens(response.json()),
+        },
+    )
+    return response
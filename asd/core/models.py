@@ -76,12 +76,23 @@ class GitStatus(BaseModel):
     staged: List[str] = Field(default_factory=list, description="staged files")
     modified: List[str] = Field(default_factory=list, description="modified files")
     untracked: List[str] = Field(default_factory=list, description="untracked files")
+    # exact counts; the lists above may only hold a sample of the paths
+    staged_count: int = Field(0, description="number of staged files")
+    modified_count: int = Field(0, description="number of modified files")
+    untracked_count: int = Field(0, description="number of untracked files")
+    paths_truncated: bool = Field(
+        False, description="file lists hold only a sample of the paths"
+    )
     ahead: int = Field(0, description="commits ahead of origin")
     behind: int = Field(0, description="commits behind origin")
     conflicts: bool = Field(False, description="merge conflicts present")
 
     # enhanced git context
     total_commits: int = Field(0, description="total commits in current branch")
+    total_commits_capped: bool = Field(
+        False,
+        description="total_commits is a lower bound, the history was not fully counted",
+    )
     uncommitted_changes: int = Field(0, description="number of modified + staged files")
     has_remote: bool = Field(False, description="repository has remote configured")
     remote_name: str = Field("", description="primary remote name")
@@ -138,6 +149,12 @@ class ExecutionPlan(BaseModel):
     )
 
 
+# intent and plan from one structured call, for the fused planning mode
+class IntentAndPlan(BaseModel):
+    intent: Intent = Field(..., description="what the user wants to do with git")
+    plan: ExecutionPlan = Field(..., description="the plan that fulfils the intent")
+
+
 # the result of each step in the execution plan
 class StepResult(BaseModel):
     command: str = Field(..., description="command that was executed")
@@ -158,6 +175,12 @@ class State(BaseModel):
     git_status: Optional[GitStatus] = None
     # the execution plan is stored in the execution plan model
     plan: Optional[ExecutionPlan] = None
+    # whether the plan was already rendered while it streamed in
+    plan_shown: bool = Field(False, description="plan rendered during streaming")
+    # wall time spent on the intent and plan llm calls, to compare the planning modes
+    planning_seconds: float = Field(
+        0.0, description="seconds from the start of intent parsing to the plan"
+    )
     # the user's approval is stored in the user approval model
     user_approval: Optional[bool] = None
     # the step results are stored in the step result model
@@ -0,0 +1,288 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .git_backend import probe_env
+from .git_tools import run_git_command
+from .intent_rules import normalize_request
+from .models import ExecutionPlan, GitStatus, Intent
+from .repo_meta import find_git_dirs, find_work_tree
+
+logger = logging.getLogger(__name__)
+
+# bumped whenever the shape of a key or a stored plan changes, so old entries stop matching
+_SCHEMA = 2
+
+# the git status fields a plan can depend on; the HEAD sha is one of them because revert,
+# reset and show plans name concrete commits, while the commit count and the last commit
+# message follow from it
+_STATUS_FIELDS = (
+    "is_repo",
+    "last_commit_hash",
+    "current_branch",
+    "staged",
+    "modified",
+    "untracked",
+    "staged_count",
+    "modified_count",
+    "untracked_count",
+    "ahead",
+    "behind",
+    "conflicts",
+    "has_remote",
+    "remote_name",
+    "stash_count",
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+# the per-user cache directory (ASD_CACHE_DIR overrides it)
+def cache_dir() -> str:
+    override = os.getenv("ASD_CACHE_DIR")
+    if override:
+        return override
+    if sys.platform == "win32":
+        base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "asd")
+
+
+# the staged blobs decide the commit message a plan proposes, so they are part of the fingerprint
+def _staged_fingerprint(status: GitStatus) -> str:
+    if not status.staged_count:
+        return ""
+    result = run_git_command(
+        ["git", "diff", "--staged", "--raw", "--no-abbrev", "-z"],
+        suppress_errors=True,
+        env=probe_env(),
+        timeout=10,
+    )
+    if not result["success"]:
+        return "unknown"
+    return hashlib.sha256(result["stdout"].encode("utf-8")).hexdigest()
+
+
+# the repository a plan belongs to: two clones with the same branch and file shape must not
+# share plans
+def _repo_root() -> str:
+    work_tree = find_work_tree()
+    if work_tree:
+        return os.path.realpath(work_tree)
+    dirs = find_git_dirs()
+    return os.path.realpath(dirs[1]) if dirs else ""
+
+
+# a fingerprint of the parts of the repository state a plan is built from
+def status_fingerprint(status: Optional[GitStatus]) -> str:
+    if status is None:
+        return ""
+    fields = {name: getattr(status, name) for name in _STATUS_FIELDS}
+    fields["repo"] = _repo_root()
+    fields["staged_blobs"] = _staged_fingerprint(status)
+    return hashlib.sha256(
+        json.dumps(fields, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+# the cache key: normalized request, intent, repository fingerprint and the model and prompt
+# that produced the plan
+def plan_cache_key(
+    request: str,
+    intent: Optional[Intent],
+    status: Optional[GitStatus],
+    model: str,
+    prompt: str,
+) -> str:
+    parts = {
+        "schema": _SCHEMA,
+        "request": normalize_request(request).lower(),
+        "intent": json.loads(intent.json()) if intent else None,
+        "status": status_fingerprint(status),
+        "model": model,
+        "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# execution plans on disk in sqlite, with lru and ttl eviction and a size cap
+# (ASD_PLAN_CACHE_TTL seconds, default a day; ASD_PLAN_CACHE_ENTRIES, default 500;
+# ASD_PLAN_CACHE_BYTES, default 16 MiB)
+class PlanCache:
+    def __init__(
+        self,
+        path: str,
+        ttl: int = 86400,
+        max_entries: int = 500,
+        max_bytes: int = 16 * 1024 * 1024,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS plans ("
+            " key TEXT PRIMARY KEY,"
+            " plan TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS plans_accessed ON plans(accessed)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[ExecutionPlan]:
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._lookup(key, now)
+            except sqlite3.Error as e:
+                logger.info("plan cache lookup failed: %s", e)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        try:
+            return ExecutionPlan.parse_raw(row[0])
+        except ValueError:
+            return None
+
+    def _lookup(self, key: str, now: float) -> Optional[Any]:
+        row = self._db.execute(
+            "SELECT plan, created FROM plans WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if self.ttl and now - row[1] > self.ttl:
+            self._db.execute("DELETE FROM plans WHERE key = ?", (key,))
+            self._db.commit()
+            self.evictions += 1
+            return None
+        self._db.execute("UPDATE plans SET accessed = ? WHERE key = ?", (now, key))
+        self._db.commit()
+        return row
+
+    def put(self, key: str, plan: ExecutionPlan) -> None:
+        data = plan.json()
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO plans (key, plan, size, created, accessed)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, data, len(data), now, now),
+                )
+                self._evict(now)
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.info("plan cache store failed: %s", e)
+
+    # expired entries first, then the least recently used until both caps hold
+    def _evict(self, now: float) -> None:
+        if self.ttl:
+            self.evictions += self._db.execute(
+                "DELETE FROM plans WHERE created < ?", (now - self.ttl,)
+            ).rowcount
+        count, size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM plans"
+        ).fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT key, size FROM plans ORDER BY accessed ASC"
+        ).fetchall()
+        drop = []
+        for key, entry_size in rows:
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            drop.append((key,))
+            count -= 1
+            size -= entry_size
+        self._db.executemany("DELETE FROM plans WHERE key = ?", drop)
+        self.evictions += len(drop)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM plans")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM plans"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+_cache: Optional[PlanCache] = None
+_cache_failed = False
+_cache_lock = threading.Lock()
+
+
+# the session's plan cache, None when it is disabled (ASD_PLAN_CACHE=0) or cannot be opened
+def get_plan_cache() -> Optional[PlanCache]:
+    global _cache, _cache_failed
+    if os.getenv("ASD_PLAN_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None and not _cache_failed:
+            try:
+                _cache = PlanCache(
+                    os.path.join(cache_dir(), "plans.sqlite3"),
+                    ttl=_env_int("ASD_PLAN_CACHE_TTL", 86400),
+                    max_entries=_env_int("ASD_PLAN_CACHE_ENTRIES", 500),
+                    max_bytes=_env_int("ASD_PLAN_CACHE_BYTES", 16 * 1024 * 1024),
+                )
+            except (OSError, sqlite3.Error) as e:
+                # a read-only home or a locked database only costs us the cache
+                logger.info("plan cache disabled: %s", e)
+                _cache_failed = True
+        return _cache
+
+
+def plan_cache_stats() -> Optional[Dict[str, Any]]:
+    return _cache.stats() if _cache is not None else None
+
+
+def close_plan_cache() -> None:
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+
+
+atexit.register(close_plan_cache)
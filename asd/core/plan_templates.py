@@ -0,0 +1,615 @@
+import os
+import shlex
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from .models import (
+    ExecutionPlan,
+    ExecutionStep,
+    GitAction,
+    GitStatus,
+    Intent,
+    SafetyLevel,
+    SafetyWarning,
+)
+from .repo_meta import get_repo_metadata
+
+_SAFETY_ORDER = [
+    SafetyLevel.SAFE,
+    SafetyLevel.CAUTION,
+    SafetyLevel.RISKY,
+    SafetyLevel.DANGEROUS,
+]
+
+
+def _step(
+    command: str,
+    description: str,
+    safety_level: SafetyLevel,
+    educational_note: str,
+    potential_issues: Sequence[str] = (),
+    recovery_options: Sequence[str] = (),
+    prerequisites: Sequence[str] = (),
+) -> ExecutionStep:
+    return ExecutionStep(
+        command=command,
+        description=description,
+        safety_level=safety_level,
+        educational_note=educational_note,
+        potential_issues=list(potential_issues),
+        recovery_options=list(recovery_options),
+        prerequisites=list(prerequisites),
+    )
+
+
+def _plan(
+    steps: List[ExecutionStep],
+    summary: str,
+    educational_summary: str,
+    concepts: Sequence[str],
+    warnings: Sequence[SafetyWarning] = (),
+) -> ExecutionPlan:
+    return ExecutionPlan(
+        steps=steps,
+        total_steps=len(steps),
+        overall_safety=max(
+            (step.safety_level for step in steps), key=_SAFETY_ORDER.index
+        ),
+        summary=summary,
+        educational_summary=educational_summary,
+        warnings=list(warnings),
+        git_concepts_taught=list(concepts),
+    )
+
+
+def _quote(value: str) -> str:
+    return shlex.quote(value)
+
+
+def _has_changes(status: GitStatus) -> bool:
+    return status.staged_count + status.modified_count + status.untracked_count > 0
+
+
+# a canonical plan for one git action, used when the repository state meets its preconditions
+# secondary lists the follow-up actions the template covers; an intent asking for anything else
+# is left to the llm
+class PlanTemplate:
+    def __init__(
+        self,
+        action: GitAction,
+        build: Callable[[Intent, GitStatus], ExecutionPlan],
+        when: Callable[[Intent, GitStatus], bool],
+        secondary: Tuple[GitAction, ...] = (),
+    ) -> None:
+        self.action = action
+        self.build = build
+        self.when = when
+        self.secondary = secondary
+
+    def matches(self, intent: Intent, status: GitStatus) -> bool:
+        return (
+            intent.primary_action == self.action
+            and set(intent.secondary_actions) <= set(self.secondary)
+            and self.when(intent, status)
+        )
+
+
+def _undo_last_commit(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    return _plan(
+        [
+            _step(
+                "git reset --soft HEAD~1",
+                "move the branch pointer back one commit while preserving your changes",
+                SafetyLevel.CAUTION,
+                "this demonstrates the difference between reset modes: --soft keeps "
+                "changes staged, --mixed unstages them, --hard deletes them",
+                [
+                    "if the commit was already pushed, your branch will diverge from the remote"
+                ],
+                ["git reset --soft ORIG_HEAD", "check git reflog for commit hash"],
+                ["the branch has at least two commits"],
+            )
+        ],
+        "safely undo the last commit while keeping all changes staged",
+        "you'll learn how git's reset command works and why --soft is safer than --hard",
+        ["commit history", "reset modes", "staging area"],
+        [
+            SafetyWarning(
+                level=SafetyLevel.CAUTION,
+                message="the last commit may already be on the remote; rewriting it "
+                "means others see a diverged branch",
+                safer_alternatives=["git revert HEAD"],
+            )
+        ]
+        if status.has_remote and status.ahead == 0
+        else [],
+    )
+
+
+def _stash(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    command = "git stash push"
+    if status.untracked_count:
+        command += " --include-untracked"
+    return _plan(
+        [
+            _step(
+                command,
+                "set your uncommitted changes aside and restore a clean working tree",
+                SafetyLevel.SAFE,
+                "the stash is a stack of saved work-in-progress; nothing is lost and "
+                "'git stash pop' brings it back",
+                [
+                    "a later 'git stash pop' can conflict if the same lines change meanwhile"
+                ],
+                ["git stash pop", "git stash list"],
+            )
+        ],
+        "save your work in progress to the stash",
+        "you'll learn how the stash keeps changes without committing them",
+        ["stash", "working directory", "staging area"],
+    )
+
+
+# the remote and branch a sync merges from: the intent may already name the remote
+# ("origin/main"), which is stripped so the merge target is not doubled
+def _sync_target(intent: Intent, status: GitStatus) -> Tuple[str, str]:
+    remote = status.remote_name or "origin"
+    branch = intent.branch_name or ""
+    if branch.startswith(f"{remote}/"):
+        branch = branch[len(remote) + 1 :]
+    return remote, branch
+
+
+def _sync(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    remote, branch = _sync_target(intent, status)
+    return _plan(
+        [
+            _step(
+                f"git fetch {_quote(remote)}",
+                f"download the latest commits from {remote} without changing your files",
+                SafetyLevel.SAFE,
+                "fetch only updates remote-tracking branches, so you can inspect "
+                "what changed before integrating it",
+                ["network or authentication errors"],
+                ["nothing to undo, fetch does not touch your branches"],
+            ),
+            _step(
+                f"git merge {_quote(f'{remote}/{branch}')}",
+                f"merge {remote}/{branch} into {status.current_branch}",
+                SafetyLevel.CAUTION,
+                "a merge keeps both histories and records a merge commit unless it "
+                "can fast-forward; rebase would rewrite your commits instead",
+                ["merge conflicts if both sides changed the same lines"],
+                ["git merge --abort", "git reset --hard ORIG_HEAD"],
+                [f"{remote}/{branch} exists", "the working tree is clean"],
+            ),
+        ],
+        f"bring {status.current_branch} up to date with {branch}",
+        "you'll learn why fetching first is safer than pulling blindly, and how "
+        "merge integrates two lines of work",
+        ["remote-tracking branches", "fetch", "merge"],
+    )
+
+
+def _push(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    command = "git push"
+    if intent.targets:
+        command += f" {_quote(intent.targets[0])}"
+        if intent.branch_name:
+            command += f" {_quote(intent.branch_name)}"
+    return _plan(
+        [
+            _step(
+                command,
+                f"upload {status.ahead} local commit(s) to the remote",
+                SafetyLevel.CAUTION,
+                "push shares your commits with others; it only fast-forwards the "
+                "remote branch, which is why a branch that is behind must pull first",
+                ["rejected if someone pushed in the meantime"],
+                ["git revert the pushed commits, never force push shared branches"],
+                ["the branch is not behind its upstream"],
+            )
+        ],
+        "share your local commits with the remote",
+        "you'll learn how push publishes history and why it never overwrites other "
+        "people's work without --force",
+        ["remotes", "upstream branches", "fast-forward"],
+    )
+
+
+def _pull(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    command = "git pull"
+    if intent.branch_name:
+        command += (
+            f" {_quote(status.remote_name or 'origin')} {_quote(intent.branch_name)}"
+        )
+    return _plan(
+        [
+            _step(
+                command,
+                "fetch the latest commits and merge them into the current branch",
+                SafetyLevel.CAUTION,
+                "pull is fetch followed by merge; with a clean working tree the only "
+                "possible surprise is a merge conflict",
+                ["merge conflicts if both sides changed the same lines"],
+                ["git merge --abort", "git reset --hard ORIG_HEAD"],
+                ["the working tree is clean"],
+            )
+        ],
+        "update the current branch from the remote",
+        "you'll learn that pull combines fetch and merge",
+        ["fetch", "merge", "remote-tracking branches"],
+    )
+
+
+def _commit(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    steps = []
+    if intent.targets:
+        steps.append(
+            _step(
+                "git add -A",
+                "stage every change in the working tree",
+                SafetyLevel.SAFE,
+                "the staging area is where you assemble the next commit; -A includes "
+                "new, modified and deleted files",
+                ["files you meant to keep out of the commit get staged too"],
+                ["git restore --staged <file>"],
+            )
+        )
+    command = "git commit"
+    if intent.commit_message:
+        command += f" -m {_quote(intent.commit_message)}"
+    steps.append(
+        _step(
+            command,
+            "record the staged changes as a new commit",
+            SafetyLevel.SAFE,
+            "a commit is a snapshot of the staging area; without a message one is "
+            "written from the staged diff in conventional commit format",
+            ["nothing to commit if the staging area is empty"],
+            ["git reset --soft HEAD~1"],
+            ["changes are staged"],
+        )
+    )
+    return _plan(
+        steps,
+        "commit your staged changes",
+        "you'll learn how the staging area decides what goes into a commit",
+        ["staging area", "commits", "conventional commits"],
+    )
+
+
+def _new_branch(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    name = _quote(intent.branch_name or "")
+    switch = GitAction.CHECKOUT in intent.secondary_actions
+    return _plan(
+        [
+            _step(
+                f"git checkout -b {name}" if switch else f"git branch {name}",
+                f"create branch {intent.branch_name}"
+                + (" and switch to it" if switch else ""),
+                SafetyLevel.SAFE,
+                "a branch is just a movable pointer to a commit; checkout -b creates it "
+                "and moves HEAD to it in one step",
+                ["fails if a branch with that name already exists"],
+                [f"git branch -d {name}"],
+            )
+        ],
+        f"create the {intent.branch_name} branch from {status.current_branch}",
+        "you'll learn that branches are cheap pointers, not copies of your files",
+        ["branches", "HEAD"],
+    )
+
+
+def _switch(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    name = intent.branch_name or ""
+    return _plan(
+        [
+            _step(
+                f"git checkout {_quote(name)}",
+                f"switch to {name}",
+                SafetyLevel.SAFE,
+                "checkout moves HEAD and updates your files to match the branch; with a "
+                "clean working tree nothing can be lost",
+                ["fails if the branch does not exist"],
+                [f"git checkout {_quote(status.current_branch)}"],
+                ["the working tree is clean"],
+            )
+        ],
+        f"switch from {status.current_branch} to {name}",
+        "you'll learn how HEAD and the working tree follow the checked out branch",
+        ["branches", "HEAD", "working directory"],
+    )
+
+
+def _stage(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    targets = intent.targets or ["."]
+    command = (
+        "git add -A"
+        if targets == ["."]
+        else "git add -- " + " ".join(_quote(t) for t in targets)
+    )
+    return _plan(
+        [
+            _step(
+                command,
+                "stage the changes for the next commit",
+                SafetyLevel.SAFE,
+                "staging copies the current file contents into the index, so later "
+                "edits are not part of the commit unless staged again",
+                ["a path that does not exist is rejected"],
+                ["git restore --staged <file>"],
+            )
+        ],
+        "stage your changes",
+        "you'll learn how the staging area separates what you changed from what "
+        "you commit",
+        ["staging area", "index"],
+    )
+
+
+def _amend(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    return _plan(
+        [
+            _step(
+                f"git commit --amend -m {_quote(intent.commit_message or '')}",
+                "replace the message of the last commit",
+                SafetyLevel.CAUTION,
+                "amend creates a new commit in place of the last one; it is safe while "
+                "the commit has not been pushed",
+                ["staged changes are folded into the amended commit too"],
+                ["git reset --soft ORIG_HEAD", "check git reflog for the old commit"],
+                ["the last commit has not been pushed"],
+            )
+        ],
+        "fix the last commit message",
+        "you'll learn that amending rewrites history, which is why it is only safe "
+        "for unpushed commits",
+        ["commit history", "amend"],
+    )
+
+
+def _inspect(
+    command: str, description: str, note: str, concepts: Sequence[str]
+) -> Callable[[Intent, GitStatus], ExecutionPlan]:
+    return lambda intent, status: _plan(
+        [_step(command, description, SafetyLevel.SAFE, note)],
+        description,
+        note,
+        concepts,
+    )
+
+
+def _diff(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    steps = [
+        _step(
+            "git diff",
+            "show changes that are not staged yet",
+            SafetyLevel.SAFE,
+            "git diff compares the working tree with the staging area",
+        )
+    ]
+    if status.staged_count:
+        steps.append(
+            _step(
+                "git diff --staged",
+                "show changes that are staged for the next commit",
+                SafetyLevel.SAFE,
+                "--staged compares the staging area with the last commit",
+            )
+        )
+    return _plan(
+        steps,
+        "review your changes",
+        "you'll learn the difference between unstaged and staged changes",
+        ["working directory", "staging area", "diff"],
+    )
+
+
+def _fetch(intent: Intent, status: GitStatus) -> ExecutionPlan:
+    remote = intent.targets[0] if intent.targets else status.remote_name or "origin"
+    return _plan(
+        [
+            _step(
+                f"git fetch {_quote(remote)}",
+                f"download the latest commits from {remote}",
+                SafetyLevel.SAFE,
+                "fetch updates remote-tracking branches only; your branches and files "
+                "stay as they are",
+                ["network or authentication errors"],
+                ["nothing to undo, fetch does not touch your branches"],
+            )
+        ],
+        f"fetch the latest changes from {remote}",
+        "you'll learn how remote-tracking branches let you look before you merge",
+        ["remotes", "fetch", "remote-tracking branches"],
+    )
+
+
+# a remote named by the intent has to be configured; without one the status remote is used
+def _known_remote(intent: Intent) -> bool:
+    if not intent.targets:
+        return True
+    meta = get_repo_metadata()
+    return meta is not None and intent.targets[0] in meta.remotes()
+
+
+# the branch pushed by name has to exist locally
+def _known_branch(intent: Intent) -> bool:
+    if not intent.branch_name:
+        return True
+    meta = get_repo_metadata()
+    return (
+        meta is not None
+        and meta.resolve_ref(f"refs/heads/{intent.branch_name}") is not None
+    )
+
+
+# the remote-tracking branch a sync merges has to exist, otherwise the request probably
+# did not name a branch at all ("update with upstream")
+def _known_sync_target(intent: Intent, status: GitStatus) -> bool:
+    remote, branch = _sync_target(intent, status)
+    meta = get_repo_metadata()
+    return (
+        bool(branch)
+        and branch != status.current_branch
+        and meta is not None
+        and meta.resolve_ref(f"refs/remotes/{remote}/{branch}") is not None
+    )
+
+
+# the branch checked out has to exist locally, or on a remote for checkout to create it
+def _known_checkout(intent: Intent) -> bool:
+    meta = get_repo_metadata()
+    if meta is None or not intent.branch_name:
+        return False
+    refs = [f"refs/heads/{intent.branch_name}"] + [
+        f"refs/remotes/{remote}/{intent.branch_name}" for remote in meta.remotes()
+    ]
+    return any(meta.resolve_ref(ref) is not None for ref in refs)
+
+
+# a pull by branch name needs that branch on the remote, a bare pull needs an upstream
+def _known_pull_source(intent: Intent, status: GitStatus) -> bool:
+    meta = get_repo_metadata()
+    if meta is None:
+        return False
+    if intent.branch_name:
+        remote = status.remote_name or "origin"
+        return (
+            meta.resolve_ref(f"refs/remotes/{remote}/{intent.branch_name}") is not None
+        )
+    branch = meta.current_branch()
+    return branch != "HEAD" and bool(
+        meta.config_value(f'branch "{branch}"'.lower(), "merge")
+    )
+
+
+# every path the intent stages has to exist, a misread request is left to the llm
+def _known_paths(intent: Intent) -> bool:
+    return all(os.path.lexists(path) for path in intent.targets or ["."])
+
+
+def _clean_tree(status: GitStatus) -> bool:
+    return status.staged_count + status.modified_count == 0 and not status.conflicts
+
+
+# the templates, tried in order; the preconditions keep each one to the states where its
+# canonical plan is the right answer and leave everything else to the llm
+TEMPLATES: List[PlanTemplate] = [
+    PlanTemplate(
+        GitAction.RESET,
+        _undo_last_commit,
+        lambda i, s: (
+            bool(i.targets)
+            and i.targets[0] in ("HEAD~1", "HEAD^")
+            and s.total_commits > 1
+            and not s.conflicts
+        ),
+    ),
+    PlanTemplate(GitAction.STASH, _stash, lambda i, s: _has_changes(s)),
+    PlanTemplate(
+        GitAction.FETCH,
+        _sync,
+        lambda i, s: s.has_remote and _clean_tree(s) and _known_sync_target(i, s),
+        secondary=(GitAction.MERGE,),
+    ),
+    PlanTemplate(
+        GitAction.FETCH,
+        _fetch,
+        lambda i, s: s.has_remote and _known_remote(i),
+    ),
+    PlanTemplate(
+        GitAction.PUSH,
+        _push,
+        lambda i, s: (
+            s.has_remote
+            and s.ahead > 0
+            and s.behind == 0
+            and _known_remote(i)
+            and _known_branch(i)
+        ),
+    ),
+    PlanTemplate(
+        GitAction.PULL,
+        _pull,
+        lambda i, s: (
+            s.has_remote
+            and s.ahead == 0
+            and _clean_tree(s)
+            and _known_pull_source(i, s)
+        ),
+    ),
+    PlanTemplate(
+        GitAction.COMMIT,
+        _commit,
+        # the commit step is checked against the status from before the plan ran, so
+        # something has to be staged already even when the plan stages everything first
+        lambda i, s: not s.conflicts and s.staged_count > 0,
+    ),
+    PlanTemplate(
+        GitAction.BRANCH,
+        _new_branch,
+        lambda i, s: bool(i.branch_name) and bool(s.last_commit_hash),
+        secondary=(GitAction.CHECKOUT,),
+    ),
+    PlanTemplate(
+        GitAction.CHECKOUT,
+        _switch,
+        lambda i, s: (
+            bool(i.branch_name)
+            and i.branch_name != s.current_branch
+            and _clean_tree(s)
+            and _known_checkout(i)
+        ),
+    ),
+    PlanTemplate(
+        GitAction.ADD, _stage, lambda i, s: _has_changes(s) and _known_paths(i)
+    ),
+    PlanTemplate(
+        GitAction.AMEND,
+        _amend,
+        lambda i, s: (
+            bool(i.commit_message)
+            and bool(s.last_commit_hash)
+            and (not s.has_remote or s.ahead > 0)
+        ),
+    ),
+    PlanTemplate(
+        GitAction.STATUS,
+        _inspect(
+            "git status",
+            "show the state of the working tree and staging area",
+            "status tells you which files are staged, modified or untracked",
+            ["working directory", "staging area"],
+        ),
+        lambda i, s: True,
+    ),
+    PlanTemplate(
+        GitAction.LOG,
+        _inspect(
+            "git log --oneline --graph -n 20",
+            "show the last 20 commits",
+            "the log walks the commit history from HEAD backwards",
+            ["commit history"],
+        ),
+        lambda i, s: bool(s.last_commit_hash),
+    ),
+    PlanTemplate(GitAction.DIFF, _diff, lambda i, s: _has_changes(s)),
+]
+
+
+# the canonical plan for an intent when a template fits the repository state, None otherwise
+# (ASD_PLAN_TEMPLATES=0 always asks the llm)
+def match_template(
+    intent: Optional[Intent], status: Optional[GitStatus]
+) -> Optional[ExecutionPlan]:
+    if os.getenv("ASD_PLAN_TEMPLATES", "1") == "0":
+        return None
+    if intent is None or status is None or not status.is_repo:
+        return None
+    if intent.force_requested:
+        return None
+    for template in TEMPLATES:
+        if template.matches(intent, status):
+            return template.build(intent, status)
+    return None
@@ -1,18 +1,29 @@
 import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
 
-from .costs import UsageCallback, get_active_model_provider
-
-from .git_tools import get_git_diff_analysis
+from .costs import UsageCallback, get_active_model_provider, get_llm_backend
+from .intents import SYSTEM_PROMPT as INTENT_PROMPT
+from .llm import get_streaming_llm, get_structured_llm
 from .models import (
     ExecutionPlan,
+    ExecutionStep,
     GitStatus,
+    Intent,
+    IntentAndPlan,
     State,
     StepResult,
 )
+from .plan_cache import get_plan_cache, plan_cache_key
+from .plan_templates import match_template
+from .prompt_budget import (
+    ContextAssembler,
+    count_tokens,
+    prompt_token_budget,
+    split_status,
+)
+from .staged_diff import get_budgeted_diff
 
 PLANNING_PROMPT = """you are an expert git instructor focused on safety and education. create a step-by-step execution plan that:
 
@@ -42,7 +53,7 @@ PLANNING_PROMPT = """you are an expert git instructor focused on safety and educ
 - teach patterns that apply to future situations
 
 **step structure for each operation:**
-- command: the exact git command
+- command: the exact git command, one command per step (no &&, pipes or redirects)
 - description: what this step accomplishes  
 - safety_level: SAFE, CAUTION, RISKY, or DANGEROUS
 - educational_note: why this step works and what it teaches
@@ -108,11 +119,14 @@ git_concepts_taught: ["commit history", "reset modes", "staging area"]
 RECOVERY_PLANNING_PROMPT = """you are an expert git instructor creating a recovery plan after a command failed.
 
 **FAILURE CONTEXT:**
-- original user intent: {original_intent}
-- completed steps successfully: {completed_steps}
-- failed step: {failed_command}
-- failure reason: {error_message}  
-- current git repository state: {current_git_status}
+the user message carries the failure context as json:
+- original_intent: the original user intent
+- completed_steps: the steps that completed successfully
+- failed_command: the failed step
+- error_message: the failure reason
+- current_git_status: the current git repository state
+- original_plan_summary and staged_changes: what was planned and what is staged now
+any of these can be missing when the context had to be trimmed
 
 **RECOVERY PLANNING PRINCIPLES:**
 
@@ -167,52 +181,140 @@ new plan: [show conflicts, guide resolution, add resolved files, commit merge] -
 
 
 # using an llm to generate an execution plan with structured outputs
-def get_llm():
-    if os.getenv("GOOGLE_API_KEY"):
-        return ChatGoogleGenerativeAI(
-            model=os.getenv("GOOGLE_MODEL", "gemini-2.5-flash"),
-            api_key=os.getenv("GOOGLE_API_KEY"),
-        )
-    return ChatOpenAI(
-        model=os.getenv("OPENAI_MODEL", "o4-mini"), api_key=os.getenv("OPENAI_API_KEY")
-    )
-
+# if the final message contains "failed", the error message and failed steps go into the context
+# this is for planning steps after execution and getting and error
+def _previous_failure(state: State) -> Optional[Dict[str, Any]]:
+    if not (state.final_message and "failed" in state.final_message):
+        return None
+    return {
+        "error_message": state.final_message,
+        "failed_steps": [
+            result.dict() for result in state.step_results if not result.success
+        ],
+        "recovery_needed": True,
+    }
 
-def generate_execution_plan(state: State) -> ExecutionPlan:
-    llm = get_llm()
-    planner = llm.with_structured_output(ExecutionPlan)
 
+# the planning context for the llm, highest priority first, under the model's prompt budget:
+# intent > status counts > file lists > diff > failure details
+def _planning_context(state: State, model: str, system_prompt: str) -> Dict[str, Any]:
     # get actual staged diff for intelligent commit message planning
-    staged_diff = get_git_diff_analysis()
-
-    # prepare the context for the llm
-    context = {
-        "user_request": state.input,
-        "intent": state.intent.dict() if state.intent else {},
-        "git_status": state.git_status.dict() if state.git_status else {},
-        "staged_changes": staged_diff if staged_diff else "no staged changes",
-        "previous_failure": None,
-        "learning_opportunity": True,
-    }
+    # bounded by ASD_DIFF_TOKEN_BUDGET, with lockfiles, generated and vendored files summarised
+    staged_diff = get_budgeted_diff()
 
-    # if the final message contains "failed", add the error message and failed steps to the context
-    # this is for planning steps after execution and getting and error
-    if state.final_message and "failed" in state.final_message:
-        context["previous_failure"] = {
-            "error_message": state.final_message,
-            "failed_steps": [
-                result.dict() for result in state.step_results if not result.success
-            ],
-            "recovery_needed": True,
-        }
+    assembler = ContextAssembler(
+        prompt_token_budget(model), reserved=count_tokens(system_prompt)
+    )
+    assembler.add("user_request", state.input)
+    # the fused call extracts the intent itself, so there is none yet
+    if state.intent is not None:
+        assembler.add("intent", state.intent.dict())
 
     # if the user has a safety concern, add it to the context
     if state.intent and state.intent.safety_concern:
-        context["safety_focus"] = state.intent.safety_concern
+        assembler.add("safety_focus", state.intent.safety_concern)
 
     # if the user has a learning goal, add it to the context
     if state.intent and state.intent.learning_goal:
-        context["learning_goal"] = state.intent.learning_goal
+        assembler.add("learning_goal", state.intent.learning_goal)
+    assembler.add("learning_opportunity", True)
+
+    status, file_lists = split_status(
+        state.git_status.dict() if state.git_status else {}
+    )
+    assembler.add("git_status", status)
+    for name, paths in file_lists.items():
+        assembler.add(("git_status", name), paths)
+    assembler.add("staged_changes", staged_diff if staged_diff else "no staged changes")
+
+    assembler.add("previous_failure", _previous_failure(state))
+    return assembler.build()
+
+
+# streaming the plan when the caller can render steps as they arrive (ASD_PLAN_STREAM, default on)
+# cassettes hold whole responses, so the record, replay and stub backends never stream
+def _stream_plans() -> bool:
+    if get_llm_backend() != "live":
+        return False
+    return os.getenv("ASD_PLAN_STREAM", "1").strip().lower() not in (
+        "0",
+        "false",
+        "no",
+        "off",
+    )
+
+
+# the plan streamed as growing dicts; a step is handed to on_step once the model has moved past
+# it (to the next step or to the fields after the list), and the final dict is validated into
+# the same ExecutionPlan a non streaming call returns
+def _stream_plan(
+    messages: List[Any],
+    provider: str,
+    model: str,
+    on_step: Callable[[ExecutionStep], None],
+) -> ExecutionPlan:
+    streamer = get_streaming_llm(ExecutionPlan)
+    emitted = 0
+    partial: Dict[str, Any] = {}
+
+    def emit(steps: List[Any], upto: int) -> None:
+        nonlocal emitted
+        while emitted < upto:
+            try:
+                step = ExecutionStep.parse_obj(steps[emitted])
+            except ValueError:
+                step = None
+            emitted += 1
+            if step is not None:
+                on_step(step)
+
+    for chunk in streamer.stream(
+        messages,
+        config={"callbacks": [UsageCallback(provider, model)]},
+    ):
+        if not isinstance(chunk, dict):
+            continue
+        partial = chunk
+        steps = partial.get("steps")
+        if not isinstance(steps, list):
+            continue
+        keys = list(partial)
+        past_steps = keys.index("steps") < len(keys) - 1
+        emit(steps, len(steps) if past_steps else len(steps) - 1)
+
+    return ExecutionPlan.parse_obj(partial)
+
+
+def generate_execution_plan(
+    state: State, on_step: Optional[Callable[[ExecutionStep], None]] = None
+) -> ExecutionPlan:
+    provider, model = get_active_model_provider()
+
+    failed_before = _previous_failure(state) is not None
+
+    # the everyday requests have a canonical plan that is filled in without the llm
+    if not failed_before:
+        plan = match_template(state.intent, state.git_status)
+        if plan is not None:
+            return plan
+
+    # identical requests against an identical repository state reuse the stored plan;
+    # plans made after a failure depend on that failure and are never cached
+    cache = get_plan_cache() if not failed_before else None
+    cache_key = None
+    if cache is not None:
+        cache_key = plan_cache_key(
+            state.input,
+            state.intent,
+            state.git_status,
+            f"{provider}:{model}",
+            PLANNING_PROMPT,
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    context = _planning_context(state, model, PLANNING_PROMPT)
 
     # prepare the messages for the llm
     messages = [
@@ -220,13 +322,62 @@ def generate_execution_plan(state: State) -> ExecutionPlan:
         HumanMessage(content=f"planning context: {context}"),
     ]
 
+    plan = None
+    if on_step is not None and _stream_plans():
+        shown: List[ExecutionStep] = []
+
+        def show(step: ExecutionStep) -> None:
+            shown.append(step)
+            on_step(step)
+
+        try:
+            plan = _stream_plan(messages, provider, model, show)
+        except Exception:
+            # a stream that breaks before showing anything falls back to the retrying call;
+            # once steps are on screen a second, different plan would only confuse
+            if shown:
+                raise
+    if plan is None:
+        planner = get_structured_llm(ExecutionPlan)
+        plan = planner.invoke(
+            messages,
+            config={"callbacks": [UsageCallback(provider, model)]},
+        )
+    plan.total_steps = len(plan.steps)
+    if cache is not None and cache_key is not None:
+        cache.put(cache_key, plan)
+    return plan
+
+
+FUSED_PLANNING_PROMPT = f"""{INTENT_PROMPT}
+
+then, using the intent you extracted, plan the work.
+
+{PLANNING_PROMPT}
+
+return both: the extracted intent and the execution plan that fulfils it."""
+
+
+# intent and plan from a single structured call (ASD_PLAN_MODE=fused)
+# one round trip and one system prompt instead of parse_intent followed by generate_execution_plan
+def generate_intent_and_plan(state: State) -> Tuple[Intent, ExecutionPlan]:
+    planner = get_structured_llm(IntentAndPlan)
     provider, model = get_active_model_provider()
-    plan = planner.invoke(
+    context = _planning_context(
+        state.copy(update={"intent": None}), model, FUSED_PLANNING_PROMPT
+    )
+
+    messages = [
+        SystemMessage(content=FUSED_PLANNING_PROMPT),
+        HumanMessage(content=f"planning context: {context}"),
+    ]
+
+    result = planner.invoke(
         messages,
         config={"callbacks": [UsageCallback(provider, model)]},
     )
-    plan.total_steps = len(plan.steps)
-    return plan
+    result.plan.total_steps = len(result.plan.steps)
+    return result.intent, result.plan
 
 
 # recovery planning function
@@ -236,30 +387,41 @@ def generate_recovery_plan(
     current_git_status: GitStatus,
     completed_steps: list,
 ) -> ExecutionPlan:
-    llm = get_llm()
-    recovery_planner = llm.with_structured_output(ExecutionPlan)
+    recovery_planner = get_structured_llm(ExecutionPlan)
+    provider, model = get_active_model_provider()
 
     # prepare recovery context using the state, failed step, current git status, and completed steps
-    recovery_context = {
-        "original_intent": state.intent.dict() if state.intent else state.input,
-        "completed_steps": [step.dict() for step in completed_steps],
-        "failed_command": failed_step.command,
-        "error_message": failed_step.error,
-        "current_git_status": current_git_status.dict(),
-        "original_plan_summary": state.plan.summary if state.plan else "unknown",
-        "staged_changes": get_git_diff_analysis() or "no staged changes",
-    }
+    # under the same budget as planning; the failure itself ranks with the intent
+    assembler = ContextAssembler(
+        prompt_token_budget(model),
+        reserved=count_tokens(RECOVERY_PLANNING_PROMPT) + 50,
+    )
+    assembler.add(
+        "original_intent", state.intent.dict() if state.intent else state.input
+    )
+    assembler.add("failed_command", failed_step.command)
+    assembler.add("error_message", failed_step.error)
+    status, file_lists = split_status(current_git_status.dict())
+    assembler.add("current_git_status", status)
+    for name, paths in file_lists.items():
+        assembler.add(("current_git_status", name), paths)
+    assembler.add(
+        "original_plan_summary", state.plan.summary if state.plan else "unknown"
+    )
+    assembler.add("staged_changes", get_budgeted_diff() or "no staged changes")
+    assembler.add("completed_steps", [step.dict() for step in completed_steps])
+    recovery_context = assembler.build()
 
-    # prepare messages for recovery planning
+    # the system prompt stays byte-identical between calls so providers can serve it from
+    # their prompt cache; everything about this failure goes after it
     messages = [
-        SystemMessage(content=RECOVERY_PLANNING_PROMPT.format(**recovery_context)),
+        SystemMessage(content=RECOVERY_PLANNING_PROMPT),
         HumanMessage(
             content=f"create recovery plan for this failure: {recovery_context}"
         ),
     ]
 
     # generate recovery plan
-    provider, model = get_active_model_provider()
     recovery_plan = recovery_planner.invoke(
         messages,
         config={"callbacks": [UsageCallback(provider, model)]},
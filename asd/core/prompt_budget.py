@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .git_tools import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# prompt budgets per model, well below each context window so the answer has room and latency
+# stays predictable; ASD_PROMPT_TOKEN_BUDGET overrides them all
+PROMPT_BUDGETS: Dict[str, int] = {
+    "gpt-4o": 24_000,
+    "gpt-4o-mini": 16_000,
+    "gpt-4.1": 24_000,
+    "gpt-4.1-mini": 16_000,
+    "o4-mini": 24_000,
+    "gemini-2.5-pro": 32_000,
+    "gemini-2.5-flash": 24_000,
+    "gemini-2.0-flash": 24_000,
+}
+_DEFAULT_BUDGET = 16_000
+
+_encoding: Any = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def prompt_token_budget(model: str) -> int:
+    override = os.getenv("ASD_PROMPT_TOKEN_BUDGET")
+    if override:
+        try:
+            return max(1000, int(override))
+        except ValueError:
+            pass
+    return PROMPT_BUDGETS.get((model or "").strip().lower(), _DEFAULT_BUDGET)
+
+
+# where tiktoken keeps the o200k tables it downloaded, resolved the way tiktoken does it
+_O200K_URL = "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken"
+
+
+def _cached_o200k() -> Optional[str]:
+    cache = os.getenv("TIKTOKEN_CACHE_DIR")
+    if cache is None:
+        cache = os.getenv("DATA_GYM_CACHE_DIR")
+    if cache is None:
+        cache = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache:
+        return None
+    path = os.path.join(cache, hashlib.sha1(_O200K_URL.encode()).hexdigest())
+    return path if os.path.isfile(path) else None
+
+
+# tiktoken's o200k encoding when it is installed and its tables are already cached locally;
+# tiktoken would otherwise download them, with no timeout, on the first count. without them
+# (or with ASD_TOKENIZER=estimate) the four-characters-per-token estimate is used
+def _get_encoding() -> Any:
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            if (
+                os.getenv("ASD_TOKENIZER", "tiktoken").strip().lower() != "estimate"
+                and _cached_o200k() is not None
+            ):
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    _encoding = None
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+# cutting text at a line boundary so it fits in tokens, noting how much was dropped
+def _trim_text(text: str, tokens: int) -> Tuple[str, int]:
+    lines = text.splitlines()
+    kept: List[str] = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if used + cost > tokens:
+            break
+        kept.append(line)
+        used += cost
+    dropped = len(lines) - len(kept)
+    if dropped and not kept and tokens > 20:
+        # a single long line (such as a dict repr) is cut instead of dropped whole
+        return text[: (tokens - 20) * 3] + " [... trimmed to fit the prompt budget]", 1
+    if dropped:
+        kept.append(f"[... {dropped} more lines trimmed to fit the prompt budget]")
+    return "\n".join(kept), dropped
+
+
+def _trim_list(items: List[Any], tokens: int) -> Tuple[List[Any], int]:
+    kept: List[Any] = []
+    used = 2
+    for item in items:
+        cost = count_tokens(repr(item)) + 1
+        if used + cost > tokens:
+            break
+        kept.append(item)
+        used += cost
+    return kept, len(items) - len(kept)
+
+
+# assembling a prompt context under a token budget
+# sections are added in priority order; each one gets whatever budget is left after the sections
+# before it, and is trimmed (text by lines, lists by items) or dropped when it does not fit
+class ContextAssembler:
+    def __init__(self, budget: int, reserved: int = 0) -> None:
+        self.budget = budget
+        self.remaining = budget - reserved
+        self.context: Dict[str, Any] = {}
+        self.trimmed: List[str] = []
+
+    def _place(self, key: Union[str, Tuple[str, str]], value: Any) -> None:
+        if isinstance(key, tuple):
+            parent = self.context.setdefault(key[0], {})
+            # a parent that had to be trimmed to text has no room for nested sections
+            if isinstance(parent, dict):
+                parent[key[1]] = value
+        else:
+            self.context[key] = value
+
+    def add(self, key: Union[str, Tuple[str, str]], value: Any) -> None:
+        name = ".".join(key) if isinstance(key, tuple) else key
+        # the repr is what the model sees, plus the key and separators
+        cost = count_tokens(repr(value)) + count_tokens(name) + 2
+        if cost <= self.remaining:
+            self._place(key, value)
+            self.remaining -= cost
+            return
+
+        room = max(0, self.remaining - count_tokens(name) - 2)
+        if isinstance(value, list):
+            kept, dropped = _trim_list(value, room)
+            note = f"{name}: kept {len(kept)} of {len(value)} items"
+        else:
+            text = value if isinstance(value, str) else repr(value)
+            kept, dropped = _trim_text(text, room)
+            note = f"{name}: dropped {dropped} lines"
+        if room <= 0 or not kept:
+            note = f"{name}: left out"
+        else:
+            self._place(key, kept)
+            self.remaining -= count_tokens(repr(kept)) + count_tokens(name) + 2
+        self.trimmed.append(note)
+
+    def build(self) -> Dict[str, Any]:
+        if self.trimmed:
+            self.context["trimmed_to_fit_prompt_budget"] = self.trimmed
+            logger.info(
+                "prompt context trimmed to %d tokens: %s",
+                self.budget,
+                "; ".join(self.trimmed),
+            )
+        return self.context
+
+
+_FILE_LISTS = ("staged", "modified", "untracked")
+
+
+# the status counts first, the (longer, less essential) file lists after everything with a
+# higher priority has been placed; returns the lists so the caller can add them later
+def split_status(
+    status: Optional[Dict[str, Any]],
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    status = dict(status or {})
+    lists = {name: status.pop(name) for name in _FILE_LISTS if name in status}
+    return status, lists
@@ -0,0 +1,235 @@
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+_SHA_PATTERN = re.compile(r"^[0-9a-f]{40}(?:[0-9a-f]{24})?$")
+_REMOTE_SECTION = re.compile(r'^\[\s*remote\s+"((?:[^"\\]|\\.)*)"\s*\]', re.IGNORECASE)
+_REMOTE_SECTION_OLD = re.compile(r"^\[\s*remote\.([^\]\s]+)\s*\]", re.IGNORECASE)
+
+
+# locating the git directory for a work tree without asking git
+# returns (git_dir, common_dir); for a linked worktree the .git file points at
+# .git/worktrees/<name>, whose commondir file points back at the shared repository
+def find_git_dirs(start: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    env_git_dir = os.getenv("GIT_DIR")
+    if env_git_dir:
+        git_dir = os.path.abspath(env_git_dir)
+        return (git_dir, _common_dir(git_dir)) if os.path.isdir(git_dir) else None
+
+    path = os.path.abspath(start or os.getcwd())
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.isdir(dot_git):
+            return dot_git, _common_dir(dot_git)
+        if os.path.isfile(dot_git):
+            git_dir = _read_gitdir_file(dot_git, path)
+            if git_dir:
+                return git_dir, _common_dir(git_dir)
+            return None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+# the top of the work tree, i.e. the directory holding the .git dir or file
+def find_work_tree(start: Optional[str] = None) -> Optional[str]:
+    env_work_tree = os.getenv("GIT_WORK_TREE")
+    if env_work_tree:
+        return os.path.abspath(env_work_tree)
+    if os.getenv("GIT_DIR"):
+        return os.path.abspath(start or os.getcwd())
+
+    path = os.path.abspath(start or os.getcwd())
+    while True:
+        if os.path.exists(os.path.join(path, ".git")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _read_gitdir_file(dot_git: str, work_tree: str) -> Optional[str]:
+    try:
+        with open(dot_git, encoding="utf-8") as f:
+            content = f.read().strip()
+    except OSError:
+        return None
+    if not content.startswith("gitdir:"):
+        return None
+    git_dir = content[len("gitdir:") :].strip()
+    if not os.path.isabs(git_dir):
+        git_dir = os.path.join(work_tree, git_dir)
+    git_dir = os.path.normpath(git_dir)
+    return git_dir if os.path.isdir(git_dir) else None
+
+
+def _common_dir(git_dir: str) -> str:
+    try:
+        with open(os.path.join(git_dir, "commondir"), encoding="utf-8") as f:
+            common = f.read().strip()
+    except OSError:
+        return git_dir
+    if not os.path.isabs(common):
+        common = os.path.join(git_dir, common)
+    return os.path.normpath(common)
+
+
+# reading HEAD, refs, remotes and the stash count straight from the git directory
+# every answer is a few small file reads; packed-refs is parsed once and re-read only when its mtime changes
+class RepoMetadata:
+    def __init__(self, git_dir: str, common_dir: Optional[str] = None) -> None:
+        self.git_dir = git_dir
+        self.common_dir = common_dir or git_dir
+        self._packed_refs: Dict[str, str] = {}
+        self._packed_refs_stamp: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    # repositories using the reftable backend keep refs in a binary format we do not parse
+    @property
+    def supported(self) -> bool:
+        if os.path.isdir(os.path.join(self.common_dir, "reftable")):
+            return False
+        return "reftable" not in self.config_value("extensions", "refstorage")
+
+    def _read_text(self, path: str) -> Optional[str]:
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    # refs that belong to a single worktree live in its own git dir, everything else is shared
+    def _ref_path(self, refname: str) -> str:
+        if (
+            refname == "HEAD"
+            or "/" not in refname
+            or refname.startswith("refs/bisect/")
+        ):
+            return os.path.join(self.git_dir, refname)
+        return os.path.join(self.common_dir, refname)
+
+    def packed_refs(self) -> Dict[str, str]:
+        path = os.path.join(self.common_dir, "packed-refs")
+        try:
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+
+        with self._lock:
+            if stamp == self._packed_refs_stamp:
+                return self._packed_refs
+
+            refs: Dict[str, str] = {}
+            content = self._read_text(path) if stamp else None
+            for line in (content or "").splitlines():
+                # comments carry the traits header, ^ lines are peeled tag targets
+                if not line or line[0] in "#^":
+                    continue
+                sha, _, name = line.partition(" ")
+                if name:
+                    refs[name.strip()] = sha.strip()
+            self._packed_refs = refs
+            self._packed_refs_stamp = stamp
+            return refs
+
+    # resolving a ref to its sha, following symbolic refs (at most a few levels deep)
+    def resolve_ref(self, refname: str, depth: int = 0) -> Optional[str]:
+        if depth > 5:
+            return None
+        content = self._read_text(self._ref_path(refname))
+        if content is not None:
+            content = content.strip()
+            if content.startswith("ref:"):
+                return self.resolve_ref(content[4:].strip(), depth + 1)
+            return content if _SHA_PATTERN.match(content) else None
+        return self.packed_refs().get(refname)
+
+    # (symbolic ref or None, sha or None); an unborn branch has a ref but no sha
+    def head(self) -> Tuple[Optional[str], Optional[str]]:
+        content = self._read_text(os.path.join(self.git_dir, "HEAD"))
+        if content is None:
+            return None, None
+        content = content.strip()
+        if content.startswith("ref:"):
+            ref = content[4:].strip()
+            return ref, self.resolve_ref(ref)
+        return None, content if _SHA_PATTERN.match(content) else None
+
+    # the index of this worktree, GIT_INDEX_FILE wins when set
+    @property
+    def index_path(self) -> str:
+        return os.getenv("GIT_INDEX_FILE") or os.path.join(self.git_dir, "index")
+
+    # the branch name, or "HEAD" when detached (matching what the status probes report)
+    def current_branch(self) -> str:
+        ref, _ = self.head()
+        if ref and ref.startswith("refs/heads/"):
+            return ref[len("refs/heads/") :]
+        return "HEAD"
+
+    def head_sha(self) -> Optional[str]:
+        return self.head()[1]
+
+    def _config_lines(self) -> List[str]:
+        content = self._read_text(os.path.join(self.common_dir, "config"))
+        return content.splitlines() if content else []
+
+    # a single lowercased value from the repository config, "" when unset
+    def config_value(self, section: str, key: str) -> str:
+        current = ""
+        for raw in self._config_lines():
+            line = raw.strip()
+            if line.startswith("["):
+                current = line.strip("[]").strip().lower()
+                continue
+            if current == section and "=" in line:
+                k, _, v = line.partition("=")
+                if k.strip().lower() == key:
+                    return v.strip().lower()
+        return ""
+
+    # remote names in the order they appear in the config, like `git remote`
+    def remotes(self) -> List[str]:
+        names: List[str] = []
+        for raw in self._config_lines():
+            line = raw.strip()
+            match = _REMOTE_SECTION.match(line) or _REMOTE_SECTION_OLD.match(line)
+            if match:
+                name = match.group(1).replace('\\"', '"').replace("\\\\", "\\")
+                if name not in names:
+                    names.append(name)
+        return names
+
+    # one reflog line per stash entry, which is exactly what `git stash list` prints
+    def stash_count(self) -> int:
+        if self.resolve_ref("refs/stash") is None:
+            return 0
+        content = self._read_text(
+            os.path.join(self.common_dir, "logs", "refs", "stash")
+        )
+        if not content:
+            return 1
+        return sum(1 for line in content.splitlines() if line.strip())
+
+
+_metadata: Dict[str, RepoMetadata] = {}
+_metadata_lock = threading.Lock()
+
+
+# the metadata reader for the repository around the working directory
+# readers are kept for the session so packed-refs is only parsed again when it changes
+def get_repo_metadata(start: Optional[str] = None) -> Optional[RepoMetadata]:
+    dirs = find_git_dirs(start)
+    if dirs is None:
+        return None
+    git_dir, common_dir = dirs
+    with _metadata_lock:
+        meta = _metadata.get(git_dir)
+        if meta is None:
+            meta = RepoMetadata(git_dir, common_dir)
+            _metadata[git_dir] = meta
+    return meta if meta.supported else None
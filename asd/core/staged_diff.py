@@ -0,0 +1,350 @@
+import math
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .git_backend import probe_env
+from .git_tools import (
+    GitStream,
+    _commit_chunk_tokens,
+    _commit_max_chunks,
+    _run_probes,
+    estimate_tokens,
+)
+
+# files whose diffs are machine written and carry no intent worth describing
+_LOCKFILES = {
+    "package-lock.json",
+    "npm-shrinkwrap.json",
+    "yarn.lock",
+    "pnpm-lock.yaml",
+    "bun.lockb",
+    "poetry.lock",
+    "pipfile.lock",
+    "uv.lock",
+    "pdm.lock",
+    "cargo.lock",
+    "gemfile.lock",
+    "composer.lock",
+    "go.sum",
+    "mix.lock",
+    "pubspec.lock",
+    "podfile.lock",
+    "packages.lock.json",
+    "flake.lock",
+}
+_VENDOR_DIRS = (
+    "vendor/",
+    "node_modules/",
+    "third_party/",
+    "third-party/",
+    "bower_components/",
+)
+_ATTRIBUTES = ("linguist-generated", "linguist-vendored", "diff")
+
+# lines of the file summary shown before the diff
+_SUMMARY_LIMIT = 100
+
+
+# token budget for the staged diff sent to the llm (ASD_DIFF_TOKEN_BUDGET, default 6000)
+def _token_budget() -> int:
+    try:
+        return max(500, int(os.getenv("ASD_DIFF_TOKEN_BUDGET", "6000")))
+    except ValueError:
+        return 6000
+
+
+# one staged file from --numstat and --name-status
+class StagedFile:
+    def __init__(
+        self, path: str, status: str, added: Optional[int], deleted: Optional[int]
+    ):
+        self.path = path
+        self.status = status
+        # None for binary files
+        self.added = added
+        self.deleted = deleted
+        # why the file's hunks are left out entirely, "" when they are candidates
+        self.skip_reason = ""
+        self.header = ""
+        self.hunks: List[str] = []
+        # hunks never kept in memory because the diff was already far over budget
+        self.unread_hunks = 0
+
+    @property
+    def churn(self) -> int:
+        return (self.added or 0) + (self.deleted or 0)
+
+    def describe(self) -> str:
+        if self.added is None:
+            return f"{self.status} {self.path} (binary)"
+        return f"{self.status} {self.path} +{self.added} -{self.deleted}"
+
+
+# the budgeted diff plus the record of what was left out
+class StagedDiff:
+    def __init__(
+        self, text: str, files: List[StagedFile], omitted: List[str], budget: int
+    ):
+        self.text = text
+        self.files = files
+        self.omitted = omitted
+        self.budget = budget
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+def _split_z(output: str) -> Iterator[str]:
+    return iter(output.split("\0"))
+
+
+# --numstat -z: "added\tdeleted\tpath", or "added\tdeleted\t" followed by old and new path for renames
+def _parse_numstat(output: str) -> List[Tuple[str, Optional[int], Optional[int]]]:
+    entries = []
+    records = _split_z(output)
+    for record in records:
+        if not record:
+            continue
+        added, deleted, path = (record.split("\t", 2) + ["", ""])[:3]
+        if not path:
+            next(records, "")
+            path = next(records, "")
+        entries.append(
+            (
+                path,
+                int(added) if added.isdigit() else None,
+                int(deleted) if deleted.isdigit() else None,
+            )
+        )
+    return entries
+
+
+# --name-status -z: status, then one path (two for renames and copies)
+def _parse_name_status(output: str) -> List[str]:
+    statuses = []
+    records = _split_z(output)
+    for record in records:
+        if not record:
+            continue
+        next(records, "")
+        if record[0] in "RC":
+            next(records, "")
+        statuses.append(record[0])
+    return statuses
+
+
+# attribute values for each path from the staged .gitattributes, asked in batches to keep argv short
+def _attributes(paths: List[str]) -> Dict[str, Dict[str, str]]:
+    values: Dict[str, Dict[str, str]] = {}
+    probes = {
+        str(i): (
+            [
+                "git",
+                "check-attr",
+                "-z",
+                "--cached",
+                *_ATTRIBUTES,
+                "--",
+                *paths[i : i + 500],
+            ],
+            10,
+        )
+        for i in range(0, len(paths), 500)
+    }
+    for result in _run_probes(probes).values():
+        if not result["success"]:
+            continue
+        fields = result["stdout"].split("\0")
+        for i in range(0, len(fields) - 2, 3):
+            path, attribute, value = fields[i : i + 3]
+            values.setdefault(path, {})[attribute] = value
+    return values
+
+
+def _skip_reason(file: StagedFile, attributes: Dict[str, str]) -> str:
+    name = file.path.rsplit("/", 1)[-1].lower()
+    if file.added is None or attributes.get("diff") == "unset":
+        return "binary"
+    if name in _LOCKFILES:
+        return "lockfile"
+    if attributes.get("linguist-generated") in ("set", "true"):
+        return "generated"
+    if attributes.get("linguist-vendored") in ("set", "true") or any(
+        file.path.startswith(d) or f"/{d}" in file.path for d in _VENDOR_DIRS
+    ):
+        return "vendored"
+    if file.status == "D":
+        return "deleted"
+    return ""
+
+
+# splitting the streamed patch into per-file headers and hunks
+# git writes files in the same order as --numstat, so sections are matched by position; hunks are
+# only kept while the total stays within a few budgets, anything later could never be chosen
+def _read_hunks(
+    files: List[StagedFile], lines: Iterable[bytes], keep_chars: int
+) -> None:
+    index = -1
+    current: Optional[StagedFile] = None
+    hunk: List[str] = []
+    kept = 0
+
+    def finish() -> None:
+        nonlocal kept
+        if current is None or not hunk:
+            return
+        text = "\n".join(hunk)
+        if kept + len(text) <= keep_chars:
+            current.hunks.append(text)
+            kept += len(text)
+        else:
+            current.unread_hunks += 1
+
+    for raw in lines:
+        line = raw.decode("utf-8", errors="replace")
+        if line.startswith("diff --git "):
+            finish()
+            hunk = []
+            index += 1
+            current = files[index] if index < len(files) else None
+            if current is not None:
+                current.header = line
+            continue
+        if current is None or current.skip_reason:
+            continue
+        if line.startswith("@@"):
+            finish()
+            hunk = [line]
+        elif hunk:
+            hunk.append(line)
+    finish()
+
+
+# changed lines with content, favouring hunks that say a lot for their size
+def _hunk_score(hunk: str) -> float:
+    lines = hunk.split("\n")[1:]
+    meaningful = sum(
+        1 for line in lines if line[:1] in "+-" and line[1:].strip(" \t{}()[];,")
+    )
+    return meaningful / math.sqrt(estimate_tokens(hunk) + 1)
+
+
+# spending the budget round by round: every file offers its most informative remaining hunk, so
+# small files are covered before a big one gets its second hunk
+def _select_hunks(files: List[StagedFile], budget: int) -> Dict[str, List[int]]:
+    remaining = budget
+    queues = {
+        f.path: sorted(range(len(f.hunks)), key=lambda i, f=f: -_hunk_score(f.hunks[i]))
+        for f in files
+        if f.hunks
+    }
+    chosen: Dict[str, List[int]] = {path: [] for path in queues}
+    order = sorted((f for f in files if f.hunks), key=lambda f: f.churn)
+    while any(queues.values()):
+        for file in order:
+            queue = queues[file.path]
+            if not queue:
+                continue
+            i = queue.pop(0)
+            cost = estimate_tokens(file.hunks[i]) + (
+                0 if chosen[file.path] else estimate_tokens(file.header)
+            )
+            if cost <= remaining:
+                chosen[file.path].append(i)
+                remaining -= cost
+    return chosen
+
+
+def _truncate_summary(lines: List[str]) -> List[str]:
+    if len(lines) <= _SUMMARY_LIMIT:
+        return lines
+    return lines[:_SUMMARY_LIMIT] + [
+        f"... and {len(lines) - _SUMMARY_LIMIT} more files"
+    ]
+
+
+# building the staged diff the llm sees: a summary of every staged file, the most informative hunks
+# that fit the token budget, and a list of everything that was left out and why
+def build_staged_diff(budget: Optional[int] = None) -> Optional[StagedDiff]:
+    budget = budget or _token_budget()
+    results = _run_probes(
+        {
+            "numstat": (
+                ["git", "diff", "--staged", "--no-ext-diff", "--numstat", "-z"],
+                30,
+            ),
+            "status": (
+                ["git", "diff", "--staged", "--no-ext-diff", "--name-status", "-z"],
+                30,
+            ),
+        }
+    )
+    if not results["numstat"]["success"] or not results["numstat"]["stdout"]:
+        return None
+
+    numstat = _parse_numstat(results["numstat"]["stdout"])
+    statuses = (
+        _parse_name_status(results["status"]["stdout"])
+        if results["status"]["success"]
+        else []
+    )
+    files = [
+        StagedFile(path, statuses[i] if i < len(statuses) else "M", added, deleted)
+        for i, (path, added, deleted) in enumerate(numstat)
+    ]
+    attributes = _attributes([f.path for f in files])
+    for file in files:
+        file.skip_reason = _skip_reason(file, attributes.get(file.path, {}))
+
+    summary = [f"staged files ({len(files)}):"] + _truncate_summary(
+        [f.describe() for f in files]
+    )
+    body_budget = max(0, budget - estimate_tokens("\n".join(summary)) - 100)
+
+    if any(not f.skip_reason for f in files):
+        stream = GitStream(
+            ["git", "diff", "--staged", "--no-ext-diff", "--no-color"],
+            delimiter=b"\n",
+            env=probe_env(),
+            skip_empty=False,
+        )
+        with stream:
+            _read_hunks(files, stream, keep_chars=body_budget * 4 * 4)
+
+    chosen = _select_hunks(files, body_budget)
+    sections = []
+    omitted = []
+    for file in files:
+        if file.skip_reason:
+            omitted.append(f"{file.describe()}: {file.skip_reason}, not shown")
+            continue
+        picked = sorted(chosen.get(file.path, []))
+        total = len(file.hunks) + file.unread_hunks
+        if picked:
+            sections.append("\n".join([file.header] + [file.hunks[i] for i in picked]))
+        if len(picked) < total:
+            omitted.append(
+                f"{file.describe()}: {total - len(picked)} of {total} hunks over the token budget"
+            )
+
+    parts = ["\n".join(summary)]
+    parts.extend(sections)
+    if omitted:
+        parts.append(
+            "\n".join(["omitted from this diff:"] + _truncate_summary(omitted))
+        )
+    return StagedDiff("\n\n".join(parts), files, omitted, budget)
+
+
+# the budgeted staged diff as text, None when nothing is staged
+def get_budgeted_diff(budget: Optional[int] = None) -> Optional[str]:
+    diff = build_staged_diff(budget)
+    return diff.text if diff is not None else None
+
+
+# the staged diff commit messages are written from; large diffs are summarised chunk by
+# chunk, so the budget is the per-chunk budget times the number of chunks instead of the
+# planner's ASD_DIFF_TOKEN_BUDGET, which would trim a big changeset to a couple of chunks
+def get_commit_diff() -> Optional[str]:
+    return get_budgeted_diff(_commit_chunk_tokens() * _commit_max_chunks())
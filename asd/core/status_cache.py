@@ -0,0 +1,569 @@
+import atexit
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import os
+import select
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from .git_async import load_git_status
+from .git_backend import get_backend, probe_env
+from .git_tools import _sampled_path_fields, run_git_command, status_for_paths
+from .models import GitStatus
+from .repo_meta import find_git_dirs, find_work_tree
+
+# inotify constants from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WORKTREE_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+    | _IN_ONLYDIR
+)
+_GIT_DIR_MASK = (
+    _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_MODIFY | _IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# files in the git dir whose changes can change any field of GitStatus
+_GIT_FILES = {"HEAD", "index", "MERGE_HEAD", "ORIG_HEAD", "packed-refs", "config"}
+# ignore rules: an edit can make any path ignored or un-ignored, so it invalidates everything
+_IGNORE_FILE = ".gitignore"
+_INFO_EXCLUDE = "exclude"
+
+
+# a minimal inotify binding over libc, so watching needs no extra dependency
+class _Inotify:
+    def __init__(self) -> None:
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.fd = fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    # (wd, mask, name) for every event currently queued
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            if not data:
+                return events
+            pos = 0
+            while pos + _EVENT_HEADER.size <= len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+                pos += _EVENT_HEADER.size
+                name = data[pos : pos + length].rstrip(b"\0")
+                pos += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self) -> None:
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+# a GitStatus kept live for the session instead of rebuilt on every request
+# inotify watches the work tree and the git dir from a background thread; edits in the work tree
+# are patched in with a pathspec-limited status, anything touching the index, HEAD or refs
+# triggers a full refresh. without inotify (or past the watch limit) mtime fingerprints decide.
+class StatusCache:
+    def __init__(
+        self,
+        work_tree: str,
+        git_dir: str,
+        common_dir: str,
+        max_incremental: int = 256,
+    ) -> None:
+        self.work_tree = work_tree
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self.max_incremental = max_incremental
+        self.hits = 0
+        self.misses = 0
+        self.incremental = 0
+        self.mode = "inotify"
+
+        self._status: Optional[GitStatus] = None
+        self._fingerprint: Optional[str] = None
+        self._refreshed_at = 0.0
+        # a fingerprint only sees the top of the work tree, so it is trusted this long
+        # (ASD_STATUS_CACHE_MAX_AGE seconds, default 5)
+        self.max_age = _max_age()
+        self._changed: Set[str] = set()
+        self._full_refresh = True
+        self._ignore_changed = False
+        self._excludes_file = _excludes_file()
+        self._ignored = _ignored_dirs(work_tree)
+        # wd -> (kind, directory); kind is "worktree", "git", "refs", "info" or "excludes"
+        self._watches: Dict[int, Tuple[str, str]] = {}
+        self._watched: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._inotify: Optional[_Inotify] = None
+        self._thread: Optional[threading.Thread] = None
+
+        try:
+            self._inotify = _Inotify()
+            self._watch_git_dirs()
+            self._watch_tree(work_tree, "worktree")
+        except (OSError, AttributeError):
+            # no inotify on this platform, or the watch limit (ENOSPC) was hit
+            self._use_fingerprints()
+            return
+
+        self._thread = threading.Thread(
+            target=self._run, name="asd-status-cache", daemon=True
+        )
+        self._thread.start()
+
+    def _use_fingerprints(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._watches.clear()
+        self._watched.clear()
+        self.mode = "fingerprint"
+
+    def _watch_git_dirs(self) -> None:
+        for directory in {self.git_dir, self.common_dir}:
+            wd = self._inotify.add_watch(directory, _GIT_DIR_MASK)
+            self._watches[wd] = ("git", directory)
+        self._watch_tree(os.path.join(self.common_dir, "refs"), "refs")
+        self._watch_dir(os.path.join(self.common_dir, "info"), "info")
+        if self._excludes_file:
+            self._watch_dir(os.path.dirname(self._excludes_file), "excludes")
+
+    # one directory without its subdirectories; a missing one is simply not watched
+    def _watch_dir(self, directory: str, kind: str) -> None:
+        try:
+            wd = self._inotify.add_watch(directory, _GIT_DIR_MASK)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise
+        self._watches[wd] = (kind, directory)
+
+    # every directory under root, except .git and the directories git ignores: build output
+    # and dependency trees would spend the watch limit on paths status never reports
+    def _watch_tree(self, root: str, kind: str) -> None:
+        mask = _WORKTREE_MASK if kind == "worktree" else _GIT_DIR_MASK
+        for dirpath, dirnames, _ in os.walk(root):
+            if kind == "worktree":
+                dirnames[:] = [
+                    d
+                    for d in dirnames
+                    if d != ".git" and os.path.join(dirpath, d) not in self._ignored
+                ]
+                if dirpath in self._watched:
+                    continue
+            try:
+                wd = self._inotify.add_watch(dirpath, mask)
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    continue
+                raise
+            self._watches[wd] = (kind, dirpath)
+            if kind == "worktree":
+                self._watched.add(dirpath)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            inotify = self._inotify
+            if inotify is None:
+                return
+            try:
+                ready, _, _ = select.select([inotify.fd], [], [], 0.5)
+            except (OSError, ValueError):
+                return
+            if ready:
+                with self._lock:
+                    self._drain()
+
+    # apply queued events; called with the lock held
+    def _drain(self) -> None:
+        if self._inotify is None:
+            return
+        try:
+            events = self._inotify.read_events()
+        except OSError:
+            self._full_refresh = True
+            return
+
+        for wd, mask, name in events:
+            if mask & _IN_Q_OVERFLOW:
+                self._full_refresh = True
+                continue
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            if mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+                self._watched.discard(watch[1])
+                continue
+            kind, directory = watch
+
+            if kind == "info":
+                if name == _INFO_EXCLUDE:
+                    self._ignore_rules_changed()
+                continue
+            if kind == "excludes":
+                if os.path.join(directory, name) == self._excludes_file:
+                    self._ignore_rules_changed()
+                continue
+            if kind == "git":
+                if name in _GIT_FILES:
+                    self._full_refresh = True
+                continue
+            if kind == "refs":
+                self._full_refresh = True
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._add_tree(os.path.join(directory, name), "refs")
+                continue
+
+            if name == ".git":
+                continue
+            if name == _IGNORE_FILE:
+                self._ignore_rules_changed()
+                continue
+            path = os.path.join(directory, name) if name else directory
+            rel = os.path.relpath(path, self.work_tree)
+            if rel == ".":
+                self._full_refresh = True
+                continue
+            self._changed.add(rel.replace(os.sep, "/"))
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                # a fresh node_modules or build directory is ignored and stays unwatched
+                if _is_ignored(self.work_tree, rel):
+                    self._ignored.add(path)
+                else:
+                    self._add_tree(path, "worktree")
+
+    # any path may have become ignored or un-ignored: the next get rebuilds the status and
+    # the set of watched directories
+    def _ignore_rules_changed(self) -> None:
+        self._full_refresh = True
+        self._ignore_changed = True
+
+    # watching directories the new rules un-ignore; watches on newly ignored ones stay,
+    # their events only cost a pathspec status that reports nothing
+    def _rewatch(self) -> None:
+        self._ignore_changed = False
+        self._ignored = _ignored_dirs(self.work_tree)
+        if self._inotify is not None:
+            self._add_tree(self.work_tree, "worktree")
+
+    def _add_tree(self, path: str, kind: str) -> None:
+        try:
+            self._watch_tree(path, kind)
+        except OSError:
+            # out of watches: stop trusting inotify for the rest of the session
+            self._use_fingerprints()
+            self._full_refresh = True
+
+    # a digest of what can be checked without walking the work tree: the index, HEAD and
+    # the other git dir files, the refs, the ignore rules and the entries at the top of the
+    # work tree (a directory's mtime moves when something is added to or removed from it)
+    # edits deeper down are caught by max_age instead
+    def _take_fingerprint(self) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+
+        def add(path: str) -> None:
+            try:
+                st = os.lstat(path)
+            except OSError:
+                return
+            digest.update(
+                f"{path}:{st.st_mtime_ns}:{st.st_size};".encode(
+                    "utf-8", errors="surrogateescape"
+                )
+            )
+
+        for name in sorted(_GIT_FILES):
+            for directory in sorted({self.git_dir, self.common_dir}):
+                add(os.path.join(directory, name))
+        add(os.path.join(self.common_dir, "info", _INFO_EXCLUDE))
+        if self._excludes_file:
+            add(self._excludes_file)
+        for dirpath, dirnames, filenames in os.walk(
+            os.path.join(self.common_dir, "refs")
+        ):
+            dirnames.sort()
+            for name in sorted(filenames):
+                add(os.path.join(dirpath, name))
+        add(self.work_tree)
+        try:
+            names = sorted(os.listdir(self.work_tree))
+        except OSError:
+            names = []
+        for name in names:
+            path = os.path.join(self.work_tree, name)
+            if name != ".git" and path not in self._ignored:
+                add(path)
+        return digest.hexdigest()
+
+    def get(self) -> GitStatus:
+        with self._lock:
+            self._drain()
+
+            if self.mode == "fingerprint":
+                fingerprint = self._take_fingerprint()
+                fresh = time.monotonic() - self._refreshed_at < self.max_age
+                if (
+                    self._status is not None
+                    and fresh
+                    and fingerprint == self._fingerprint
+                ):
+                    self.hits += 1
+                    return self._status.copy(deep=True)
+                self._fingerprint = fingerprint
+                return self._refresh()
+
+            if (
+                self._status is not None
+                and not self._full_refresh
+                and not self._changed
+            ):
+                self.hits += 1
+                return self._status.copy(deep=True)
+
+            if (
+                self._status is None
+                or self._full_refresh
+                or len(self._changed) > self.max_incremental
+            ):
+                return self._refresh()
+            return self._patch()
+
+    def _refresh(self) -> GitStatus:
+        # flags are cleared first so events that arrive during the refresh are kept
+        self._full_refresh = False
+        self._changed.clear()
+        if self._ignore_changed:
+            self._rewatch()
+        self.misses += 1
+        self._status = load_git_status()
+        self._refreshed_at = time.monotonic()
+        return self._status.copy(deep=True)
+
+    # re-asking git only about the paths that changed and patching modified and untracked
+    # staged files cannot change without an index write, which forces a full refresh instead
+    def _patch(self) -> GitStatus:
+        status = self._status
+        # a sampled status cannot be patched without losing the exact counts
+        if status.paths_truncated:
+            return self._refresh()
+        changed = sorted(self._changed)
+        self._changed.clear()
+
+        pathspecs = set(changed)
+        # an untracked directory is listed as "dir/", so ask about the whole directory again
+        for entry in status.untracked:
+            if entry.endswith("/") and any(p.startswith(entry) for p in changed):
+                pathspecs.add(entry.rstrip("/"))
+
+        fields = status_for_paths(sorted(pathspecs))
+        if fields is None:
+            return self._refresh()
+
+        def covered(path: str) -> bool:
+            path = path.rstrip("/")
+            return any(
+                path == spec or path.startswith(spec + "/") for spec in pathspecs
+            )
+
+        modified = [p for p in status.modified if not covered(p)] + fields["modified"]
+        untracked = [
+            p for p in status.untracked if not covered(p)
+        ] + _collapse_untracked(fields["untracked"], status.staged)
+        modified = sorted(set(modified))
+        untracked = sorted(set(untracked))
+        # sampled like a full collection, so a patched status that outgrew ASD_STATUS_SAMPLE
+        # says its lists are partial instead of passing as complete
+        paths = _sampled_path_fields(status.staged, modified, untracked)
+        self._status = status.copy(
+            update={**paths, "uncommitted_changes": status.staged_count + len(modified)}
+        )
+        self.incremental += 1
+        return self._status.copy(deep=True)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "incremental": self.incremental,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+
+def _max_age() -> float:
+    try:
+        return max(0.0, float(os.getenv("ASD_STATUS_CACHE_MAX_AGE", "5")))
+    except ValueError:
+        return 5.0
+
+
+# the effective core.excludesFile, or git's default of $XDG_CONFIG_HOME/git/ignore
+def _excludes_file() -> Optional[str]:
+    result = run_git_command(
+        ["git", "config", "--path", "--get", "core.excludesFile"],
+        suppress_errors=True,
+        env=probe_env(),
+        timeout=10,
+    )
+    if result["success"] and result["stdout"].strip():
+        return os.path.abspath(os.path.expanduser(result["stdout"].strip()))
+    base = os.getenv("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return os.path.join(base, "git", "ignore")
+
+
+# absolute paths of the directories git ignores as a whole, from one ls-files call
+# (--directory stops at the top-most ignored directory instead of listing its contents)
+def _ignored_dirs(work_tree: str) -> Set[str]:
+    result = run_git_command(
+        [
+            "git",
+            "-C",
+            work_tree,
+            "ls-files",
+            "--others",
+            "--ignored",
+            "--exclude-standard",
+            "--directory",
+            "-z",
+        ],
+        suppress_errors=True,
+        env=probe_env(),
+        timeout=30,
+    )
+    if not result["success"]:
+        return set()
+    return {
+        os.path.join(work_tree, entry.rstrip("/"))
+        for entry in result["stdout"].split("\0")
+        if entry.endswith("/")
+    }
+
+
+def _is_ignored(work_tree: str, rel: str) -> bool:
+    result = run_git_command(
+        ["git", "-C", work_tree, "check-ignore", "-q", "--", rel],
+        suppress_errors=True,
+        env=probe_env(),
+        timeout=10,
+    )
+    return result["returncode"] == 0
+
+
+# a full status lists a wholly untracked directory as "dir/", but a status limited to a path
+# inside it lists the file itself; fold such files up to their top-most untracked directory.
+# a directory counts as tracked when HEAD has it or something under it is staged
+def _collapse_untracked(paths: List[str], staged: List[str]) -> List[str]:
+    backend = get_backend()
+    tracked_dirs: Dict[str, bool] = {}
+
+    def is_tracked(directory: str) -> bool:
+        if directory not in tracked_dirs:
+            prefix = directory + "/"
+            tracked_dirs[directory] = any(p.startswith(prefix) for p in staged) or (
+                backend.object_info(f"HEAD:{directory}") is not None
+            )
+        return tracked_dirs[directory]
+
+    collapsed = []
+    for path in paths:
+        parts = path.rstrip("/").split("/")
+        for depth in range(1, len(parts)):
+            directory = "/".join(parts[:depth])
+            if not is_tracked(directory):
+                path = directory + "/"
+                break
+        collapsed.append(path)
+    return collapsed
+
+
+_cache: Optional[StatusCache] = None
+_cache_lock = threading.Lock()
+
+
+# the status cache for the repository around the working directory, None outside a repository
+def get_status_cache() -> Optional[StatusCache]:
+    global _cache
+    dirs = find_git_dirs()
+    work_tree = find_work_tree()
+    if dirs is None or work_tree is None:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.work_tree != work_tree:
+            if _cache is not None:
+                _cache.close()
+            _cache = StatusCache(work_tree, dirs[0], dirs[1])
+        return _cache
+
+
+# what the analyze step calls; ASD_STATUS_CACHE=0 rebuilds the status on every request
+def get_cached_git_status() -> GitStatus:
+    if os.getenv("ASD_STATUS_CACHE", "1") == "0":
+        return load_git_status()
+    cache = get_status_cache()
+    return cache.get() if cache is not None else load_git_status()
+
+
+def status_cache_stats() -> Optional[Dict[str, object]]:
+    return _cache.stats() if _cache is not None else None
+
+
+def close_status_cache() -> None:
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+
+
+atexit.register(close_status_cache)
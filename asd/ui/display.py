@@ -1,11 +1,16 @@
+from typing import Optional
+
 from rich import box
 from rich.console import Console
+from rich.live import Live
 from rich.panel import Panel
 from rich.rule import Rule
 from rich.table import Table
 from rich_gradient import Gradient
 
-from ..core.costs import fmt_usd, session_usage_snapshot
+from ..core.costs import fmt_usd, plan_latency_snapshot, session_usage_snapshot
+from ..core.plan_cache import plan_cache_stats
+from ..core.status_cache import status_cache_stats
 from .themes import THEME
 
 console = Console(theme=THEME)
@@ -64,9 +69,9 @@ def display_git_status(status):
 
     rows = [
         ("branch", status.current_branch or "none"),
-        ("staged", str(len(status.staged))),
-        ("modified", str(len(status.modified))),
-        ("untracked", str(len(status.untracked))),
+        ("staged", str(status.staged_count)),
+        ("modified", str(status.modified_count)),
+        ("untracked", str(status.untracked_count)),
     ]
 
     if status.has_remote:
@@ -97,23 +102,25 @@ def display_git_status(status):
     console.print()
 
 
-def display_execution_plan(plan):
-    section_rule("plan")
+def _step_lines(i: int, step) -> list[str]:
+    icon = {"safe": "+", "caution": "!", "risky": "!", "dangerous": "x"}.get(
+        step.safety_level.lower(), "+"
+    )
+    lines = [
+        f"[accent]{icon} {i}.[/accent] [command]{step.command}[/]",
+        f"  {step.description}",
+    ]
+    if step.safety_level.lower() in {"risky", "dangerous"} and step.potential_issues:
+        lines.append(f"  [warning]! {step.potential_issues[0]}[/warning]")
+    return lines
 
+
+def _plan_lines(plan) -> list[str]:
     lines = [
         f"[{plan.overall_safety.lower()}]safety: {plan.overall_safety.lower()}[/{plan.overall_safety.lower()}]"
     ]
     for i, step in enumerate(plan.steps, 1):
-        icon = {"safe": "+", "caution": "!", "risky": "!", "dangerous": "x"}.get(
-            step.safety_level.lower(), "+"
-        )
-        lines.append(f"[accent]{icon} {i}.[/accent] [command]{step.command}[/]")
-        lines.append(f"  {step.description}")
-        if (
-            step.safety_level.lower() in {"risky", "dangerous"}
-            and step.potential_issues
-        ):
-            lines.append(f"  [warning]! {step.potential_issues[0]}[/warning]")
+        lines.extend(_step_lines(i, step))
 
     if plan.warnings:
         w = plan.warnings[0]
@@ -123,20 +130,75 @@ def display_execution_plan(plan):
             lines.append(f"  [info]> {w.safer_alternatives[0]}[/info]")
 
     lines.append("")
+    return lines
 
-    console.print(
-        Panel(
-            "\n".join(lines),
-            # subtitle=f"[info]{plan.summary}[/info]",
-            box=box.MINIMAL,
-            border_style="accent",
-            style=f"on {PLAN_BG}",
-            padding=(0, 1, 1, 1),
-        )
+
+def _plan_panel(lines: list[str]) -> Panel:
+    return Panel(
+        "\n".join(lines),
+        # subtitle=f"[info]{plan.summary}[/info]",
+        box=box.MINIMAL,
+        border_style="accent",
+        style=f"on {PLAN_BG}",
+        padding=(0, 1, 1, 1),
     )
+
+
+def display_execution_plan(plan):
+    section_rule("plan")
+    console.print(_plan_panel(_plan_lines(plan)))
     console.print()
 
 
+# the plan panel filled in step by step while the plan streams
+# it opens on the first step (stopping the loader and showing the status first); finish swaps
+# in the validated plan, so what stays on screen is exactly what display_execution_plan shows
+class StreamingPlanView:
+    def __init__(self, status, on_open=None):
+        self.status = status
+        self.on_open = on_open
+        self.lines: list[str] = []
+        self.steps = 0
+        self._live: Optional[Live] = None
+
+    @property
+    def opened(self) -> bool:
+        return self._live is not None
+
+    def add_step(self, step) -> None:
+        if self._live is None:
+            if self.on_open is not None:
+                self.on_open()
+            console.print()
+            display_git_status(self.status)
+            section_rule("plan")
+            self._live = Live(
+                _plan_panel(["[caption]planning...[/caption]"]),
+                console=console,
+                refresh_per_second=16,
+            )
+            self._live.start()
+        self.steps += 1
+        self.lines.extend(_step_lines(self.steps, step))
+        self._live.update(
+            _plan_panel(self.lines + ["[caption]planning...[/caption]"]), refresh=True
+        )
+
+    def finish(self, plan) -> None:
+        if self._live is None:
+            return
+        self._live.update(_plan_panel(_plan_lines(plan)), refresh=True)
+        self.close()
+        console.print()
+
+    def close(self) -> None:
+        if self._live is not None:
+            try:
+                self._live.stop()
+            finally:
+                self._live = None
+
+
 def display_recovery_comparison(original_plan, recovery_plan, failure_reason):
     section_rule("recovery", variant="error")
     console.print(f"[failure] failure analysis: {failure_reason}[/failure]\n")
@@ -234,6 +296,26 @@ def display_nerd_stats():
 
     section_rule("nerd stats")
 
+    cache = status_cache_stats()
+    if cache:
+        console.print(
+            f"[caption]status cache ({cache['mode']}): {cache['hits']} hits, "
+            f"{cache['incremental']} incremental, {cache['misses']} misses[/caption]"
+        )
+
+    plans = plan_cache_stats()
+    if plans:
+        console.print(
+            f"[caption]plan cache: {plans['hits']} hits, {plans['misses']} misses, "
+            f"{plans['entries']} stored[/caption]"
+        )
+
+    for mode, t in plan_latency_snapshot().items():
+        console.print(
+            f"[caption]time to plan ({mode}): {t['avg']:.2f}s avg over {int(t['runs'])} "
+            f"runs, last {t['last']:.2f}s[/caption]"
+        )
+
     if not grand or int(grand.get("calls", 0)) == 0:
         console.print("[caption]no llm usage yet[/caption]\n")
         return
@@ -268,4 +350,14 @@ def display_nerd_stats():
         )
 
     console.print(tbl)
+
+    # share of input tokens the providers served from their prompt cache, and what it saved
+    prompt_tokens = int(grand.get("prompt_tokens", 0))
+    if prompt_tokens:
+        cached_tokens = int(grand.get("cached_tokens", 0))
+        console.print(
+            f"[caption]prompt cache: {cached_tokens / prompt_tokens:.0%} of "
+            f"{prompt_tokens:,} input tokens cached, "
+            f"saved {fmt_usd(float(grand.get('saved', 0.0)))}[/caption]"
+        )
     console.print()
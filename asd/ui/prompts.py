@@ -6,6 +6,7 @@ from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Confirm, Prompt
 
+from ..core.llm import invalidate_llm_clients
 from .themes import SYMBOLS, THEME
 
 console = Console(theme=THEME)
@@ -120,10 +121,13 @@ def select_model():
     ).ask()
 
     sel = selected_display.split(" ")[0]
+    # with both keys set the menu choice decides the provider, not the key order
+    os.environ["ASD_PROVIDER"] = provider
     if provider == "openai":
         os.environ["OPENAI_MODEL"] = sel
     else:
         os.environ["GOOGLE_MODEL"] = sel
+    invalidate_llm_clients()
 
     console.print(f"» model set to {sel}\n")
 